@@ -0,0 +1,510 @@
+import argparse
+import json
+import random
+import sys
+import time
+import tracemalloc
+
+import arcade
+
+import dead_knight
+
+
+def make_walls(map_size, density=0.3, seed=1):
+    """
+    Build a square test map of static wall sprites.
+    
+    The map has a solid border and random interior walls, with an 
+    open room in the middle for the player to move around in.
+    
+    Args:
+        map_size (int): Map width and height in tiles
+        density (float): Chance of an interior tile being a wall
+        seed (int): Random seed so every run uses the same map
+        
+    Returns:
+        list: Wall sprites
+    """
+    
+    rng = random.Random(seed)
+    tile_size = 32 * dead_knight.TILE_SCALING
+    texture = arcade.make_soft_square_texture(32, arcade.color.GRAY)
+    centre = map_size // 2
+    
+    walls = []
+    for row in range(map_size):
+        for column in range(map_size):
+            border = row in (0, map_size - 1) or \
+                column in (0, map_size - 1)
+            in_room = abs(row - centre) <= 4 and abs(column - centre) <= 4
+            
+            if border or (not in_room and rng.random() < density):
+                wall = arcade.Sprite(texture, dead_knight.TILE_SCALING)
+                wall.center_x = (column + 0.5) * tile_size
+                wall.center_y = (row + 0.5) * tile_size
+                walls.append(wall)
+                
+    return walls
+
+
+def time_physics(map_size, walls, hashed, frames):
+    """
+    Time PhysicsEngineSimple.update while the player walks in a loop.
+    
+    Args:
+        map_size (int): Map width and height in tiles
+        walls (list): Wall sprites
+        hashed (bool): Use the spatially hashed static collision list
+        frames (int): Number of updates to time
+        
+    Returns:
+        float: Mean milliseconds per update
+    """
+    
+    if hashed:
+        collision_list = dead_knight.build_static_collision([walls])
+    else:
+        collision_list = arcade.SpriteList(lazy=True)
+        collision_list.extend(walls)
+
+    tile_size = 32 * dead_knight.TILE_SCALING
+    player = arcade.SpriteSolidColor(40, 60, color=arcade.color.WHITE)
+    player.center_x = player.center_y = map_size / 2 * tile_size
+    engine = arcade.PhysicsEngineSimple(player, collision_list)
+    
+    # Walk a square so the player keeps bumping into the room walls
+    moves = [(5.5, 0), (0, 5.5), (-5.5, 0), (0, -5.5)]
+    
+    start = time.perf_counter()
+    for frame in range(frames):
+        player.change_x, player.change_y = moves[(frame // 60) % 4]
+        engine.update()
+        
+    return (time.perf_counter() - start) / frames * 1000
+
+
+def bench_collision(args):
+    """
+    Compare per-frame collision cost against wall count.
+    
+    Large unhashed sprite lists are checked on the GPU by arcade, so 
+    a hidden window is opened to give them an OpenGL context.
+    """
+    
+    arcade.Window(64, 64, "Dead Knight benchmark", visible=False)
+    
+    print(f"{'map':>9} {'walls':>7} {'unhashed ms':>12} {'hashed ms':>10}")
+    
+    for map_size in args.sizes:
+        walls = make_walls(map_size)
+        unhashed = time_physics(map_size, walls, False, args.frames)
+        hashed = time_physics(map_size, walls, True, args.frames)
+        print(f"{map_size:>4}x{map_size:<4} {len(walls):>7} "
+              f"{unhashed:>12.3f} {hashed:>10.3f}")
+
+
+def time_calls(call, count):
+    """
+    Time a callable run count times.
+    
+    Args:
+        call (callable): Called with the run index
+        count (int): Number of runs
+        
+    Returns:
+        list: Milliseconds taken by each run
+    """
+    
+    times = []
+    for index in range(count):
+        start = time.perf_counter()
+        call(index)
+        times.append((time.perf_counter() - start) * 1000)
+        
+    return times
+
+
+def peak_memory(call, count):
+    """
+    Measure the peak memory allocated while running a callable.
+    
+    Kept apart from time_calls since tracing allocations slows every 
+    call down.
+    
+    Args:
+        call (callable): Called with the run index
+        count (int): Number of runs
+        
+    Returns:
+        float: Peak traced memory in KiB
+    """
+    
+    tracemalloc.start()
+    try:
+        for index in range(count):
+            call(index)
+        return tracemalloc.get_traced_memory()[1] / 1024
+    finally:
+        tracemalloc.stop()
+
+
+def summarize(times, memory):
+    """
+    Reduce per-run times to the statistics that get reported.
+    
+    Args:
+        times (list): Milliseconds per run
+        memory (float): Peak memory in KiB
+        
+    Returns:
+        dict: Run count, mean, p50, p90, p99, max and memory
+    """
+    
+    ordered = sorted(times)
+    return {
+        "runs": len(times),
+        "mean": sum(times) / len(times),
+        "p50": dead_knight.percentile(ordered, 50),
+        "p90": dead_knight.percentile(ordered, 90),
+        "p99": dead_knight.percentile(ordered, 99),
+        "max": ordered[-1],
+        "memory_kib": memory
+    }
+
+
+def suite_cases(game, args):
+    """
+    List the hot paths measured by the suite.
+    
+    Each case sets up its own state and returns a callable for one 
+    run plus the number of runs.
+    
+    Args:
+        game (dead_knight.HeadlessGame): Game to measure against
+        args (argparse.Namespace): Parsed command line
+        
+    Returns:
+        list: (name, setup) pairs, where setup() returns 
+        (call, count)
+    """
+    
+    player = game.player
+    delta_time = dead_knight.FIXED_TIMESTEP
+    
+    def load_level(level_number):
+        def setup():
+            # Drop any preloaded copy so every run loads the level
+            map_path = game._level_map_path(level_number)
+            
+            def call(index):
+                game.level_preloader.take(map_path)
+                game.load_level(level_number)
+                
+            return call, args.repeats
+        return setup
+    
+    def prepare_level(level_number, streamed):
+        def setup():
+            map_path = game._level_map_path(level_number)
+            return lambda index: dead_knight.prepare_level(
+                map_path, streamed
+            ), args.repeats
+        return setup
+    
+    def load_textures():
+        def call(index):
+            # Start cold so every run decodes the frames again
+            dead_knight.TEXTURE_CACHE.clear()
+            player._load_textures()
+            
+        return call, args.repeats
+    
+    def physics():
+        game.load_level(1)
+        engine = game.physics_engine
+        moves = [(5.5, 0), (0, 5.5), (-5.5, 0), (0, -5.5)]
+        
+        def call(index):
+            player.change_x, player.change_y = moves[(index // 60) % 4]
+            engine.update()
+            
+        return call, args.ticks
+    
+    def trap_systems():
+        game.load_level(1)
+        return lambda index: game.update_trap_systems(delta_time), \
+            args.ticks
+    
+    def character_animation():
+        game.load_level(1)
+        moves = [(0, 0), (5.5, 0), (0, 5.5), (-5.5, 0), (0, -5.5)]
+        
+        def call(index):
+            player.change_x, player.change_y = moves[(index // 120) % 5]
+            player.character_animation(delta_time)
+            
+        return call, args.ticks
+    
+    def enemies():
+        game.load_level(1)
+        swarm = game.enemies
+        
+        # A grid of skeletons around the start, inside and outside sight
+        for i in range(args.enemies):
+            swarm.spawn(
+                "skeleton1",
+                player.center_x + (i % 20 - 10) * 40,
+                player.center_y + (i // 20 - 5) * 40
+            )
+        game.flow_field = dead_knight.FlowField(game.tile_grid)
+            
+        def call(index):
+            game.flow_field.update(player.center_x, player.center_y)
+            swarm.update(delta_time, player, game.tile_grid, 
+                         game.flow_field)
+            
+        return call, args.ticks
+    
+    def player_attack():
+        game.load_level(1)
+        
+        for i in range(args.enemies):
+            game.enemies.spawn(
+                "skeleton1",
+                player.center_x + (i % 20 - 10) * 40,
+                player.center_y + (i // 20 - 5) * 40
+            )
+        
+        # Land a fresh blow every run, spinning round all directions
+        def call(index):
+            player.facing_direction = index % 4
+            player._start_attack(index % 2)
+            game.clock.advance(dead_knight.ATTACK_DURATION / 2)
+            game.update_player_attack()
+            
+        return call, args.ticks
+    
+    cases = [
+        (f"load_level[{level}]", load_level(level))
+        for level in range(1, dead_knight.MAX_LEVEL + 1)
+    ]
+    cases += [
+        (f"prepare_level[{level},{mode}]", prepare_level(level, streamed))
+        for level in range(1, dead_knight.MAX_LEVEL + 1)
+        for mode, streamed in (("eager", False), ("streamed", True))
+    ]
+    cases += [
+        ("_load_textures", load_textures),
+        ("physics_engine.update", physics),
+        ("update_trap_systems", trap_systems),
+        ("character_animation", character_animation),
+        (f"enemies[{args.enemies}]", enemies),
+        (f"update_player_attack[{args.enemies}]", player_attack)
+    ]
+    
+    return cases
+
+
+def grid_hits(game, layers):
+    """
+    Find the damaging traps touching the player through the tile grid.
+    
+    Args:
+        game (dead_knight.HeadlessGame): Game to test against
+        layers (list): Names of the damaging trap layers
+        
+    Returns:
+        set: Trap sprites hurting the player
+    """
+    
+    scheduler = game.trap_scheduler
+    touching = set()
+    for name in layers:
+        touching.update(scheduler.damaging_sprites(
+            game.tile_grid.collisions(name, game.player)
+        ))
+    return touching
+
+
+def bench_hazards(args):
+    """
+    Check the NumPy hazard index against the tile grid, tick by tick.
+    
+    Each level's traps are stepped through two full cycles while the 
+    player is moved from trap to trap. As in update_trap_systems, hits
+    are only tested on ticks where some trap layer is damaging, and 
+    both paths must find the same traps. Exits with status 1 on any 
+    mismatch.
+    """
+    
+    if dead_knight.np is None:
+        print("NumPy is not installed, the hazard index is unused")
+        return
+    
+    game = dead_knight.HeadlessGame()
+    player = game.player
+    delta_time = dead_knight.FIXED_TIMESTEP
+    mismatches = 0
+    
+    print(f"{'level':<8}{'checks':>8}{'mismatches':>12}"
+          f"{'index us':>10}{'grid us':>10}")
+    
+    for level in range(1, dead_knight.MAX_LEVEL + 1):
+        game.load_level(level)
+        scheduler = game.trap_scheduler
+        
+        # Wait for the next level's preload so its thread does not 
+        # compete with the timed calls
+        game.level_preloader.take(game._level_map_path(level + 1))
+        index = dead_knight.HazardIndex(scheduler)
+        traps = index.sprites
+        if not traps:
+            continue
+        
+        cycle = max(table.cycle + table.offset 
+                    for table, _ in scheduler.layers.values())
+        checks = level_mismatches = 0
+        index_time = grid_time = 0.0
+        
+        for tick in range(int(2 * cycle / delta_time) + 1):
+            player.position = traps[tick // args.dwell % len(traps)]\
+                .position
+            scheduler.update(delta_time)
+            
+            layers = [name for name in scheduler.layers 
+                      if scheduler.layer_damaging(name)]
+            if not layers:
+                continue
+            
+            start = time.perf_counter()
+            found = set(index.hits([player])[0])
+            index_time += time.perf_counter() - start
+            
+            start = time.perf_counter()
+            expected = grid_hits(game, layers)
+            grid_time += time.perf_counter() - start
+            
+            checks += 1
+            if found != expected:
+                level_mismatches += 1
+                
+        mismatches += level_mismatches
+        print(f"{level:<8}{checks:>8}{level_mismatches:>12}"
+              f"{index_time / max(checks, 1) * 1e6:>10.2f}"
+              f"{grid_time / max(checks, 1) * 1e6:>10.2f}")
+    
+    game.close()
+    
+    if mismatches:
+        sys.exit(1)
+
+
+def compare_to_baseline(results, baseline, tolerance, min_delta):
+    """
+    Find benchmarks that got slower than the stored baseline.
+    
+    Args:
+        results (dict): Name -> statistics from this run
+        baseline (dict): Name -> statistics from the baseline
+        tolerance (float): Allowed slowdown, 0.2 meaning 20%
+        min_delta (float): Smallest slowdown in ms worth flagging, 
+            so timer noise on very fast calls is ignored
+        
+    Returns:
+        list: (name, baseline p50, current p50) for each regression
+    """
+    
+    regressions = []
+    for name, stats in results.items():
+        if name not in baseline:
+            continue
+        
+        before = baseline[name]["p50"]
+        slower = stats["p50"] - before
+        if slower > before * tolerance and slower > min_delta:
+            regressions.append((name, before, stats["p50"]))
+            
+    return regressions
+
+
+def bench_suite(args):
+    """
+    Time level loading, texture loading, physics, traps and animation.
+    
+    Runs headlessly on a HeadlessGame. Results can be saved as a 
+    baseline and later runs compared against it, exiting with status
+    1 when any median has regressed beyond the tolerance.
+    """
+    
+    game = dead_knight.HeadlessGame()
+    
+    results = {}
+    print(f"{'benchmark':<28}{'runs':>7}{'mean ms':>10}{'p50 ms':>10}"
+          f"{'p90 ms':>10}{'p99 ms':>10}{'peak KiB':>11}")
+    
+    for name, setup in suite_cases(game, args):
+        call, count = setup()
+        times = time_calls(call, count)
+        memory = peak_memory(call, min(count, args.repeats))
+        
+        stats = results[name] = summarize(times, memory)
+        print(f"{name:<28}{stats['runs']:>7}{stats['mean']:>10.4f}"
+              f"{stats['p50']:>10.4f}{stats['p90']:>10.4f}"
+              f"{stats['p99']:>10.4f}{stats['memory_kib']:>11.1f}")
+    
+    game.close()
+    
+    if args.save_baseline:
+        with open(args.baseline, "w") as f:
+            json.dump(results, f, indent=2)
+        print(f"Baseline written to {args.baseline}")
+        return
+    
+    try:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+    except FileNotFoundError:
+        return
+    
+    regressions = compare_to_baseline(
+        results, baseline, args.tolerance, args.min_delta
+    )
+    for name, before, after in regressions:
+        print(f"REGRESSION {name}: p50 {before:.4f} ms -> {after:.4f} ms")
+    if regressions:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Dead Knight benchmarks")
+    commands = parser.add_subparsers(dest="command", required=True)
+    
+    collision = commands.add_parser(
+        "collision", help="per-frame collision cost versus wall count"
+    )
+    collision.add_argument("--sizes", type=int, nargs="+", 
+                           default=[64, 128, 256])
+    collision.add_argument("--frames", type=int, default=300)
+    collision.set_defaults(run=bench_collision)
+    
+    suite = commands.add_parser(
+        "suite", help="hot path timings compared against a baseline"
+    )
+    suite.add_argument("--ticks", type=int, default=10000)
+    suite.add_argument("--repeats", type=int, default=5)
+    suite.add_argument("--enemies", type=int, default=200)
+    suite.add_argument("--baseline", default="benchmark_baseline.json")
+    suite.add_argument("--save-baseline", action="store_true")
+    suite.add_argument("--tolerance", type=float, default=0.2)
+    suite.add_argument("--min-delta", type=float, default=0.005)
+    suite.set_defaults(run=bench_suite)
+    
+    hazards = commands.add_parser(
+        "hazards", help="check the hazard index against the tile grid"
+    )
+    hazards.add_argument("--dwell", type=int, default=7,
+                         help="ticks the player stays on each trap")
+    hazards.set_defaults(run=bench_hazards)
+    
+    args = parser.parse_args()
+    args.run(args)
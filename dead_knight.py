@@ -1,7 +1,31 @@
 import arcade
+import argparse
+import csv
+import hashlib
+import heapq
+import json
+import math
 import os
-import time
+import pytiled_parser
+import struct
 import sys
+import threading
+import time
+import xml.etree.ElementTree as ElementTree
+
+from array import array
+from bisect import bisect_right
+from collections import OrderedDict, deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from itertools import product, repeat
+from operator import attrgetter
+from PIL import Image
+
+# NumPy is optional and only speeds up hazard hit tests
+try:
+    import numpy as np
+except ImportError:
+    np = None
 
 
 # GLOBAL CONSTANTS
@@ -14,6 +38,8 @@ PLAYER_DASH_BOOST = 15.0
 TILE_SCALING = 1.5
 CHARACTER_SCALING = 2
 UPDATES_PER_FRAME = 5
+FIXED_TIMESTEP = 1 / 60
+MAX_STEPS_PER_FRAME = 5
 MAX_LEVEL = 3
 KEY_COUNT = 6
 
@@ -32,6 +58,864 @@ DIRECTION_RIGHT = 3
 # Character frame constants
 HEAL_FRAMES = 12
 IDLE_WALK_RUN_DEATH_FRAMES = 7
+HURT_FRAMES = 4
+ATTACK_FRAMES = 8
+
+# Slack when comparing simulated times against animation frame ends, 
+# so a frame ending on a tick is not held one tick too long by float 
+# rounding
+ANIMATION_TIME_EPSILON = 1e-6
+
+# Knight animation clips and the number of frames used from each
+KNIGHT_ANIMATIONS = {
+    "heal": HEAL_FRAMES,
+    "idle": IDLE_WALK_RUN_DEATH_FRAMES,
+    "run": IDLE_WALK_RUN_DEATH_FRAMES,
+    "dash": IDLE_WALK_RUN_DEATH_FRAMES,
+    "death": IDLE_WALK_RUN_DEATH_FRAMES,
+    "hurt": HURT_FRAMES,
+    "attack": ATTACK_FRAMES,
+    "attack2_": ATTACK_FRAMES
+}
+
+# Knight animation states, highest priority first. The first state 
+# whose flag attribute is set plays, the last has no flag and plays 
+# otherwise. clips holds one clip per value of the variant attribute,
+# start names the attribute holding when the state began and lasts an
+# optional attribute capping how long it runs. faces picks the 
+# direction the frames are drawn for, tracks_facing turns the knight 
+# towards its movement first and cooldowns are timers that run down 
+# while the state plays. When the clip ends, on_end is called, or the
+# flag is cleared if there is none
+KNIGHT_STATES = (
+    {"name": "death", "flag": "is_dead", "clips": ("death",), 
+     "start": "death_start_time", "on_end": "_finish_death"},
+    {"name": "heal", "flag": "is_healing", "clips": ("heal",),
+     "start": "heal_start_time", 
+     "cooldowns": ("heal_cooldown", "dash_cooldown")},
+    {"name": "drink", "flag": "is_drinking", "clips": ("drink",),
+     "start": "drink_start_time", 
+     "cooldowns": ("heal_cooldown", "dash_cooldown")},
+    {"name": "hurt", "flag": "is_hurt", "clips": ("hurt",),
+     "start": "hurt_start_time", 
+     "cooldowns": ("heal_cooldown", "dash_cooldown")},
+    {"name": "attack", "flag": "is_attacking", 
+     "clips": ("attack", "attack2_"), "variant": "attack_combo",
+     "start": "attack_start_time", "on_end": "_finish_attack",
+     "cooldowns": ("heal_cooldown", "dash_cooldown")},
+    {"name": "dash", "flag": "is_dashing", "clips": ("dash",),
+     "start": "dash_start_time", "lasts": "dash_duration",
+     "tracks_facing": True, "on_end": "_finish_dash",
+     "cooldowns": ("heal_cooldown", "dash_cooldown")},
+    {"name": "run", "flag": "is_moving", "clips": ("run",),
+     "start": "animation_start_time", "faces": "direction",
+     "tracks_facing": True, 
+     "cooldowns": ("heal_cooldown", "dash_cooldown")},
+    {"name": "idle", "clips": ("idle",),
+     "start": "animation_start_time", "faces": "direction",
+     "tracks_facing": True, 
+     "cooldowns": ("heal_cooldown", "dash_cooldown")}
+)
+
+# Melee combo: clip of each swing, its damage, how long it lasts and
+# the frame the blow lands on. A second press during a swing or within
+# the combo window after it chains the next swing
+ATTACK_CLIPS = ("attack", "attack2_")
+ATTACK_DAMAGE = (1, 2)
+ATTACK_DURATION = 0.4
+ATTACK_HIT_FRAME = 4
+ATTACK_COMBO_WINDOW = 0.3
+
+# Size of the blow's hit box in front of the knight, in pixels
+ATTACK_REACH = 56
+ATTACK_WIDTH = 64
+
+# Tile layer whose sprites break when hit
+DESTRUCTIBLE_LAYER = "Destructibles"
+
+# File name part for each direction
+DIRECTION_NAMES = {
+    DIRECTION_UP: "up",
+    DIRECTION_DOWN: "down",
+    DIRECTION_LEFT: "left",
+    DIRECTION_RIGHT: "right"
+}
+
+# Enemy sheets are single rows of square frames, one sheet per state
+ENEMY_SHEET_DIR = "Enemy_Animations_Set"
+ENEMY_FRAME_SIZE = 32
+ENEMY_SCALING = 2
+ENEMY_ANIMATION_FPS = 10
+
+# Enemy states, indexing ENEMY_STATE_NAMES
+ENEMY_IDLE = 0
+ENEMY_MOVE = 1
+ENEMY_ATTACK = 2
+ENEMY_HURT = 3
+ENEMY_DEAD = 4
+ENEMY_STATE_NAMES = ("idle", "move", "attack", "hurt", "death")
+
+# Object layer enemies are spawned from, their half width for wall 
+# checks and how long a hit stuns them
+ENEMY_LAYER = "Enemies"
+ENEMY_RADIUS = 12
+ENEMY_HURT_TIME = 0.4
+
+# Bucket size of the enemy spatial hash used by attack queries
+ENEMY_HASH_CELL_SIZE = 96
+
+# Enemy sheets and stats. Speed is in pixels per 1/60 s, sight and 
+# reach in pixels, attack_time in seconds between hits
+ENEMY_KINDS = {
+    "skeleton1": {
+        "sheets": {
+            "idle": "enemies-skeleton1_idle.png",
+            "move": "enemies-skeleton1_movement.png",
+            "attack": "enemies-skeleton1_attack.png",
+            "hurt": "enemies-skeleton1_take_damage.png",
+            "death": "enemies-skeleton1_death.png"
+        },
+        "health": 3, "speed": 1.5, "sight": 320, "reach": 40,
+        "damage": 1, "attack_time": 1.0
+    },
+    "skeleton2": {
+        "sheets": {
+            "idle": "enemies-skeleton2_idle.png",
+            "move": "enemies-skeleton2_movemen.png",
+            "attack": "enemies-skeleton2_attack.png",
+            "hurt": "enemies-skeleton2_take_damage.png",
+            "death": "enemies-skeleton2_death.png"
+        },
+        "health": 4, "speed": 1.2, "sight": 320, "reach": 44,
+        "damage": 1, "attack_time": 1.2
+    },
+    "vampire": {
+        "sheets": {
+            "idle": "enemies-vampire_idle.png",
+            "move": "enemies-vampire_movement.png",
+            "attack": "enemies-vampire_attack.png",
+            "hurt": "enemies-vampire_take_damage.png",
+            "death": "enemies-vampire_death.png"
+        },
+        "health": 5, "speed": 2.2, "sight": 400, "reach": 40,
+        "damage": 1, "attack_time": 0.8
+    }
+}
+
+# Packed knight texture atlas
+KNIGHT_ATLAS_IMAGE = "knight_atlas.png"
+KNIGHT_ATLAS_INDEX = "knight_atlas.json"
+KNIGHT_ATLAS_VERSION = 1
+
+# Maximum number of entries kept by the shared texture cache
+TEXTURE_CACHE_SIZE = 2048
+
+# Spatial hash cell size for static collision, two scaled tiles
+COLLISION_HASH_CELL_SIZE = 96
+
+# Grid layer holding every wall, for enemy movement
+SOLID_GRID_LAYER = "Solid"
+
+# Cost of a straight and a diagonal step in the enemy flow field, 
+# roughly 1 : sqrt(2)
+FLOW_STRAIGHT_COST = 10
+FLOW_DIAGONAL_COST = 14
+
+# Walking distance in pixels the flow field is mapped out to. Enemies
+# only give chase within sight, and twice the longest sight leaves 
+# room for paths that lead around walls
+FLOW_RADIUS = 2 * max(kind["sight"] for kind in ENEMY_KINDS.values())
+
+# Static layers are split into square chunks of this many tiles a 
+# side, and only chunks the camera can see are drawn
+CHUNK_SIZE_TILES = 16
+
+# Layers taken out of the scene and drawn over the player
+FOREGROUND_LAYERS = ("Foreground Fake Walls", "Walls On Top of Boundary")
+
+# Static layers pre-rendered into one image per chunk at load time. 
+# Runs of these layers that are next to each other in scene draw 
+# order are baked together; animated tiles stay sprites
+BAKED_LAYERS = (
+    "Background", "Floor", "Boundary Walls", "Walls", 
+    "Non Collision Items"
+)
+
+# Maps with more tiles than this stream their chunks in around the 
+# camera instead of creating everything up front
+STREAM_MIN_TILES = 64 * 64
+
+# Streaming: estimated bytes of sprite and GPU data the loaded chunks
+# may hold, rough bytes per streamed sprite used to estimate it, and 
+# rings of chunks prepared ahead of the view. This bounds what is 
+# resident in the sprite lists and on the GPU, not process memory: 
+# the whole level map is still read when the level loads
+STREAM_RESIDENCY_BUDGET = 256 * 1024 * 1024
+STREAM_SPRITE_BYTES = 1024
+STREAM_PREFETCH_CHUNKS = 1
+
+# Baked layers that are only drawn, whose tiles are only created when
+# their chunk is streamed in
+STREAMED_LAYERS = ("Background", "Floor", "Non Collision Items")
+
+# Layers indexed by the tile occupancy grid
+GRID_LAYERS = (
+    "Walls", "Collision Items", "Boundary Walls", "Peaks", "Arrow",
+    "Flamethrower", "Slow Speed Items", "Keys", "Small Health Flasks",
+    "Small Speed Flasks", "Tunnel", DESTRUCTIBLE_LAYER
+)
+
+# Trap timing per layer. TMX layer properties of the same names 
+# override these: trap_phases lists "name seconds" pairs in cycle 
+# order, trap_damage the phases that hurt, trap_show_on/trap_hide_on 
+# the phases that show/hide the traps on entry, trap_sounds "phase 
+# sound" pairs played on entry. trap_start and trap_offset pick where
+# the cycle begins
+TRAP_DEFAULTS = {
+    "Peaks": {
+        "trap_phases": "wait 4.2, active 2.0, cooldown 0.2",
+        "trap_damage": "active",
+        "trap_show_on": "active",
+        "trap_hide_on": "cooldown",
+        "trap_sounds": "active peak",
+        "trap_hurt_sound": "hurt_peak"
+    },
+    "Arrow": {
+        "trap_phases": "short 0.1, wait 2.0, long 0.3",
+        "trap_start": "wait",
+        "trap_damage": "short, long",
+        "trap_sounds": "long arrow",
+        "trap_hurt_sound": "hurt_arrow"
+    },
+    "Flamethrower": {
+        "trap_phases": "short 0.15, wait 2.0, long 0.3",
+        "trap_start": "wait",
+        "trap_damage": "short, long",
+        "trap_sounds": "long flamethrower",
+        "trap_hurt_sound": "hurt_arrow"
+    }
+}
+
+# Sound effect attributes set by GameLogic._load_sounds, the only 
+# names trap_sounds and trap_hurt_sound may refer to
+SOUND_EFFECTS = (
+    "heal_sound", "key_sound", "speed_sound", "dash", "hurt_peak",
+    "hurt_arrow", "peak", "arrow", "flamethrower", "level_complete"
+)
+
+# Slack when comparing trap phase ends against summed frame times
+TRAP_TIME_EPSILON = 1e-6
+
+# Compiled level cache written next to each Level_N.tmx
+COMPILED_LEVEL_EXTENSION = ".dklevel"
+COMPILED_LEVEL_MAGIC = b"DKLV"
+COMPILED_LEVEL_VERSION = 2
+
+# Recorded input sessions: header, then one (tick, key, pressed) 
+# record per key event
+INPUT_RECORD_MAGIC = b"DKIN"
+INPUT_RECORD_VERSION = 1
+INPUT_RECORD_HEADER = "<4sH"
+INPUT_RECORD_EVENT = "<IIB"
+
+# Frame profiler: frames in the rolling percentiles, frames kept for
+# export, and frames between overlay text refreshes
+PROFILER_WINDOW = 300
+PROFILER_HISTORY = 36000
+PROFILER_OVERLAY_REFRESH = 30
+PROFILER_EXPORT_PATH = "frame_profile.csv"
+
+# Profiling overlay columns: (left x, width, alignment) of the phase 
+# names and of the p50 and p99 timings
+PROFILER_OVERLAY_COLUMNS = (
+    (10, 230, "left"), (240, 70, "right"), (310, 70, "right")
+)
+
+# Audio: voices of one effect allowed at once, and seconds within 
+# which a repeat of the same effect is dropped
+AUDIO_MAX_VOICES = 4
+AUDIO_DEDUP_WINDOW = 0.02
+
+# Longest session simulated by --headless, ten minutes at 60 updates/s
+HEADLESS_MAX_TICKS = 60 * 60 * 10
+
+
+class TextureCache(arcade.TextureCacheManager):
+    """
+    Process-wide registry of decoded textures and images.
+    
+    Entries are keyed by source file and region so every 
+    PlayerCharacter and every level load shares the same decoded 
+    data. The least recently used entries are evicted once the 
+    cache holds more than max_entries.
+    
+    Attributes:
+        max_entries (int): Eviction cap
+        hits (int): Lookups answered from the cache
+        misses (int): Lookups that had to decode from disk
+        evictions (int): Entries dropped by the LRU cap
+    """
+    
+    def __init__(self, max_entries=TEXTURE_CACHE_SIZE):
+        """
+        Create an empty cache.
+        
+        Args:
+            max_entries (int): Maximum number of entries to keep
+        """
+        
+        super().__init__()
+        
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = OrderedDict()
+        
+        # Levels are prepared on a worker thread
+        self._lock = threading.Lock()
+
+    def get(self, key, loader):
+        """
+        Return the cached entry for key, loading it on a miss.
+        
+        Args:
+            key: Hashable cache key
+            loader (callable): Called with no arguments on a miss
+            
+        Returns:
+            The cached or newly loaded entry
+        """
+        
+        with self._lock:
+            entry = self._entries.get(key)
+            
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry
+
+            self.misses += 1
+            
+        # Load outside the lock so one slow decode does not block 
+        # lookups from the other thread
+        entry = loader()
+        
+        with self._lock:
+            entry = self._entries.setdefault(key, entry)
+            
+            # Drop least recently used entries past the cap
+            while len(self._entries) > self.max_entries:
+                _, evicted = self._entries.popitem(last=False)
+                if isinstance(evicted, arcade.Texture):
+                    self._forget(evicted)
+                self.evictions += 1
+            
+        return entry
+
+    def _forget(self, texture):
+        """
+        Drop everything arcade's caches hold for an evicted texture.
+        
+        Args:
+            texture (arcade.Texture): The evicted texture
+        """
+        
+        self.texture_cache.delete(texture)
+        
+        # Image data is stored under the source file and crop as well 
+        # as under the pixel hash, depending on how it was loaded
+        for name in (texture.image_cache_name, texture.image_data.hash):
+            if name:
+                self.image_data_cache.delete(name)
+        
+        # HitBoxCache has no delete of its own
+        self.hit_box_cache._entries.pop(texture.cache_name, None)
+
+    def load_image(self, file_path):
+        """
+        Decode a whole image file once.
+        
+        Args:
+            file_path (str): Path of the image
+            
+        Returns:
+            PIL.Image.Image: RGBA image
+        """
+        
+        return self.get(
+            ("image", str(file_path)),
+            lambda: Image.open(file_path).convert("RGBA")
+        )
+
+    def load_region(self, file_path, region, hit_box_points=None):
+        """
+        Slice a region out of a decoded image as a texture.
+        
+        Args:
+            file_path (str): Path of the source image
+            region (tuple): (x, y, width, height), all zero for the 
+                whole image
+            hit_box_points (list): Precomputed hit box, computed from 
+                the pixels when not given
+                
+        Returns:
+            arcade.Texture: The cached texture
+        """
+        
+        x, y, width, height = region
+        
+        def load():
+            image = self.load_image(file_path)
+            if width and height:
+                image = image.crop((x, y, x + width, y + height))
+            return arcade.Texture(image, hit_box_points=hit_box_points)
+        
+        return self.get(("region", str(file_path), x, y, width, height), 
+                        load)
+
+    def load_or_get_texture(self, file_path, *, x=0, y=0, width=0, 
+                            height=0, hit_box_algorithm=None):
+        """
+        Load a texture (or a region of one) through the cache.
+        
+        Overrides arcade's manager so tilemaps loaded with this cache
+        are counted and evicted like every other texture.
+        """
+        
+        algorithm = hit_box_algorithm or arcade.hitbox.algo_default
+        key = ("texture", str(file_path), x, y, width, height,
+               algorithm.cache_name)
+        
+        return self.get(key, lambda: super(TextureCache, self)\
+            .load_or_get_texture(
+                file_path, x=x, y=y, width=width, height=height,
+                hit_box_algorithm=hit_box_algorithm
+            ))
+
+    def stats(self):
+        """Return hit, miss and eviction counters as a dictionary."""
+        
+        return {
+            "entries": len(self._entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions
+        }
+
+    def clear(self):
+        """Drop every cached entry and reset the counters."""
+        
+        self._entries.clear()
+        self.flush(hit_boxes=True)
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+
+# Shared by every PlayerCharacter and level load in this process
+TEXTURE_CACHE = TextureCache()
+
+
+def knight_character_dir():
+    """Return the folder holding the knight animation frames."""
+    
+    dir_name = os.path.dirname(os.path.abspath(__file__))
+    return os.path.join(dir_name, "knight_character")
+
+
+def _read_json(path):
+    """Read and parse a JSON file."""
+    
+    with open(path) as json_file:
+        return json.load(json_file)
+
+
+def build_knight_atlas(character_dir=None):
+    """
+    Pack every knight animation frame into a single atlas image.
+
+    Each (clip, direction) pair gets one row in the atlas with its
+    frames laid out left to right. The index written next to the 
+    image maps clip -> direction -> frame to its region and a 
+    precomputed hit box, so loading never has to scan pixels again.
+    
+    Args:
+        character_dir (str): Folder with the knight frames
+        
+    Returns:
+        str: Path of the written atlas index
+    """
+    
+    character_dir = character_dir or knight_character_dir()
+    
+    # Decode every source frame once
+    frames = {}
+    for state, frame_count in KNIGHT_ANIMATIONS.items():
+        for direction, name in DIRECTION_NAMES.items():
+            frames[(state, name)] = [
+                Image.open(os.path.join(
+                    character_dir, f"knight_{name}_{state}{i}.png"
+                )).convert("RGBA")
+                for i in range(frame_count)
+            ]
+
+    # All knight frames share one size
+    frame_width, frame_height = next(iter(frames.values()))[0].size
+    columns = max(KNIGHT_ANIMATIONS.values())
+    atlas = Image.new(
+        "RGBA", 
+        (columns * frame_width, len(frames) * frame_height), 
+        (0, 0, 0, 0)
+    )
+
+    # Paste frames row by row and record their regions
+    clips = {}
+    for row, ((state, name), images) in enumerate(frames.items()):
+        regions = clips.setdefault(state, {}).setdefault(name, [])
+        for column, image in enumerate(images):
+            x = column * frame_width
+            y = row * frame_height
+            atlas.paste(image, (x, y))
+            hit_box = arcade.hitbox.algo_default.calculate(image)
+            regions.append({
+                "region": [x, y, frame_width, frame_height],
+                "hit_box": [[round(px, 2), round(py, 2)] 
+                            for px, py in hit_box]
+            })
+
+    atlas.save(os.path.join(character_dir, KNIGHT_ATLAS_IMAGE))
+    
+    index_path = os.path.join(character_dir, KNIGHT_ATLAS_INDEX)
+    with open(index_path, "w") as index_file:
+        json.dump({
+            "version": KNIGHT_ATLAS_VERSION,
+            "image": KNIGHT_ATLAS_IMAGE,
+            "clips": clips
+        }, index_file, separators=(",", ":"))
+        
+    return index_path
+
+
+def load_knight_atlas(character_dir=None):
+    """
+    Load knight animation textures from the packed atlas.
+    
+    The atlas image is decoded once and every frame is sliced out of
+    it using the regions stored in the index.
+    
+    Args:
+        character_dir (str): Folder with the knight atlas
+        
+    Returns:
+        dict: clip -> direction -> list of textures, or None when the
+        atlas is missing or does not match KNIGHT_ANIMATIONS
+    """
+    
+    character_dir = character_dir or knight_character_dir()
+    index_path = os.path.join(character_dir, KNIGHT_ATLAS_INDEX)
+    
+    if not os.path.exists(index_path):
+        return None
+    
+    index = TEXTURE_CACHE.get(("index", index_path), 
+                              lambda: _read_json(index_path))
+        
+    # Reject atlases built for a different set of clips
+    clips = index.get("clips", {})
+    if index.get("version") != KNIGHT_ATLAS_VERSION:
+        return None
+    for state, frame_count in KNIGHT_ANIMATIONS.items():
+        for name in DIRECTION_NAMES.values():
+            if len(clips.get(state, {}).get(name, [])) != frame_count:
+                return None
+
+    # Decode the whole atlas in one go
+    atlas_path = os.path.join(character_dir, index["image"])
+    atlas = TEXTURE_CACHE.load_image(atlas_path)
+
+    def slice_frame(state, name, i, frame):
+        x, y, width, height = frame["region"]
+        return arcade.Texture(
+            atlas.crop((x, y, x + width, y + height)),
+            hit_box_points=[tuple(p) for p in frame["hit_box"]],
+            hash=f"knight_atlas_{state}_{name}_{i}"
+        )
+
+    animations = {}
+    for state in KNIGHT_ANIMATIONS:
+        animations[state] = {}
+        for direction, name in DIRECTION_NAMES.items():
+            animations[state][direction] = [
+                TEXTURE_CACHE.get(
+                    ("atlas", atlas_path, *frame["region"]),
+                    lambda frame=frame, i=i: slice_frame(
+                        state, name, i, frame
+                    )
+                )
+                for i, frame in enumerate(clips[state][name])
+            ]
+            
+    return animations
+
+
+def load_knight_frames(character_dir=None):
+    """
+    Load knight animation textures one file per frame.
+    
+    Slow path used when the packed atlas has not been built.
+    
+    Args:
+        character_dir (str): Folder with the knight frames
+        
+    Returns:
+        dict: clip -> direction -> list of textures
+    """
+    
+    character_dir = character_dir or knight_character_dir()
+    
+    animations = {}
+    for state, frame_count in KNIGHT_ANIMATIONS.items():
+        animations[state] = {}
+        for direction, name in DIRECTION_NAMES.items():
+            animations[state][direction] = [
+                TEXTURE_CACHE.load_or_get_texture(os.path.join(
+                    character_dir, f"knight_{name}_{state}{i}.png"
+                ))
+                for i in range(frame_count)
+            ]
+            
+    return animations
+
+
+class GameClock:
+    """
+    Simulated game time that every timed effect is measured against.
+    
+    The clock only moves when the game steps, so dash, hurt, heal and
+    boost timings follow the simulation rather than the wall clock and
+    play out the same however fast the updates are run.
+    
+    Attributes:
+        now (float): Seconds simulated since the clock was started
+    """
+    
+    def __init__(self, start=0.0):
+        """
+        Start the clock.
+        
+        Args:
+            start (float): Initial time in seconds
+        """
+        
+        self.now = start
+
+    def time(self):
+        """
+        Get the current simulated time.
+        
+        Returns:
+            float: Seconds simulated so far
+        """
+        
+        return self.now
+
+    def advance(self, delta_time):
+        """
+        Move the clock forward by one step.
+        
+        Args:
+            delta_time (float): Seconds to advance
+        """
+        
+        self.now += delta_time
+
+
+class AnimationClip:
+    """
+    One knight clip with its frame timing worked out in advance.
+    
+    The end time of every frame is stored once, so finding the frame 
+    for an elapsed time is a binary search over a small table rather 
+    than a count of updates. Frames are picked by time alone and play
+    at the same speed however often the game updates.
+    
+    Attributes:
+        frames (dict): Direction -> list of textures
+        ends (array): Time each frame ends, from the clip start
+        duration (float): Length of one play through
+        loop (bool): True if the clip repeats
+    """
+    
+    __slots__ = ("frames", "ends", "last", "duration", "loop")
+    
+    def __init__(self, frames, frame_time=None, duration=None, 
+                 loop=False):
+        """
+        Build the frame end table of a clip.
+        
+        Give either frame_time, for a fixed frame rate, or duration, 
+        to spread the frames evenly over a set time.
+        
+        Args:
+            frames (dict): Direction -> list of textures
+            frame_time (float): Seconds each frame is shown
+            duration (float): Seconds the whole clip lasts
+            loop (bool): True if the clip repeats
+        """
+        
+        count = len(next(iter(frames.values())))
+        if frame_time is None:
+            frame_time = duration / count
+            
+        self.frames = frames
+        self.ends = array("d", [
+            (i + 1) * frame_time - ANIMATION_TIME_EPSILON 
+            for i in range(count)
+        ])
+        self.last = count - 1
+        self.duration = count * frame_time
+        self.loop = loop
+
+    def sample(self, elapsed):
+        """
+        Find the frame shown after some time in the clip.
+        
+        Looping clips wrap around, others hold their last frame.
+        
+        Args:
+            elapsed (float): Seconds since the clip started
+            
+        Returns:
+            tuple: (frame index, seconds from the clip start until the
+            frame is replaced)
+        """
+        
+        cycle_start = 0.0
+        if self.loop:
+            cycle_start = elapsed - elapsed % self.duration
+        
+        frame = bisect_right(self.ends, elapsed - cycle_start)
+        if frame > self.last:
+            frame = self.last
+            
+        return frame, cycle_start + self.ends[frame]
+
+    def finished(self, elapsed):
+        """Return True once a one-shot clip has played through."""
+        
+        return not self.loop and \
+            elapsed >= self.duration - ANIMATION_TIME_EPSILON
+
+
+class AnimationState:
+    """
+    One row of a state table with its attribute names turned into 
+    getters.
+    
+    Attributes:
+        name (str): State name
+        flag (str): Attribute that selects the state, None for the 
+            fallback state
+        clips (tuple): Clip name for each variant
+        variant: Getter for the clip index, None for one clip
+        start: Getter for when the state began
+        lasts: Getter for the longest the state runs, or None
+        faces: Getter for the direction frames are drawn for
+        tracks_facing (bool): True to turn towards movement first
+        cooldowns (tuple): Timer attributes run down in the state
+        on_end (str): Method called when the clip ends, or None
+    """
+    
+    __slots__ = ("name", "flag", "clips", "variant", "start", "lasts",
+                 "faces", "tracks_facing", "cooldowns", "on_end")
+    
+    def __init__(self, row):
+        """
+        Compile one state table row.
+        
+        Args:
+            row (dict): Entry of a table like KNIGHT_STATES
+        """
+        
+        def getter(name):
+            return attrgetter(name) if name else None
+        
+        self.name = row["name"]
+        self.flag = row.get("flag")
+        self.clips = tuple(row["clips"])
+        self.variant = getter(row.get("variant"))
+        self.start = attrgetter(row["start"])
+        self.lasts = getter(row.get("lasts"))
+        self.faces = attrgetter(row.get("faces", "facing_direction"))
+        self.tracks_facing = row.get("tracks_facing", False)
+        self.cooldowns = tuple(row.get("cooldowns", ()))
+        self.on_end = row.get("on_end")
+
+
+class AnimationStateMachine:
+    """
+    A priority table of animation states compiled into lookups.
+    
+    All flags are read in one go as a tuple, which is looked up in a 
+    table listing the highest priority state for every combination of
+    flags. Picking the state each update is therefore one attribute 
+    fetch and one table lookup, whatever the number of states.
+    
+    Attributes:
+        states (list): AnimationState rows in priority order
+        by_flags (dict): Tuple of flag values -> AnimationState
+    """
+    
+    def __init__(self, table):
+        """
+        Compile a state table.
+        
+        Args:
+            table (tuple): Rows like KNIGHT_STATES, highest priority 
+                first, ending with one state that has no flag
+        """
+        
+        self.states = [AnimationState(row) for row in table]
+        flagged = [state for state in self.states if state.flag]
+        fallback = len(self.states) - 1
+        if self.states[fallback].flag or len(flagged) != fallback:
+            raise ValueError("Only the last animation state may have "
+                             "no flag")
+        
+        # Fetch every flag at once, as a tuple even for one flag
+        flag_names = [state.flag for state in flagged]
+        self._read_flags = attrgetter(*flag_names, flag_names[0])
+        
+        # The first set flag is the highest priority state
+        self.by_flags = {}
+        for flags in product((False, True), repeat=len(flag_names)):
+            index = flags.index(True) if True in flags else fallback
+            self.by_flags[flags + flags[:1]] = self.states[index]
+
+    def current(self, owner):
+        """
+        Return the state that should play for an object.
+        
+        Args:
+            owner: Object with the flag attributes
+            
+        Returns:
+            AnimationState: Highest priority state whose flag is set
+        """
+        
+        flags = self._read_flags(owner)
+        state = self.by_flags.get(flags)
+        if state is None:
+            # Flags holding other truthy values than True
+            state = self.by_flags[tuple(map(bool, flags))]
+            
+        return state
+
+
+# The knight's states, compiled once for every player
+KNIGHT_STATE_MACHINE = AnimationStateMachine(KNIGHT_STATES)
+
 
 class PlayerCharacter(arcade.Sprite):
     """
@@ -40,19 +924,33 @@ class PlayerCharacter(arcade.Sprite):
     
     Attributes:
         cur_texture (int): Current frame in animation sequence
+        animation_start_time (float): When the current clip started
         direction (int): Current movement direction
         facing_direction (int): Direction character is facing
         Various state flags (is_dashing, is_hurt, etc.)
         Animation texture dictionaries for different states
+        clock (GameClock): Time source for every timed state
     """
     
-    def __init__(self):
-        """Initialize player with default state and load animation."""
+    def __init__(self, clock=None):
+        """
+        Initialize player with default state and load animation.
+        
+        Args:
+            clock (GameClock): Shared game clock, a new one if omitted
+        """
         
         super().__init__()
         
+        # Time source for all player timings
+        self.clock = clock if clock is not None else GameClock()
+        
         # Animation control
         self.cur_texture = 0
+        self.animation_start_time = self.clock.time()
+        self._shown_frame = None
+        self._shown_state = None
+        self._frame_until = float("-inf")
         self.direction = DIRECTION_DOWN
         self.facing_direction = DIRECTION_RIGHT
         
@@ -74,7 +972,7 @@ class PlayerCharacter(arcade.Sprite):
         self.is_dead = False
         self.invincible = False
         self.invincibility_duration = 1.0
-        self.last_hurt_time = 0
+        self.last_hurt_time = float("-inf")
 
         # Healing properties
         self.heal_amount = 1
@@ -94,7 +992,17 @@ class PlayerCharacter(arcade.Sprite):
         self.drink_start_time = 0
         self.drink_duration = 0.5
         
+        # Melee attack properties
+        self.is_attacking = False
+        self.attack_combo = 0
+        self.attack_start_time = 0
+        self.attack_end_time = float("-inf")
+        self.attack_queued = False
+        self.attack_landed = False
+        
         # Death state
+        self.death_start_time = 0
+        self.death_duration = 1.0
         self.death_completed = False
         self.death_complete_time = 0
         
@@ -108,582 +1016,3430 @@ class PlayerCharacter(arcade.Sprite):
         )
 
     def _load_textures(self):
-        """Load all animation textures from the Dead Knight File."""
+        """
+        Load all animation textures from the Dead Knight File.
+        
+        The packed atlas is used when it has been built, otherwise 
+        every frame is loaded from its own file.
+        """
+        
+        animations = load_knight_atlas()
+        if animations is None:
+            animations = load_knight_frames()
+
+        # Texture dictionaries for each animation state
+        self.heal_textures = animations["heal"]
+        self.idle_textures = animations["idle"]
+        self.walk_textures = animations["run"]
+        self.dash_textures = animations["dash"]
+        self.death_textures = animations["death"]
+        self.hurt_textures = animations["hurt"]
+        self.attack_textures = [
+            animations[clip] for clip in ATTACK_CLIPS
+        ]
+        
+        # Frame timing of each clip. Looping clips keep the original 
+        # rate of one frame every UPDATES_PER_FRAME steps
+        frame_time = UPDATES_PER_FRAME * FIXED_TIMESTEP
+        self.clips = {
+            "idle": AnimationClip(self.idle_textures, frame_time, 
+                                  loop=True),
+            "run": AnimationClip(self.walk_textures, frame_time, 
+                                 loop=True),
+            "dash": AnimationClip(self.dash_textures, frame_time),
+            "heal": AnimationClip(self.heal_textures, 
+                                  duration=self.heal_duration),
+            "drink": AnimationClip(self.heal_textures, 
+                                   duration=self.drink_duration),
+            "hurt": AnimationClip(self.hurt_textures, 
+                                  duration=self.hurt_duration),
+            "death": AnimationClip(self.death_textures, 
+                                   duration=self.death_duration)
+        }
+        for clip in ATTACK_CLIPS:
+            self.clips[clip] = AnimationClip(
+                animations[clip], duration=ATTACK_DURATION
+            )
+
+    def _show_frame(self, clip_name, elapsed, direction):
+        """
+        Show the frame of a clip due after some time.
+        
+        The texture is only reassigned when the frame actually 
+        changes, so sprite data is not re-synced every update.
+        
+        Args:
+            clip_name (str): Key of self.clips
+            elapsed (float): Seconds since the clip started
+            direction (int): DIRECTION_* to take frames from
+        """
+        
+        clip = self.clips[clip_name]
+        frame, until = clip.sample(elapsed)
+        self._frame_until = self.clock.time() - elapsed + until
+        
+        shown = (clip_name, direction, frame)
+        if shown != self._shown_frame:
+            self._shown_frame = shown
+            self.cur_texture = frame
+            self.texture = clip.frames[direction][frame]
+
+    def restart_animation(self):
+        """Start the next clip from its first frame."""
+        
+        self.cur_texture = 0
+        self.animation_start_time = self.clock.time()
+        self._frame_until = float("-inf")
+
+    def character_animation(self, delta_time: float = 1 / 60):
+        """
+        Update character animation based on current state.
+        
+        The state comes from KNIGHT_STATE_MACHINE. Until the frame on
+        show is due to change, an update in the same state and 
+        direction stops there. When the clip has run out the state is
+        ended and the next state is picked, so the knight never skips 
+        an update without a frame.
+        
+        Args:
+            delta_time (float): Time since last update
+        """
+        
+        machine = KNIGHT_STATE_MACHINE
+        state = machine.current(self)
+        
+        # Update cooldowns
+        for cooldown in state.cooldowns:
+            timer = getattr(self, cooldown)
+            if timer > 0:
+                setattr(self, cooldown, timer - delta_time)
+        
+        now = self.clock.time()
+        
+        if state.tracks_facing:
+            self._update_facing_direction()
+            
+        # Nothing changes before the frame on show is due to end
+        if state is self._shown_state and now < self._frame_until and \
+                state.faces(self) == self._shown_frame[1]:
+            return
+        
+        # End finished states until one is still playing or holds its
+        # last frame
+        for _ in range(len(machine.states)):
+            clip_name = state.clips[state.variant(self) 
+                                    if state.variant else 0]
+            elapsed = now - state.start(self)
+            ended = self.clips[clip_name].finished(elapsed) or (
+                state.lasts is not None and elapsed >= state.lasts(self)
+            )
+            if not ended:
+                break
+            
+            started = state.start(self)
+            if state.on_end:
+                getattr(self, state.on_end)()
+            else:
+                setattr(self, state.flag, False)
+                self.restart_animation()
+            
+            # A state that ends without leaving or restarting holds 
+            # its last frame
+            next_state = machine.current(self)
+            if next_state is state and state.start(self) == started:
+                break
+            state = next_state
+            if state.tracks_facing:
+                self._update_facing_direction()
+            
+        self._show_frame(clip_name, elapsed, state.faces(self))
+        self._shown_state = state
+        
+        # A state capped short of its clip ends early
+        if state.lasts is not None:
+            self._frame_until = min(
+                self._frame_until, state.start(self) + state.lasts(self)
+            )
+
+    @property
+    def is_moving(self):
+        """True while the knight has any velocity."""
+        
+        change_x, change_y = self.velocity
+        
+        return change_x != 0 or change_y != 0
+
+    def _finish_death(self):
+        """Hold the last death frame and record when it was reached."""
+        
+        if not self.death_completed:
+            self.death_completed = True
+            self.death_complete_time = self.clock.time()
+
+    def _finish_attack(self):
+        """Chain a queued combo swing, or end the attack."""
+        
+        if self.attack_queued:
+            self._start_attack(self.attack_combo + 1)
+        else:
+            self.is_attacking = False
+            self.attack_end_time = self.clock.time()
+            self.restart_animation()
+
+    def _finish_dash(self):
+        """End the dash and stop the knight."""
+        
+        self.is_dashing = False
+        self.restart_animation()
+        self.change_x = 0
+        self.change_y = 0
+
+    def _update_facing_direction(self):
+        """
+        Update character's facing direction based on movement.
+        
+        This method:
+        1. Determines primary movement direction
+        2. Sets both direction and facing_direction properties
+        Note: Facing direction takes precedence over movement direction
+        for animations when not moving.
+        """
+        
+        change_x, change_y = self.velocity
+        
+        # Vertical movement takes precedence
+        if change_y > 0:
+            self.direction = DIRECTION_UP
+            self.facing_direction = DIRECTION_UP
+            
+        elif change_y < 0:
+            self.direction = DIRECTION_DOWN
+            self.facing_direction = DIRECTION_DOWN
+            
+        # Horizontal movement
+        elif change_x < 0:
+            self.direction = DIRECTION_LEFT
+            self.facing_direction = DIRECTION_LEFT
+            
+        elif change_x > 0:
+            self.direction = DIRECTION_RIGHT
+            self.facing_direction = DIRECTION_RIGHT
+
+    def heal(self):
+        """
+        Start the healing animation and apply health restoration.
+
+        Conditions for starting:
+        - Player is alive (not self.is_dead)
+        - Not currently in hurt, dash, another heal, or drinking state
+        """
+        
+        # Only allow healing when fully idle
+        if not (self.is_dead or self.is_hurt or self.is_dashing
+                or self.is_healing or self.is_drinking):
+            
+            self.is_healing = True
+            self.heal_start_time = self.clock.time()
+            self.hurt_count = max(0, self.hurt_count - self.heal_amount)
+
+    def drink_speed(self):
+        """
+        Start the speed-flask drinking animation and grant speed boost.
+
+        Conditions for starting:
+        - Player is alive
+        - Not currently in hurt, dash, healing, or another drinking 
+        state
+        """
+        
+        if not (self.is_dead or self.is_hurt or self.is_dashing
+                or self.is_healing or self.is_drinking):
+            
+            self.is_drinking = True
+            self.drink_start_time = self.clock.time()
+            self.apply_speed_boost()
+
+    def attack(self):
+        """
+        Swing the sword, or chain the next swing of the combo.
+
+        Conditions for starting:
+        - Player is alive
+        - Not currently in hurt, dash, healing, or drinking state
+        
+        Pressing again during a swing, or within ATTACK_COMBO_WINDOW
+        after it, follows up with the next swing in ATTACK_CLIPS.
+        """
+        
+        if (self.is_dead or self.is_hurt or self.is_dashing
+                or self.is_healing or self.is_drinking):
+            return
+        
+        last_combo = len(ATTACK_CLIPS) - 1
+        
+        if self.is_attacking:
+            if self.attack_combo < last_combo:
+                self.attack_queued = True
+            return
+        
+        # Follow up a recent swing, otherwise start a new combo
+        in_window = self.clock.time() - self.attack_end_time <= \
+            ATTACK_COMBO_WINDOW
+        if in_window and self.attack_combo < last_combo:
+            self._start_attack(self.attack_combo + 1)
+        else:
+            self._start_attack(0)
+
+    def _start_attack(self, combo):
+        """
+        Begin one swing of the combo.
+        
+        Args:
+            combo (int): Index of the swing in ATTACK_CLIPS
+        """
+        
+        self.is_attacking = True
+        self.attack_combo = combo
+        self.attack_start_time = self.clock.time()
+        self.attack_queued = False
+        self.attack_landed = False
+        self.restart_animation()
+        self.change_x = 0
+        self.change_y = 0
+
+    def attack_hit(self):
+        """
+        Report the blow of the current swing once it lands.
+        
+        The blow lands on ATTACK_HIT_FRAME and is only reported once
+        per swing.
+        
+        Returns:
+            tuple: ((left, bottom, right, top), damage) of the blow, or
+            None when no blow lands this update
+        """
+        
+        if not self.is_attacking or self.attack_landed:
+            return None
+        
+        elapsed = self.clock.time() - self.attack_start_time
+        if elapsed < ATTACK_DURATION * ATTACK_HIT_FRAME / ATTACK_FRAMES:
+            return None
+        
+        self.attack_landed = True
+        
+        # Box in front of the knight in the direction it faces
+        x, y = self.center_x, self.center_y
+        half_width = ATTACK_WIDTH / 2
+        if self.facing_direction == DIRECTION_RIGHT:
+            box = (x, y - half_width, x + ATTACK_REACH, y + half_width)
+        elif self.facing_direction == DIRECTION_LEFT:
+            box = (x - ATTACK_REACH, y - half_width, x, y + half_width)
+        elif self.facing_direction == DIRECTION_UP:
+            box = (x - half_width, y, x + half_width, y + ATTACK_REACH)
+        else:
+            box = (x - half_width, y - ATTACK_REACH, x + half_width, y)
+            
+        return box, ATTACK_DAMAGE[self.attack_combo]
+
+    def dash(self):
+        """
+        Initiate dash ability if possible.
+        
+        Conditions:
+        - Player not dead
+        - Not currently dashing
+        - Dash cooldown expired
+        """
+        
+        if (not self.is_dead and not self.is_dashing 
+            and self.dash_cooldown <= 0):
+                
+            self.is_dashing = True
+            
+            # A dash cancels the swing and any swing queued after it
+            self.is_attacking = False
+            self.attack_queued = False
+            self.dash_cooldown = self.dash_cooldown_time
+            self.dash_start_time = self.clock.time()
+            self.is_hurt = False
+            self.restart_animation()
+
+            # Set dash vector based on facing direction
+            if self.facing_direction == DIRECTION_RIGHT:
+                self.change_x = self.dash_speed
+                self.change_y = 0
+                
+            elif self.facing_direction == DIRECTION_LEFT:
+                self.change_x = -self.dash_speed
+                self.change_y = 0
+                
+            elif self.facing_direction == DIRECTION_UP:
+                self.change_x = 0
+                
+                self.change_y = self.dash_speed
+            elif self.facing_direction == DIRECTION_DOWN:
+                self.change_x = 0
+                
+                self.change_y = -self.dash_speed
+
+            # Play dash sound if available
+            if hasattr(self, "dash_sound"):
+                self.dash_sound.play()
+
+    def hurt(self, damage_amount=1):
+        """
+        Apply damage to player if conditions met.
+        
+        Args:
+            damage_amount (int): Amount of damage to apply
+            
+        Returns:
+            bool: True if damage was applied, False otherwise
+        """
+        
+        current_time = self.clock.time()
+        invincible_period = current_time - self.last_hurt_time <= \
+            self.invincibility_duration
+        
+        if self.is_hurt:
+            self.is_healing = False
+            self.is_drinking = False
+        
+        if (not self.is_dead and not self.is_hurt 
+            and not self.is_dashing and not self.is_healing 
+            and not invincible_period
+            and not self.invincible):
+            
+            # Set hurt state, cutting any swing or drink short
+            self.is_hurt = True
+            self.is_attacking = False
+            self.is_drinking = False
+            self.hurt_start_time = current_time
+            self.last_hurt_time = current_time
+            self.hurt_count += damage_amount
+            self.change_x = 0
+            self.change_y = 0
+            
+            # Apply knockback based on facing direction
+            knockback = 20
+            if self.facing_direction == DIRECTION_RIGHT:
+                self.center_x -= knockback
+            elif self.facing_direction == DIRECTION_LEFT:
+                self.center_x += knockback
+            elif self.facing_direction == DIRECTION_UP:
+                self.center_y -= knockback
+            elif self.facing_direction == DIRECTION_DOWN:
+                self.center_y += knockback
+                
+            # Check for death
+            if self.hurt_count >= self.max_hits_before_death:
+                self.die()
+            
+            # Damage applied
+            return True
+        
+        # No damage applied
+        return False
+                
+    def die(self):
+        """Set player to death state."""
+        
+        self.is_dead = True
+        self.death_start_time = self.clock.time()
+        self.change_x = 0
+        self.change_y = 0
+        self.is_dashing = False
+        self.is_attacking = False
+        self.restart_animation()
+        self._show_frame("death", 0, self.facing_direction)
+
+    def apply_speed_boost(self):
+        """Apply speed boost effect to player."""
+        
+        if not self.is_dead:
+            self.is_speed_boosted = True
+            self.speed_boost_start_time = self.clock.time()
+
+    def update_speed_boost(self):
+        """Update speed boost duration and expiration."""
+        
+        if self.is_speed_boosted:
+            elapsed = self.clock.time() - self.speed_boost_start_time
+            if elapsed >= self.speed_boost_duration:
+                self.is_speed_boosted = False
+
+
+def enemy_sheet_dir():
+    """Return the folder holding the enemy sprite sheets."""
+    
+    return os.path.join(os.path.dirname(__file__), ENEMY_SHEET_DIR)
+
+
+def load_enemy_textures(sheet_dir=None):
+    """
+    Slice every enemy sheet into frames, once per process.
+    
+    Frames come from the shared TEXTURE_CACHE, so every enemy of a 
+    kind uses the same textures.
+    
+    Args:
+        sheet_dir (str): Folder with the enemy sheets
+        
+    Returns:
+        dict: kind -> one (right frames, left frames) pair per state,
+        indexed by the ENEMY_* state constants
+    """
+    
+    sheet_dir = sheet_dir or enemy_sheet_dir()
+    
+    def slice_kind(kind):
+        states = []
+        for state in ENEMY_STATE_NAMES:
+            path = os.path.join(
+                sheet_dir, ENEMY_KINDS[kind]["sheets"][state]
+            )
+            width = TEXTURE_CACHE.load_image(path).width
+            right = [
+                TEXTURE_CACHE.load_region(
+                    path, (x, 0, ENEMY_FRAME_SIZE, ENEMY_FRAME_SIZE)
+                )
+                for x in range(0, width, ENEMY_FRAME_SIZE)
+            ]
+            left = [frame.flip_left_right() for frame in right]
+            states.append((right, left))
+        return states
+    
+    return {
+        kind: TEXTURE_CACHE.get(
+            ("enemy", sheet_dir, kind), lambda kind=kind: slice_kind(kind)
+        )
+        for kind in ENEMY_KINDS
+    }
+
+
+class EnemySwarm:
+    """
+    Every enemy of a level, stored column by column.
+    
+    Enemy state lives in parallel arrays indexed by enemy number 
+    rather than in one object per enemy, and update() runs AI, 
+    movement and animation for the whole swarm in one loop. Sprites 
+    are only touched when an enemy moves or its frame changes. A 
+    spatial hash of enemy positions, kept up to date as they move, 
+    lets attacks find the enemies under a box without visiting the 
+    rest of the swarm.
+    
+    Enemies idle until the player comes within sight, follow the 
+    level's FlowField around walls towards the player, and attack 
+    within reach. Walls are looked up in the level's TileGrid.
+    
+    Attributes:
+        kinds (list): Kind name of each enemy
+        x, y (array): Enemy positions
+        health (array): Hits left before dying
+        state (array): ENEMY_* state of each enemy
+        timer (array): Seconds spent in the current state
+        cooldown (array): Seconds until the next attack lands
+        facing_left (array): 1 where the enemy faces left
+        sprites (list): Sprite of each enemy
+        sprite_list (arcade.SpriteList): All enemy sprites, for drawing
+    """
+    
+    def __init__(self):
+        """Start with no enemies."""
+        
+        self._textures = None
+        self.kinds = []
+        self.x = array("d")
+        self.y = array("d")
+        self.health = array("i")
+        self.state = array("b")
+        self.timer = array("d")
+        self.cooldown = array("d")
+        self.facing_left = array("b")
+        self._shown = array("i")
+        self._bucket = []
+        self._buckets = {}
+        self.sprites = []
+        self.sprite_list = arcade.SpriteList()
+
+    @property
+    def textures(self):
+        """dict: Enemy frames by kind, loaded when first needed."""
+        
+        # Most levels have no enemies, so skip decoding the sheets 
+        # until one spawns
+        if self._textures is None:
+            self._textures = load_enemy_textures()
+        return self._textures
+
+    @classmethod
+    def from_level(cls, level_data):
+        """
+        Spawn the enemies placed on a level's Enemies object layer.
+        
+        The kind is taken from an object's "enemy" property, falling 
+        back to its class (type) and then its name.
+        
+        Args:
+            level_data (LevelData): The loaded level
+            
+        Returns:
+            EnemySwarm: The level's enemies
+        """
+        
+        swarm = cls()
+        for tiled_object in level_data.object_lists.get(ENEMY_LAYER, ()):
+            properties = tiled_object.properties or {}
+            kind = (properties.get("enemy") or tiled_object.type 
+                    or tiled_object.name)
+            if kind not in ENEMY_KINDS:
+                continue
+            
+            # Spawn at the centre of the object's shape
+            shape = tiled_object.shape
+            if isinstance(shape[0], (int, float)):
+                x, y = shape[:2]
+            else:
+                x = sum(point[0] for point in shape) / len(shape)
+                y = sum(point[1] for point in shape) / len(shape)
+            swarm.spawn(kind, x, y)
+            
+        return swarm
+
+    def __len__(self):
+        """Return the number of enemies, living or dead."""
+        
+        return len(self.kinds)
+
+    def spawn(self, kind, x, y):
+        """
+        Add an enemy.
+        
+        Args:
+            kind (str): Key of ENEMY_KINDS
+            x, y (float): World position
+            
+        Returns:
+            int: Index of the new enemy
+        """
+        
+        self.kinds.append(kind)
+        self.x.append(x)
+        self.y.append(y)
+        self.health.append(ENEMY_KINDS[kind]["health"])
+        self.state.append(ENEMY_IDLE)
+        self.timer.append(0.0)
+        self.cooldown.append(0.0)
+        self.facing_left.append(0)
+        self._shown.append(-1)
+        
+        bucket = self._bucket_at(x, y)
+        self._bucket.append(bucket)
+        self._buckets.setdefault(bucket, []).append(len(self.kinds) - 1)
+        
+        sprite = arcade.Sprite(
+            self.textures[kind][ENEMY_IDLE][0][0], ENEMY_SCALING, x, y
+        )
+        self.sprites.append(sprite)
+        self.sprite_list.append(sprite)
+        
+        return len(self.kinds) - 1
+
+    def _bucket_at(self, x, y):
+        """Return the spatial hash bucket of a world position."""
+        
+        return (int(x // ENEMY_HASH_CELL_SIZE), 
+                int(y // ENEMY_HASH_CELL_SIZE))
+
+    def _move_bucket(self, index, x, y):
+        """Rehash an enemy if it crossed into another bucket."""
+        
+        bucket = self._bucket_at(x, y)
+        old_bucket = self._bucket[index]
+        if bucket != old_bucket:
+            members = self._buckets[old_bucket]
+            members.remove(index)
+            if not members:
+                del self._buckets[old_bucket]
+            self._buckets.setdefault(bucket, []).append(index)
+            self._bucket[index] = bucket
+
+    def in_box(self, left, bottom, right, top):
+        """
+        Find the living enemies whose bodies overlap a box.
+        
+        Only the spatial hash buckets under the box are visited.
+        
+        Args:
+            left, bottom, right, top (float): Box in world pixels
+            
+        Returns:
+            list: Indices of the enemies inside the box
+        """
+        
+        radius = ENEMY_RADIUS
+        first_column, first_row = self._bucket_at(left - radius, 
+                                                  bottom - radius)
+        last_column, last_row = self._bucket_at(right + radius, 
+                                                top + radius)
+        
+        found = []
+        for column in range(first_column, last_column + 1):
+            for row in range(first_row, last_row + 1):
+                for i in self._buckets.get((column, row), ()):
+                    if self.state[i] == ENEMY_DEAD:
+                        continue
+                    x, y = self.x[i], self.y[i]
+                    if left - radius <= x <= right + radius and \
+                            bottom - radius <= y <= top + radius:
+                        found.append(i)
+                        
+        return found
+
+    def hurt(self, index, amount=1):
+        """
+        Damage an enemy, killing it when its health runs out.
+        
+        Args:
+            index (int): Enemy to damage
+            amount (int): Health to take away
+            
+        Returns:
+            bool: True if the enemy was alive to take the damage
+        """
+        
+        if self.state[index] == ENEMY_DEAD:
+            return False
+        
+        self.health[index] -= amount
+        self.state[index] = (
+            ENEMY_DEAD if self.health[index] <= 0 else ENEMY_HURT
+        )
+        self.timer[index] = 0.0
+        
+        return True
+
+    def update(self, delta_time, player, tile_grid, flow_field=None):
+        """
+        Run AI, movement and animation for every enemy.
+        
+        Args:
+            delta_time (float): Time since last update
+            player (PlayerCharacter): The player being hunted
+            tile_grid (TileGrid): Grid with the SOLID_GRID_LAYER walls
+            flow_field (FlowField): Paths to the player, already 
+                updated for this tick. Without one enemies walk 
+                straight at the player
+            
+        Returns:
+            int: Damage dealt to the player by attacks landing now
+        """
+        
+        kinds = self.kinds
+        xs, ys = self.x, self.y
+        states, timers = self.state, self.timer
+        cooldowns, facing = self.cooldown, self.facing_left
+        shown, sprites, textures = self._shown, self.sprites, self.textures
+        
+        player_x, player_y = player.center_x, player.center_y
+        player_alive = not player.is_dead
+        occupied = tile_grid.occupied
+        next_cell = flow_field.next_cell if flow_field else None
+        radius = ENEMY_RADIUS
+        step_scale = delta_time * 60
+        damage = 0
+        
+        for i in range(len(kinds)):
+            kind = ENEMY_KINDS[kinds[i]]
+            state = states[i]
+            timers[i] += delta_time
+            
+            if state == ENEMY_DEAD:
+                # Corpses keep the last death frame once it is showing
+                death_frames = len(textures[kinds[i]][ENEMY_DEAD][0])
+                if timers[i] * ENEMY_ANIMATION_FPS > death_frames:
+                    continue
+                
+            elif state == ENEMY_HURT:
+                if timers[i] >= ENEMY_HURT_TIME:
+                    state = ENEMY_IDLE
+                    
+            else:
+                x, y = xs[i], ys[i]
+                dx = player_x - x
+                dy = player_y - y
+                distance_squared = dx * dx + dy * dy
+                cooldowns[i] -= delta_time
+                
+                if not player_alive:
+                    state = ENEMY_IDLE
+                    
+                elif distance_squared <= kind["reach"] ** 2:
+                    state = ENEMY_ATTACK
+                    if cooldowns[i] <= 0:
+                        cooldowns[i] = kind["attack_time"]
+                        damage += kind["damage"]
+                        
+                elif distance_squared <= kind["sight"] ** 2:
+                    state = ENEMY_MOVE
+                    
+                    # Head for the next cell on the path, or straight 
+                    # at the player once in the same cell
+                    move_x, move_y = dx, dy
+                    waypoint = next_cell(x, y) if next_cell else None
+                    if waypoint is not None:
+                        move_x = waypoint[0] - x
+                        move_y = waypoint[1] - y
+                    length = (move_x * move_x + move_y * move_y) ** 0.5
+                    
+                    # Move one axis at a time so walls can be slid along
+                    step = kind["speed"] * step_scale / max(length, 1e-9)
+                    new_x = x + move_x * step
+                    if not occupied(SOLID_GRID_LAYER, new_x - radius, 
+                                    y - radius, new_x + radius, 
+                                    y + radius):
+                        x = new_x
+                    new_y = y + move_y * step
+                    if not occupied(SOLID_GRID_LAYER, x - radius, 
+                                    new_y - radius, x + radius, 
+                                    new_y + radius):
+                        y = new_y
+                    
+                    if x != xs[i] or y != ys[i]:
+                        xs[i], ys[i] = x, y
+                        sprites[i].position = (x, y)
+                        self._move_bucket(i, x, y)
+                        
+                else:
+                    state = ENEMY_IDLE
+                
+                facing[i] = dx < 0
+            
+            if state != states[i]:
+                states[i] = state
+                timers[i] = 0.0
+            
+            # Pick the frame and only swap textures when it changes
+            frames = textures[kinds[i]][state][facing[i]]
+            frame = int(timers[i] * ENEMY_ANIMATION_FPS)
+            if state == ENEMY_DEAD:
+                frame = min(frame, len(frames) - 1)
+            else:
+                frame %= len(frames)
+            
+            key = (state * 64 + frame) * 2 + facing[i]
+            if key != shown[i]:
+                shown[i] = key
+                sprites[i].texture = frames[frame]
+                
+        return damage
+
+
+class LevelData:
+    """
+    Sprite lists and raw tile data for one loaded level.
+    
+    Has the same sprite_lists mapping as arcade.TileMap, so it can be 
+    handed to arcade.Scene.from_tilemap.
+    
+    Attributes:
+        width (int): Map width in tiles
+        height (int): Map height in tiles
+        tile_width (int): Tile width in pixels before scaling
+        tile_height (int): Tile height in pixels before scaling
+        sprite_lists (OrderedDict): Layer name -> arcade.SpriteList
+        layer_properties (dict): Layer name -> Tiled layer properties
+        gids (dict): Layer name -> array of raw gids in row order
+        object_lists (dict): Object layer name -> list of TiledObject,
+            tile objects reduced to their centre
+    """
+    
+    def __init__(self, width, height, tile_width, tile_height):
+        """Create an empty level of the given size."""
+        
+        self.width = width
+        self.height = height
+        self.tile_width = tile_width
+        self.tile_height = tile_height
+        self.sprite_lists = OrderedDict()
+        self.layer_properties = {}
+        self.gids = {}
+        self.object_lists = {}
+
+
+def compiled_level_path(map_path):
+    """Return where the compiled cache for a .tmx file is stored."""
+    
+    return os.path.splitext(map_path)[0] + COMPILED_LEVEL_EXTENSION
+
+
+def _file_signature(path, map_dir):
+    """
+    Describe a source file so a compiled level can be validated.
+    
+    Returns:
+        list: [relative path, mtime in ns, size, sha1 of contents]
+    """
+    
+    stat = os.stat(path)
+    with open(path, "rb") as source:
+        digest = hashlib.sha1(source.read()).hexdigest()
+        
+    return [os.path.relpath(path, map_dir), stat.st_mtime_ns, 
+            stat.st_size, digest]
+
+
+def _sources_unchanged(sources, map_dir):
+    """
+    Check that every source file of a compiled level is unchanged.
+    
+    The mtime and size are checked first, the contents are only hashed
+    when those differ (e.g. after a fresh checkout).
+    """
+    
+    for relative_path, mtime, size, digest in sources:
+        path = os.path.join(map_dir, relative_path)
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return False
+        
+        if stat.st_mtime_ns == mtime and stat.st_size == size:
+            continue
+        
+        with open(path, "rb") as source:
+            if hashlib.sha1(source.read()).hexdigest() != digest:
+                return False
+            
+    return True
+
+
+def compile_level(map_path):
+    """
+    Parse a .tmx map once and write its compiled cache next to it.
+
+    The compiled file holds a small JSON header (layers, resolved 
+    tileset images, hit boxes, animations, objects and the signature 
+    of every source file) followed by packed buffers: the raw gids of
+    each layer and the precomputed sprite positions at TILE_SCALING.
+    
+    Args:
+        map_path (str): Path of the .tmx file
+        
+    Returns:
+        tuple: (meta dict, buffer bytes), the same data 
+        read_compiled_level returns
+    """
+    
+    map_dir = os.path.dirname(os.path.abspath(map_path))
+    tilemap = arcade.TileMap(
+        map_path, scaling=TILE_SCALING, 
+        texture_cache_manager=TEXTURE_CACHE, lazy=True
+    )
+    tiled_map = tilemap.tiled_map
+
+    images = []
+    textures = {}
+    tiles = {}
+    layers = []
+    buffers = bytearray()
+
+    def image_index(image_file):
+        relative_path = os.path.relpath(
+            os.path.join(map_dir, image_file), map_dir
+        )
+        if relative_path not in images:
+            images.append(relative_path)
+        return images.index(relative_path)
+
+    def texture_index(tile, region):
+        # Base (unflipped) texture with its hit box computed once here
+        key = (image_index(tile.image or tile.tileset.image), *region)
+        if key not in textures:
+            texture = TEXTURE_CACHE.load_region(
+                os.path.join(map_dir, images[key[0]]), region
+            )
+            textures[key] = [
+                len(textures), key[0], list(region), 
+                [list(p) for p in texture.hit_box_points]
+            ]
+        return textures[key][0]
+
+    def add_buffer(values):
+        offset = len(buffers)
+        buffers.extend(values.tobytes())
+        return [offset, len(values)]
+
+    # The gids in each layer resolve to tile descriptors
+    for layer in tiled_map.layers:
+        if not isinstance(layer, pytiled_parser.TileLayer):
+            continue
+        
+        sprite_list = tilemap.sprite_lists[layer.name]
+        gids = array("I", (gid for row in layer.data for gid in row))
+        positions = array("f")
+        
+        # Sprites were created in the same order as the non-empty gids
+        sprites = iter(sprite_list)
+        for gid in gids:
+            if gid == 0:
+                continue
+            sprite = next(sprites)
+            positions.extend((sprite.center_x, sprite.center_y))
+            
+            if gid in tiles:
+                continue
+            
+            # Private arcade helpers keep flips and regions identical
+            # to what arcade.TileMap builds
+            tile = tilemap._get_tile_by_gid(gid)
+            region = arcade.tilemap.tilemap._get_image_info_from_tileset(
+                tile
+            )
+            frames = None
+            if tile.animation:
+                frames = []
+                for frame in tile.animation:
+                    frame_tile = tilemap._get_tile_by_gid(
+                        tile.tileset.firstgid + frame.tile_id
+                    )
+                    frame_region = (0, 0, 0, 0)
+                    if frame_tile.tileset.image:
+                        frame_region = arcade.tilemap.tilemap.\
+                            _get_image_info_from_tileset(frame_tile)
+                    frames.append([
+                        texture_index(frame_tile, frame_region),
+                        frame.duration, frame.tile_id
+                    ])
+                base = frames[0][0]
+            else:
+                base = texture_index(tile, region)
+                
+            tiles[gid] = {
+                "texture": base,
+                "flip": [tile.flipped_diagonally, 
+                         tile.flipped_horizontally,
+                         tile.flipped_vertically],
+                "hit_box": [list(p) for p in sprite.hit_box.points],
+                "frames": frames,
+                "properties": dict(sprite.properties)
+            }
+
+        layers.append({
+            "name": layer.name,
+            "visible": layer.visible,
+            "alpha": int(layer.opacity * 255) if layer.opacity else 255,
+            "properties": dict(layer.properties or {}),
+            "gids": add_buffer(gids),
+            "positions": add_buffer(positions)
+        })
+
+    # Object layers keep each object's shape and properties. Tile 
+    # objects become a point at the tile's centre
+    objects = {}
+    for layer in tiled_map.layers:
+        if not isinstance(layer, pytiled_parser.ObjectLayer):
+            continue
+        
+        entries = objects.setdefault(layer.name, [])
+        for tiled_object in tilemap.object_lists.get(layer.name, ()):
+            entries.append({
+                "shape": tiled_object.shape,
+                "properties": dict(tiled_object.properties or {}),
+                "name": tiled_object.name,
+                "type": tiled_object.type
+            })
+        for sprite in tilemap.sprite_lists.get(layer.name, ()):
+            entries.append({
+                "shape": [sprite.center_x, sprite.center_y],
+                "properties": dict(sprite.properties),
+                "name": sprite.properties.get("name"),
+                "type": sprite.properties.get("class")
+            })
+
+    # Every file the compiled data depends on
+    tree = ElementTree.parse(map_path)
+    source_files = [os.path.abspath(map_path)]
+    source_files += [
+        os.path.join(map_dir, tileset.get("source"))
+        for tileset in tree.getroot().iter("tileset")
+        if tileset.get("source")
+    ]
+    source_files += [os.path.join(map_dir, image) for image in images]
+
+    meta = {
+        "byteorder": sys.byteorder,
+        "width": tilemap.width,
+        "height": tilemap.height,
+        "tile_width": tilemap.tile_width,
+        "tile_height": tilemap.tile_height,
+        "sources": [_file_signature(path, map_dir) 
+                    for path in source_files],
+        "images": images,
+        "textures": sorted(textures.values()),
+        "tiles": {str(gid): tile for gid, tile in tiles.items()},
+        "layers": layers,
+        "objects": objects
+    }
+    meta_bytes = json.dumps(meta, separators=(",", ":"), 
+                            default=str).encode("utf-8")
+
+    # Write next to the cache and swap it in, so a crash or another 
+    # process compiling the same map never leaves a truncated file
+    compiled_path = compiled_level_path(map_path)
+    temp_path = f"{compiled_path}.{os.getpid()}.{threading.get_ident()}"
+    try:
+        with open(temp_path, "wb") as compiled:
+            compiled.write(struct.pack(
+                "<4sHI", COMPILED_LEVEL_MAGIC, COMPILED_LEVEL_VERSION,
+                len(meta_bytes)
+            ))
+            compiled.write(meta_bytes)
+            compiled.write(buffers)
+        os.replace(temp_path, compiled_path)
+    except OSError:
+        # Read-only install, the level is simply compiled every time
+        try:
+            os.remove(temp_path)
+        except OSError:
+            pass
+        
+    return json.loads(meta_bytes), bytes(buffers)
+
+
+def read_compiled_level(map_path):
+    """
+    Read the compiled cache of a map if it is present and up to date.
+    
+    Args:
+        map_path (str): Path of the .tmx file
+        
+    Returns:
+        tuple: (meta dict, buffer bytes) or None when the cache is 
+        missing, from another version or older than its sources
+    """
+    
+    compiled_path = compiled_level_path(map_path)
+    header_size = struct.calcsize("<4sHI")
+    
+    try:
+        with open(compiled_path, "rb") as compiled:
+            data = compiled.read()
+    except OSError:
+        return None
+    
+    if len(data) < header_size:
+        return None
+    
+    magic, version, meta_length = struct.unpack_from("<4sHI", data)
+    if magic != COMPILED_LEVEL_MAGIC or version != COMPILED_LEVEL_VERSION:
+        return None
+
+    if len(data) < header_size + meta_length:
+        return None
+    
+    try:
+        meta = json.loads(data[header_size:header_size + meta_length])
+        map_dir = os.path.dirname(os.path.abspath(map_path))
+        if not _sources_unchanged(meta["sources"], map_dir):
+            return None
+        _check_buffers(meta, len(data) - header_size - meta_length)
+    except (ValueError, KeyError, TypeError, struct.error):
+        # Damaged cache, compile the level again
+        return None
+    
+    return meta, data[header_size + meta_length:]
+
+
+def _unpack_buffer(buffers, meta, typecode, offset_count):
+    """Unpack one typed array from the compiled buffer block."""
+    
+    offset, count = offset_count
+    values = array(typecode)
+    values.frombytes(
+        buffers[offset:offset + count * values.itemsize]
+    )
+    if meta["byteorder"] != sys.byteorder:
+        values.byteswap()
+    return values
+
+
+def _check_buffers(meta, buffer_size):
+    """
+    Check that every layer's arrays fit in the compiled buffer block.
+    
+    Args:
+        meta (dict): Compiled level header
+        buffer_size (int): Length of the buffer block in bytes
+        
+    Raises:
+        ValueError: When a layer points past the end of the block
+    """
+    
+    for layer in meta["layers"]:
+        for key, typecode in (("gids", "I"), ("positions", "f")):
+            offset, count = layer[key]
+            if offset < 0 or count < 0 or (
+                offset + count * array(typecode).itemsize > buffer_size
+            ):
+                raise ValueError(
+                    f"Layer {layer['name']} is truncated in the "
+                    "compiled level"
+                )
+
+
+def chunk_key(x, y, chunk_size):
+    """
+    Return the chunk holding a point.
+    
+    Args:
+        x (float): World x
+        y (float): World y
+        chunk_size (float): Chunk width and height in world pixels
+        
+    Returns:
+        tuple: (column, row) of the chunk
+    """
+    
+    return (int(x // chunk_size), int(y // chunk_size))
+
+
+def bake_chunk(tiles, name):
+    """
+    Pre-render the static tiles of one chunk into a single sprite.
+    
+    Tiles are pasted at their unscaled size in the order given, so 
+    later tiles cover earlier ones just as when drawn. The image only
+    covers the tiles given. Safe to call from a worker thread.
+    
+    Args:
+        tiles (list): (center_x, center_y, image) for every tile, 
+            image being the tile as it is drawn, flips applied
+        name (str): Unique name for the chunk texture
+        
+    Returns:
+        arcade.Sprite: Sprite showing the chunk
+    """
+    
+    # Tile corners in unscaled pixels
+    corners = [
+        (center_x / TILE_SCALING - image.width / 2,
+         center_y / TILE_SCALING + image.height / 2)
+        for center_x, center_y, image in tiles
+    ]
+    left = min(x for x, _ in corners)
+    top = max(y for _, y in corners)
+    right = max(x + image.width 
+                for (x, _), (_, _, image) in zip(corners, tiles))
+    bottom = min(y - image.height 
+                 for (_, y), (_, _, image) in zip(corners, tiles))
+    
+    canvas = Image.new(
+        "RGBA", (round(right - left), round(top - bottom)), (0, 0, 0, 0)
+    )
+    for (x, y), (_, _, image) in zip(corners, tiles):
+        canvas.alpha_composite(image, (round(x - left), round(top - y)))
+    
+    texture = arcade.Texture(
+        canvas, 
+        hit_box_algorithm=arcade.hitbox.algo_bounding_box,
+        hash=f"baked_chunk_{name}"
+    )
+    return arcade.Sprite(
+        texture, TILE_SCALING,
+        (left + right) / 2 * TILE_SCALING,
+        (bottom + top) / 2 * TILE_SCALING
+    )
+
+
+class ChunkedSpriteList(arcade.SpriteList):
+    """
+    Sprite list for a static layer that only draws what is in view.
+    
+    The list still holds every sprite, so it can be searched, 
+    collided with and iterated like any other. For drawing, the 
+    sprites are also sorted by centre into square chunks, each with 
+    its own sprite list, and draw() only draws the chunks that overlap
+    the view. Sprites must not move or be added after the list is 
+    built; removing them is fine.
+    
+    A baked layer draws one pre-rendered sprite per chunk in place of 
+    its static tiles, plus the tiles left live. Streamed levels add 
+    and remove whole chunks of these as the camera moves.
+    
+    Attributes:
+        chunk_size (float): Chunk width and height in world pixels
+        chunks (dict): (column, row) -> arcade.SpriteList
+        view (arcade.types.Rect): World area to draw, set every frame
+            by the game. Everything is drawn while it is None
+    """
+    
+    def __init__(self, sprites=(), chunk_size=768, baked=None, 
+                 **kwargs):
+        """
+        Fill the list and sort its sprites into chunks.
+        
+        Args:
+            sprites: Sprites of the layer
+            chunk_size (float): Chunk width and height in world pixels
+            baked (tuple): (chunk key -> sprite from bake_chunk(), 
+                live sprites) to draw instead of the layer's sprites
+            **kwargs: Passed on to arcade.SpriteList
+        """
+        
+        super().__init__(**kwargs)
+        self.extend(sprites)
+        
+        self.chunk_size = chunk_size
+        self.chunks = {}
+        self.view = None
+        
+        # Views are widened by the most any sprite hangs over the 
+        # edge of its chunk
+        self._margin = 0.0
+        
+        # What gets drawn: pre-rendered chunks first, then live tiles
+        if baked:
+            for key, sprite in baked[0].items():
+                self.add_to_chunk(key, (sprite,))
+        for sprite in (baked[1] if baked else self):
+            self.add_to_chunk(
+                chunk_key(sprite.center_x, sprite.center_y, chunk_size),
+                (sprite,)
+            )
+
+    def add_to_chunk(self, key, sprites, under=False):
+        """
+        Draw sprites as part of a chunk.
+        
+        Only affects drawing: sprites that should also be searched or
+        animated with the layer must be added to the list as well.
+        
+        Args:
+            key (tuple): (column, row) of the chunk
+            sprites: Sprites to add
+            under (bool): Draw them under what the chunk already holds
+        """
+        
+        chunk = self.chunks.get(key)
+        if chunk is None:
+            chunk = self.chunks[key] = arcade.SpriteList()
+        
+        column, row = key
+        size = self.chunk_size
+        for index, sprite in enumerate(sprites):
+            if under:
+                chunk.insert(index, sprite)
+            else:
+                chunk.append(sprite)
+            
+            half_width = sprite.width / 2
+            half_height = sprite.height / 2
+            self._margin = max(
+                self._margin,
+                column * size - (sprite.center_x - half_width),
+                sprite.center_x + half_width - (column + 1) * size,
+                row * size - (sprite.center_y - half_height),
+                sprite.center_y + half_height - (row + 1) * size
+            )
+
+    def remove_from_chunk(self, key, sprites):
+        """
+        Stop drawing sprites added with add_to_chunk().
+        
+        Args:
+            key (tuple): (column, row) of the chunk
+            sprites: Sprites to remove
+        """
+        
+        chunk = self.chunks[key]
+        for sprite in sprites:
+            chunk.remove(sprite)
+        if not chunk:
+            del self.chunks[key]
+
+    def visible_chunks(self, view):
+        """
+        List the chunks that overlap a world area.
+        
+        Args:
+            view (arcade.types.Rect): World area
+            
+        Returns:
+            list: Sprite lists of the chunks in view
+        """
+        
+        margin, size = self._margin, self.chunk_size
+        first_column = int((view.left - margin) // size)
+        last_column = int((view.right + margin) // size)
+        first_row = int((view.bottom - margin) // size)
+        last_row = int((view.top + margin) // size)
+        
+        chunks = self.chunks
+        return [
+            chunks[(column, row)]
+            for row in range(first_row, last_row + 1)
+            for column in range(first_column, last_column + 1)
+            if (column, row) in chunks
+        ]
+
+    def draw(self, **kwargs):
+        """Draw the chunks in view, or everything without a view."""
+        
+        if self.view is None:
+            super().draw(**kwargs)
+            return
+        
+        if not self.visible:
+            return
+        
+        for chunk in self.visible_chunks(self.view):
+            chunk.draw(**kwargs)
+
+
+class PreparedLevel:
+    """
+    A level whose textures and sprites have been created but not yet
+    put into sprite lists.
+    
+    Everything in here can be built on a worker thread. Turning it 
+    into a LevelData creates the sprite lists, which needs the 
+    window's OpenGL context and so must happen on the main thread.
+    
+    Attributes:
+        width (int): Map width in tiles
+        height (int): Map height in tiles
+        tile_width (int): Tile width in pixels before scaling
+        tile_height (int): Tile height in pixels before scaling
+        layers (list): (name, visible, properties, gids, sprites) 
+            for every layer in draw order
+        object_lists (dict): Object layer name -> list of TiledObject
+        chunk_size (float): Chunk width and height in world pixels
+        baked (dict): Layer name -> (chunk key -> sprite, live 
+            sprites) for the layers pre-rendered by bake_chunk()
+        streamed (bool): Whether chunk images and the tiles of 
+            STREAMED_LAYERS are left for prepare_chunk()
+        stream_keys (set): Chunks prepare_chunk() has anything for
+    """
+    
+    def __init__(self, map_path, meta, buffers, streamed=False):
+        """
+        Create the textures and sprites of a level from compiled data.
+        
+        Args:
+            map_path (str): Path of the .tmx file the data came from
+            meta (dict): Compiled header
+            buffers (bytes): Compiled buffer block
+            streamed (bool): Leave chunk images and draw-only tiles 
+                to be created chunk by chunk as the camera nears them
+        """
+        
+        self.width = meta["width"]
+        self.height = meta["height"]
+        self.tile_width = meta["tile_width"]
+        self.tile_height = meta["tile_height"]
+        self.chunk_size = CHUNK_SIZE_TILES * self.tile_width * TILE_SCALING
+        self.streamed = streamed
+        self.layers = []
+        self._map_path = os.path.abspath(map_path)
+        
+        # JSON turned the shape tuples into lists
+        def shape(points):
+            if points and isinstance(points[0], (int, float)):
+                return tuple(points)
+            return [tuple(point) for point in points]
+        
+        self.object_lists = {
+            name: [
+                arcade.tilemap.tilemap.TiledObject(
+                    shape(entry["shape"]), entry["properties"], 
+                    entry["name"], entry["type"]
+                )
+                for entry in entries
+            ]
+            for name, entries in meta["objects"].items()
+        }
+        
+        map_dir = os.path.dirname(os.path.abspath(map_path))
+        
+        # Base textures, decoded once per source image through the cache
+        base_textures = [
+            TEXTURE_CACHE.load_region(
+                os.path.join(map_dir, meta["images"][image]),
+                tuple(region),
+                [tuple(p) for p in hit_box]
+            )
+            for _, image, region, hit_box in meta["textures"]
+        ]
+        
+        def flipped(texture, flip):
+            diagonal, horizontal, vertical = flip
+            if diagonal:
+                texture = texture.flip_diagonally()
+            if horizontal:
+                texture = texture.flip_horizontally()
+            if vertical:
+                texture = texture.flip_vertically()
+            return texture
+
+        # Resolve every tile once, sprites then only copy references
+        tiles = {}
+        for gid, tile in meta["tiles"].items():
+            frames = None
+            if tile["frames"]:
+                frames = [
+                    arcade.TextureKeyframe(
+                        flipped(base_textures[texture], tile["flip"]),
+                        duration=duration, tile_id=tile_id
+                    )
+                    for texture, duration, tile_id in tile["frames"]
+                ]
+            texture = flipped(base_textures[tile["texture"]], tile["flip"])
+            hit_box = [tuple(p) for p in tile["hit_box"]]
+            tiles[int(gid)] = (texture, frames, hit_box, tile["properties"])
+        
+        self._tiles = tiles
+        self._tile_records = meta["tiles"]
+        self._base_textures = base_textures
+        self._tile_images = {}
+        
+        # Static tiles of the current run of baked layers by chunk, and
+        # the layers in it as (name, live sprites)
+        self.baked = {}
+        run_tiles = {}
+        run_layers = []
+        
+        # Streamed levels keep the runs' tiles, and the animated tiles 
+        # of draw-only layers, to create chunk by chunk
+        self._stream_runs = []
+        self._stream_live = {}
+        
+        def bake_run():
+            if run_layers:
+                first = run_layers[0][0]
+                if streamed:
+                    self._stream_runs.append((first, dict(run_tiles)))
+                    chunks = {}
+                else:
+                    chunks = {
+                        key: bake_chunk(tiles, self._chunk_name(first, key))
+                        for key, tiles in run_tiles.items()
+                    }
+                for name, live in run_layers:
+                    self.baked[name] = (chunks, live)
+                    chunks = {}
+            run_tiles.clear()
+            run_layers.clear()
+
+        for layer in meta["layers"]:
+            name = layer["name"]
+            alpha = layer["alpha"]
+            gids = _unpack_buffer(buffers, meta, "I", layer["gids"])
+            positions = _unpack_buffer(
+                buffers, meta, "f", layer["positions"]
+            )
+            
+            # Foreground layers are not drawn in the scene, so they do 
+            # not split a run
+            bake = name in BAKED_LAYERS and layer["visible"]
+            if not bake and name not in FOREGROUND_LAYERS:
+                bake_run()
+            live = []
+            
+            # Draw-only layers of a streamed level get no sprites here
+            deferred = streamed and bake and name in STREAMED_LAYERS
+            deferred_live = {}
+            
+            sprites = []
+            position = 0
+            for gid in gids:
+                if gid == 0:
+                    continue
+                
+                center_x = positions[position]
+                center_y = positions[position + 1]
+                position += 2
+                animated = bool(tiles[gid][1])
+                
+                if bake and not animated:
+                    run_tiles.setdefault(
+                        chunk_key(center_x, center_y, self.chunk_size), []
+                    ).append(
+                        (center_x, center_y, self._tile_image(gid, alpha))
+                    )
+                    if deferred:
+                        continue
+                elif deferred:
+                    deferred_live.setdefault(
+                        chunk_key(center_x, center_y, self.chunk_size), []
+                    ).append((gid, center_x, center_y, alpha))
+                    continue
+                
+                sprite = self._tile_sprite(gid, center_x, center_y, alpha)
+                sprites.append(sprite)
+                if bake and animated:
+                    live.append(sprite)
+            
+            if deferred_live:
+                self._stream_live[name] = deferred_live
+            
+            # Live tiles must draw above everything baked so far, so 
+            # they end the run
+            if bake:
+                run_layers.append((name, live))
+                if live or deferred_live:
+                    bake_run()
+
+            self.layers.append((
+                name, layer["visible"], layer["properties"], gids, sprites
+            ))
+        bake_run()
+        
+        self.stream_keys = set()
+        for _, chunks in self._stream_runs:
+            self.stream_keys.update(chunks)
+        for chunks in self._stream_live.values():
+            self.stream_keys.update(chunks)
+
+    def _tile_sprite(self, gid, center_x, center_y, alpha):
+        """
+        Create the sprite for one tile.
+        
+        Args:
+            gid (int): Global tile id
+            center_x (float): World x of the tile centre
+            center_y (float): World y of the tile centre
+            alpha (int): Opacity of the tile's layer
+            
+        Returns:
+            arcade.Sprite: The tile, animated if it has frames
+        """
+        
+        texture, frames, hit_box, properties = self._tiles[gid]
+        if frames:
+            sprite = arcade.TextureAnimationSprite(
+                center_x, center_y,
+                path_or_texture=frames[0].texture,
+                scale=TILE_SCALING,
+                animation=arcade.TextureAnimation(keyframes=frames)
+            )
+        else:
+            sprite = arcade.Sprite(texture, TILE_SCALING, center_x, center_y)
+            
+        sprite.hit_box = arcade.hitbox.RotatableHitBox(
+            hit_box, position=sprite.position, scale=sprite.scale
+        )
+        sprite.properties.update(properties)
+        if alpha != 255:
+            sprite.alpha = alpha
+        return sprite
+
+    def _tile_image(self, gid, alpha):
+        """
+        Return a tile's image as drawn, for baking.
+        
+        Flipped textures share the unflipped image, so the flips are 
+        applied again here, along with the layer's opacity.
+        
+        Args:
+            gid (int): Global tile id
+            alpha (int): Opacity of the tile's layer
+            
+        Returns:
+            PIL.Image.Image: RGBA image at the tile's unscaled size
+        """
+        
+        image = self._tile_images.get((gid, alpha))
+        if image is None:
+            tile = self._tile_records[str(gid)]
+            texture = self._base_textures[tile["texture"]]
+            image = texture.image.convert("RGBA")
+            diagonal, horizontal, vertical = tile["flip"]
+            if diagonal:
+                image = image.transpose(Image.Transpose.TRANSPOSE)
+            if horizontal:
+                image = image.transpose(Image.Transpose.FLIP_LEFT_RIGHT)
+            if vertical:
+                image = image.transpose(Image.Transpose.FLIP_TOP_BOTTOM)
+            if alpha != 255:
+                image.putalpha(
+                    image.getchannel("A").point(
+                        lambda value: value * alpha // 255
+                    )
+                )
+            self._tile_images[(gid, alpha)] = image
+        return image
+
+    def _chunk_name(self, layer_name, key):
+        """Return the unique texture name of a baked chunk."""
+        
+        column, row = key
+        return f"{self._map_path}:{layer_name}_{column}_{row}"
+
+    def prepare_chunk(self, key):
+        """
+        Create what a streamed level draws in one chunk.
+        
+        Safe to call from a worker thread.
+        
+        Args:
+            key (tuple): (column, row) of the chunk
+            
+        Returns:
+            list: (layer name, sprites, baked) for every layer with 
+            something in the chunk. Baked sprites are pre-rendered 
+            tiles and draw under the rest of the layer's chunk
+        """
+        
+        parts = []
+        for name, chunks in self._stream_runs:
+            tiles = chunks.get(key)
+            if tiles:
+                sprite = bake_chunk(tiles, self._chunk_name(name, key))
+                parts.append((name, [sprite], True))
+                
+        for name, chunks in self._stream_live.items():
+            records = chunks.get(key)
+            if records:
+                sprites = [self._tile_sprite(*record) for record in records]
+                parts.append((name, sprites, False))
+                
+        return parts
+
+    def build(self, layer_options=None):
+        """
+        Put the prepared sprites into sprite lists.
+        
+        Must run on the main thread.
+        
+        Args:
+            layer_options (dict): Layer name -> {"use_spatial_hash": 
+                bool, "chunked": bool}. Chunked layers are built as 
+                ChunkedSpriteLists, as are baked layers
+            
+        Returns:
+            LevelData: The built level
+        """
+        
+        layer_options = layer_options or {}
+        level = LevelData(self.width, self.height, 
+                          self.tile_width, self.tile_height)
+        
+        for name, visible, properties, gids, sprites in self.layers:
+            options = layer_options.get(name, {})
+            use_spatial_hash = options.get("use_spatial_hash", False)
+            if options.get("chunked") or name in self.baked:
+                sprite_list = ChunkedSpriteList(
+                    sprites, self.chunk_size, baked=self.baked.get(name),
+                    use_spatial_hash=use_spatial_hash
+                )
+            else:
+                sprite_list = arcade.SpriteList(
+                    use_spatial_hash=use_spatial_hash
+                )
+                sprite_list.extend(sprites)
+            sprite_list.visible = visible
+            if properties:
+                sprite_list.properties = properties
+
+            level.sprite_lists[name] = sprite_list
+            level.layer_properties[name] = properties
+            level.gids[name] = gids
+        
+        level.object_lists = self.object_lists
+            
+        return level
+
+
+class SoundEffect:
+    """
+    A sound decoded in the background and played from a voice pool.
+    
+    Playing waits for the decode only if it has not finished yet. At 
+    most max_voices playbacks run at once, the oldest being cut off 
+    to make room, and a play within dedup_window seconds of the last 
+    one is dropped.
+    
+    Attributes:
+        file_name (str): Path of the sound file
+        streaming (bool): Whether the sound is streamed from disk
+        max_voices (int): Playbacks allowed at once
+        dedup_window (float): Seconds a repeat play is ignored for
+        voices (deque): pyglet players started, oldest first
+    """
+    
+    def __init__(self, future, file_name, streaming, max_voices, 
+                 dedup_window):
+        """
+        Wrap a sound being decoded.
+        
+        Args:
+            future (Future): Resolves to the arcade.Sound
+            file_name (str): Path of the sound file
+            streaming (bool): Whether the sound is streamed from disk
+            max_voices (int): Playbacks allowed at once
+            dedup_window (float): Seconds a repeat play is ignored for
+        """
+        
+        self._future = future
+        self.file_name = file_name
+        self.streaming = streaming
+        self.max_voices = max_voices
+        self.dedup_window = dedup_window
+        self.voices = deque()
+        self._last_played = float("-inf")
+        self._stream_used = False
+
+    @property
+    def sound(self):
+        """The decoded arcade.Sound, waiting for it if necessary."""
+        
+        # Decoding errors surface here, as a synchronous load would
+        return self._future.result()
+
+    def play(self, volume=1.0, pan=0.0, loop=False, speed=1.0):
+        """
+        Start a playback unless it repeats one that just started.
+        
+        Args:
+            volume (float): Volume, from 0 to 1
+            pan (float): Left to right balance, from -1 to 1
+            loop (bool): Whether to restart at the end
+            speed (float): Playback speed and pitch
+            
+        Returns:
+            pyglet.media.Player: The new voice, or None when dropped
+        """
+        
+        now = time.perf_counter()
+        if now - self._last_played < self.dedup_window:
+            return None
+        
+        sound = self.sound
+        
+        # Free the pool of finished voices, then cut off the oldest 
+        # if it is still full
+        voices = self.voices
+        if voices:
+            self.voices = voices = deque(
+                voice for voice in voices if voice.playing
+            )
+        if len(voices) >= self.max_voices:
+            sound.stop(voices.popleft())
+        
+        # A stream is read through once, so open the file again to 
+        # replay it rather than relying on it seeking back
+        if self.streaming and self._stream_used:
+            sound = arcade.Sound(self.file_name, streaming=True)
+            self._future = Future()
+            self._future.set_result(sound)
+        self._stream_used = self.streaming
+        
+        voice = sound.play(volume, pan, loop, speed)
+        voices.append(voice)
+        
+        # Only a voice that started counts towards the dedup window
+        self._last_played = now
+        return voice
+
+    def stop(self):
+        """Stop every voice of this sound."""
+        
+        sound = self.sound
+        while self.voices:
+            sound.stop(self.voices.popleft())
+
+
+class AudioManager:
+    """
+    Load sounds on a background thread so startup does not wait on 
+    decoding.
+    
+    Effects are decoded fully into memory for instant replay, while 
+    music is streamed from disk as it plays.
+    """
+    
+    def __init__(self, max_voices=AUDIO_MAX_VOICES, 
+                 dedup_window=AUDIO_DEDUP_WINDOW):
+        """
+        Start the decoding thread.
+        
+        Args:
+            max_voices (int): Default playbacks allowed per effect
+            dedup_window (float): Default seconds a repeat of an effect
+                is ignored for
+        """
+        
+        self._executor = ThreadPoolExecutor(
+            max_workers=1, thread_name_prefix="audio-decode"
+        )
+        self.max_voices = max_voices
+        self.dedup_window = dedup_window
+
+    def effect(self, file_name, max_voices=None):
+        """
+        Start decoding a sound effect.
+        
+        Args:
+            file_name (str): Path of the sound file
+            max_voices (int): Playbacks allowed at once, the manager's
+                default if None
+            
+        Returns:
+            SoundEffect: Handle to play the effect through
+        """
+        
+        return SoundEffect(
+            self._executor.submit(arcade.Sound, file_name), file_name,
+            False, max_voices or self.max_voices, self.dedup_window
+        )
+
+    def music(self, file_name):
+        """
+        Open a music track to be streamed.
+        
+        A streamed source can only play once at a time, so the track 
+        gets a single voice. It cannot loop either, so replay it when
+        its player ends.
+        
+        Args:
+            file_name (str): Path of the sound file
+            
+        Returns:
+            SoundEffect: Handle to play the track through
+        """
+        
+        return SoundEffect(
+            self._executor.submit(arcade.Sound, file_name, True), 
+            file_name, True, 1, 0.0
+        )
+
+    def shutdown(self):
+        """Stop the decoding thread once the queued sounds are decoded."""
+        
+        # Cancelled decodes would make later plays of those effects 
+        # raise, so let the queue finish in the background
+        self._executor.shutdown(wait=False, cancel_futures=False)
+
+
+def prepare_level(map_path, streamed=None):
+    """
+    Read (or compile) a level and create its sprites.
+    
+    Safe to call from a worker thread.
+    
+    Args:
+        map_path (str): Path of the .tmx file
+        streamed (bool): Whether to stream the level's chunks, or None
+            to stream maps of more than STREAM_MIN_TILES tiles
+        
+    Returns:
+        PreparedLevel: The level, ready to be built
+    """
+    
+    meta, buffers = read_compiled_level(map_path) or compile_level(map_path)
+    if streamed is None:
+        streamed = meta["width"] * meta["height"] > STREAM_MIN_TILES
+    return PreparedLevel(map_path, meta, buffers, streamed)
+
+
+def load_level_data(map_path, layer_options=None):
+    """
+    Load a level, compiling its .tmx into the binary cache if needed.
+    
+    Args:
+        map_path (str): Path of the .tmx file
+        layer_options (dict): Layer name -> {"use_spatial_hash": bool,
+            "chunked": bool}
+        
+    Returns:
+        LevelData: The loaded level
+    """
+    
+    return prepare_level(map_path).build(layer_options)
+
+
+class ChunkStreamer:
+    """
+    Load and release the chunks of a streamed level around the camera.
+    
+    Chunks in or a ring around the view are prepared on a worker 
+    thread and added to their layers on the main thread. Chunks the 
+    view itself needs are waited for, so nothing is drawn missing. 
+    Chunks the camera has left stay loaded until the estimated sprite
+    and GPU residency of all loaded chunks goes over the budget, then
+    the ones seen longest ago are released first. The budget only 
+    covers what the chunks hold once loaded; the level's tile data 
+    stays in memory while it is played. Chunks in or near the view are 
+    never released, so they alone may go over a very small budget.
+    
+    Attributes:
+        budget (int): Estimated bytes of sprite and GPU data the 
+            loaded chunks may hold
+        loaded_bytes (int): Estimated bytes of sprite and GPU data 
+            the loaded chunks hold
+        loaded (OrderedDict): Chunk key -> (bytes, parts), least 
+            recently in view first
+    """
+    
+    def __init__(self, prepared_level, sprite_lists, 
+                 budget=STREAM_RESIDENCY_BUDGET):
+        """
+        Start streaming a built level with nothing loaded.
+        
+        Args:
+            prepared_level (PreparedLevel): The streamed level
+            sprite_lists (dict): Layer name -> ChunkedSpriteList the 
+                level was built into
+            budget (int): Estimated bytes of sprite and GPU data 
+                the loaded chunks may hold
+        """
+        
+        self.prepared_level = prepared_level
+        self.sprite_lists = sprite_lists
+        self.budget = budget
+        self.loaded_bytes = 0
+        self.loaded = OrderedDict()
+        self._pending = {}
+        self._executor = ThreadPoolExecutor(
+            max_workers=1, thread_name_prefix="chunk-stream"
+        )
+
+    def _keys_around(self, view, margin):
+        """
+        List the chunks with content that overlap a widened view.
+        
+        Args:
+            view (arcade.types.Rect): World area
+            margin (float): World pixels to widen the view by
+            
+        Returns:
+            list: (column, row) keys
+        """
+        
+        size = self.prepared_level.chunk_size
+        keys = self.prepared_level.stream_keys
+        return [
+            (column, row)
+            for row in range(int((view.bottom - margin) // size),
+                             int((view.top + margin) // size) + 1)
+            for column in range(int((view.left - margin) // size),
+                                int((view.right + margin) // size) + 1)
+            if (column, row) in keys
+        ]
+
+    def update(self, view):
+        """
+        Load what the view needs and release what went over budget.
+        
+        Must run on the main thread.
+        
+        Args:
+            view (arcade.types.Rect): World area about to be drawn
+        """
+        
+        level = self.prepared_level
+        
+        # Tiles are sorted into chunks by centre, so one tile of 
+        # margin catches those hanging into the view
+        needed = set(self._keys_around(
+            view, level.tile_width * TILE_SCALING
+        ))
+        wanted = set(self._keys_around(
+            view, level.chunk_size * STREAM_PREFETCH_CHUNKS
+        ))
+        
+        for key in wanted:
+            if key in self.loaded:
+                self.loaded.move_to_end(key)
+            elif key not in self._pending:
+                self._pending[key] = self._executor.submit(
+                    level.prepare_chunk, key
+                )
+        
+        ready = [
+            key for key, future in self._pending.items()
+            if key in needed or future.done()
+        ]
+        for key in ready:
+            self._install(key, self._pending.pop(key).result())
+        
+        # Chunks still wanted were just moved to the end, so stop at
+        # the first one
+        while self.loaded_bytes > self.budget:
+            key = next(iter(self.loaded))
+            if key in wanted:
+                break
+            self._release(key)
+
+    def _install(self, key, parts):
+        """
+        Add a prepared chunk to its layers.
+        
+        Args:
+            key (tuple): (column, row) of the chunk
+            parts (list): Result of PreparedLevel.prepare_chunk()
+        """
+        
+        size = 0
+        for name, sprites, baked in parts:
+            sprite_list = self.sprite_lists[name]
+            sprite_list.add_to_chunk(key, sprites, under=baked)
+            if baked:
+                size += sum(
+                    sprite.texture.width * sprite.texture.height * 4
+                    for sprite in sprites
+                )
+            else:
+                # Live tiles are animated along with the layer
+                sprite_list.extend(sprites)
+                size += len(sprites) * STREAM_SPRITE_BYTES
+        
+        self.loaded[key] = (size, parts)
+        self.loaded_bytes += size
+
+    def _release(self, key):
+        """
+        Take a loaded chunk out of its layers.
+        
+        Args:
+            key (tuple): (column, row) of the chunk
+        """
+        
+        size, parts = self.loaded.pop(key)
+        for name, sprites, baked in parts:
+            sprite_list = self.sprite_lists[name]
+            sprite_list.remove_from_chunk(key, sprites)
+            if not baked:
+                for sprite in sprites:
+                    sprite_list.remove(sprite)
+        self.loaded_bytes -= size
+
+    def shutdown(self):
+        """Stop the worker thread, dropping chunks not yet started."""
+        
+        self._executor.shutdown(wait=False, cancel_futures=True)
+        self._pending.clear()
+
+
+def build_static_collision(sprite_lists, 
+                           cell_size=COLLISION_HASH_CELL_SIZE):
+    """
+    Combine static collision layers into one spatially hashed list.
+    
+    The list is built once per level and never drawn, so it is lazy 
+    and only holds the spatial hash used by the physics engine.
+    
+    Args:
+        sprite_lists (list): Sprite lists whose sprites never move
+        cell_size (int): Spatial hash cell size in pixels
+        
+    Returns:
+        arcade.SpriteList: Hashed list with every sprite
+    """
+    
+    collision_list = arcade.SpriteList(
+        use_spatial_hash=True,
+        spatial_hash_cell_size=cell_size,
+        lazy=True
+    )
+    for sprite_list in sprite_lists:
+        collision_list.extend(sprite_list)
+        
+    return collision_list
+
+
+class TileGrid:
+    """
+    Per-level occupancy grid for constant time tile queries.
+    
+    Every indexed layer gets a bytearray with one entry per map cell 
+    plus a cell -> sprites table. A query only visits the cells 
+    covered by the given box, so its cost does not depend on how many
+    sprites the layer holds. Sprites larger than a tile (arrows, 
+    flamethrowers) are registered in every cell their hit box covers.
+    
+    Attributes:
+        width (int): Map width in cells
+        height (int): Map height in cells
+        cell_size (float): Cell size in world pixels
+        occupancy (dict): Layer name -> bytearray, 1 where occupied
+    """
+    
+    def __init__(self, width, height, cell_size):
+        """
+        Create an empty grid.
+        
+        Args:
+            width (int): Map width in cells
+            height (int): Map height in cells
+            cell_size (float): Cell size in world pixels
+        """
+        
+        self.width = width
+        self.height = height
+        self.cell_size = cell_size
+        self.occupancy = {}
+        self._cells = {}
+
+    @classmethod
+    def from_level(cls, level_data, layer_names=GRID_LAYERS):
+        """
+        Build the grid for a loaded level.
+        
+        Args:
+            level_data (LevelData): The loaded level
+            layer_names (tuple): Layers to index
+            
+        Returns:
+            TileGrid: The filled grid
+        """
+        
+        grid = cls(level_data.width, level_data.height, 
+                   level_data.tile_width * TILE_SCALING)
+        for name in layer_names:
+            grid.add_layer(name, level_data.sprite_lists.get(name, ()))
+            
+        return grid
+
+    def _cell_range(self, left, bottom, right, top):
+        """Return the clamped (columns, rows) ranges covering a box."""
+        
+        first_column = max(int(left // self.cell_size), 0)
+        last_column = min(int(right // self.cell_size), self.width - 1)
+        first_row = max(int(bottom // self.cell_size), 0)
+        last_row = min(int(top // self.cell_size), self.height - 1)
+        
+        return (range(first_column, last_column + 1), 
+                range(first_row, last_row + 1))
+
+    def add_layer(self, name, sprites):
+        """
+        Index every sprite of a layer by the cells it covers.
+        
+        Args:
+            name (str): Layer name
+            sprites: Sprites in the layer
+        """
+        
+        occupancy = bytearray(self.width * self.height)
+        cells = {}
+        
+        for sprite in sprites:
+            columns, rows = self._cell_range(
+                sprite.left, sprite.bottom, sprite.right, sprite.top
+            )
+            for row in rows:
+                for column in columns:
+                    cell = row * self.width + column
+                    occupancy[cell] = 1
+                    cells.setdefault(cell, []).append(sprite)
+                    
+        self.occupancy[name] = occupancy
+        self._cells[name] = cells
+
+    def remove(self, name, sprite):
+        """
+        Take a sprite out of a layer, e.g. a collected key.
+        
+        Args:
+            name (str): Layer name
+            sprite (arcade.Sprite): Sprite to remove
+        """
+        
+        cells = self._cells.get(name)
+        if not cells:
+            return
+        
+        columns, rows = self._cell_range(
+            sprite.left, sprite.bottom, sprite.right, sprite.top
+        )
+        for row in rows:
+            for column in columns:
+                cell = row * self.width + column
+                sprites = cells.get(cell)
+                if sprites and sprite in sprites:
+                    sprites.remove(sprite)
+                    if not sprites:
+                        del cells[cell]
+                        self.occupancy[name][cell] = 0
+
+    def occupied(self, name, left, bottom, right, top):
+        """
+        Check the occupancy bitmap for any filled cell under a box.
+        
+        Args:
+            name (str): Layer name
+            left, bottom, right, top (float): Box in world pixels
+            
+        Returns:
+            bool: True if any covered cell is occupied
+        """
+        
+        occupancy = self.occupancy.get(name)
+        if occupancy is None:
+            return False
+        
+        columns, rows = self._cell_range(left, bottom, right, top)
+        for row in rows:
+            start = row * self.width
+            if any(occupancy[start + columns.start:start + columns.stop]):
+                return True
+            
+        return False
+
+    def sprites_in(self, name, left, bottom, right, top):
+        """
+        Return the sprites registered in the cells under a box.
+        
+        Args:
+            name (str): Layer name
+            left, bottom, right, top (float): Box in world pixels
+            
+        Returns:
+            list: Candidate sprites, each listed once
+        """
+        
+        cells = self._cells.get(name)
+        if not cells:
+            return []
+        
+        found = []
+        seen = set()
+        columns, rows = self._cell_range(left, bottom, right, top)
+        for row in rows:
+            for column in columns:
+                for sprite in cells.get(row * self.width + column, ()):
+                    if sprite not in seen:
+                        seen.add(sprite)
+                        found.append(sprite)
+                        
+        return found
+
+    def collisions(self, name, sprite):
+        """
+        Return the sprites of a layer whose hit boxes touch a sprite.
+        
+        Same result as arcade.check_for_collision_with_list, but only 
+        the sprites in the cells under the sprite are checked.
+        
+        Args:
+            name (str): Layer name
+            sprite (arcade.Sprite): Sprite to test, usually the player
+            
+        Returns:
+            list: Colliding sprites
+        """
+        
+        # Cheap bitmap test first, most frames touch nothing
+        bounds = (sprite.left, sprite.bottom, sprite.right, sprite.top)
+        if not self.occupied(name, *bounds):
+            return []
+        
+        return [
+            other for other in self.sprites_in(name, *bounds)
+            if arcade.check_for_collision(sprite, other)
+        ]
+
+
+class FlowField:
+    """
+    Distance map from the player's cell, shared by every enemy.
+    
+    A Dijkstra search from the player's cell over the free cells of a 
+    TileGrid layer gives every cell within FLOW_RADIUS its walking 
+    distance to the player. An enemy then finds its way by stepping 
+    to the neighbour cell with the lowest distance, a constant time 
+    lookup no matter how many enemies ask. The map is only rebuilt 
+    when the player moves into another cell, and a rebuild only 
+    touches the cells around the player, so it costs the same on any
+    size of map.
+    
+    Diagonal steps are allowed, but not past the corner of a wall.
+    
+    Attributes:
+        width (int): Grid width in cells
+        height (int): Grid height in cells
+        cell_size (float): Cell size in world pixels
+        blocked (bytearray): 1 for every cell enemies cannot enter
+        distance (array): Path cost from each cell to the target, -1
+            where the target cannot be reached within the radius
+        max_cost (int): Path cost the search stops at
+        target (int): Cell the map leads to, -1 before the first 
+            update
+        rebuilds (int): Number of times the map has been rebuilt
+    """
+    
+    def __init__(self, tile_grid, layer=SOLID_GRID_LAYER):
+        """
+        Create an empty map over a grid layer.
+        
+        Args:
+            tile_grid (TileGrid): Grid to walk over
+            layer (str): Grid layer holding the walls
+        """
+        
+        self.width = tile_grid.width
+        self.height = tile_grid.height
+        self.cell_size = tile_grid.cell_size
+        self.blocked = bytearray(
+            tile_grid.occupancy.get(layer, bytes(self.width * self.height))
+        )
+        self.distance = array("i", [-1]) * (self.width * self.height)
+        self.max_cost = FLOW_STRAIGHT_COST * math.ceil(
+            FLOW_RADIUS / self.cell_size
+        )
+        self.target = -1
+        self.rebuilds = 0
+        self._neighbours = self._build_neighbours()
+        self._reached = []
+
+    def _build_neighbours(self):
+        """
+        List the (cell, cost) steps out of every free cell once.
+        
+        Returns:
+            list: Per cell, a tuple of (neighbour, cost) pairs
+        """
+        
+        width, height, blocked = self.width, self.height, self.blocked
+        straight = ((1, 0), (-1, 0), (0, 1), (0, -1))
+        diagonal = ((1, 1), (1, -1), (-1, 1), (-1, -1))
+        
+        neighbours = []
+        for row in range(height):
+            for column in range(width):
+                steps = []
+                if not blocked[row * width + column]:
+                    for dx, dy in straight:
+                        x, y = column + dx, row + dy
+                        if 0 <= x < width and 0 <= y < height and \
+                                not blocked[y * width + x]:
+                            steps.append((y * width + x, 
+                                          FLOW_STRAIGHT_COST))
+                    for dx, dy in diagonal:
+                        x, y = column + dx, row + dy
+                        if 0 <= x < width and 0 <= y < height and \
+                                not blocked[y * width + x] and \
+                                not blocked[row * width + x] and \
+                                not blocked[y * width + column]:
+                            steps.append((y * width + x, 
+                                          FLOW_DIAGONAL_COST))
+                neighbours.append(tuple(steps))
+                
+        return neighbours
+
+    def cell_at(self, x, y):
+        """Return the cell under a world position, clamped to the map."""
+        
+        column = min(max(int(x // self.cell_size), 0), self.width - 1)
+        row = min(max(int(y // self.cell_size), 0), self.height - 1)
+        
+        return row * self.width + column
+
+    def update(self, x, y):
+        """
+        Point the map at a world position.
+        
+        Args:
+            x, y (float): Target position, usually the player
+            
+        Returns:
+            bool: True if the map was rebuilt
+        """
+        
+        target = self.cell_at(x, y)
+        if target == self.target:
+            return False
+        
+        self.target = target
+        self.rebuilds += 1
+        
+        distance = self.distance
+        neighbours = self._neighbours
+        blocked = self.blocked
+        max_cost = self.max_cost
+        
+        # Only clear the cells the last search reached
+        for cell in self._reached:
+            distance[cell] = -1
+        reached = self._reached = []
+        
+        # The player's hit box can overlap a wall cell, so the search 
+        # also starts from the free cells around a blocked target
+        queue = [(0, target)]
+        if blocked[target]:
+            queue = self._free_cells_around(target)
+        for _, cell in queue:
+            distance[cell] = 0
+            reached.append(cell)
+        
+        while queue:
+            cost, cell = heapq.heappop(queue)
+            if cost > distance[cell]:
+                continue
+            for neighbour, step in neighbours[cell]:
+                new_cost = cost + step
+                if new_cost > max_cost:
+                    continue
+                old_cost = distance[neighbour]
+                if old_cost < 0:
+                    reached.append(neighbour)
+                elif new_cost >= old_cost:
+                    continue
+                distance[neighbour] = new_cost
+                heapq.heappush(queue, (new_cost, neighbour))
+        
+        return True
+
+    def _free_cells_around(self, cell):
+        """Return (0, cell) entries for the free cells next to a cell."""
+        
+        row, column = divmod(cell, self.width)
+        free = []
+        for near_row in range(max(row - 1, 0), min(row + 2, self.height)):
+            for near_column in range(max(column - 1, 0), 
+                                     min(column + 2, self.width)):
+                neighbour = near_row * self.width + near_column
+                if not self.blocked[neighbour]:
+                    free.append((0, neighbour))
+                    
+        return free
+
+    def next_cell(self, x, y):
+        """
+        Find where to walk next from a world position.
+        
+        Args:
+            x, y (float): Current position
+            
+        Returns:
+            tuple: World centre of the next cell on the way to the 
+            target, or None when already in the target cell or the 
+            target cannot be reached
+        """
+        
+        cell = self.cell_at(x, y)
+        if cell == self.target:
+            return None
+        
+        distance = self.distance
+        best_cost = distance[cell]
+        best = -1
+        
+        # Standing in a wall cell (e.g. brushing past a corner) still 
+        # leads back to the nearest free neighbour
+        if best_cost < 0 or self.blocked[cell]:
+            best_cost = None
+            row, column = divmod(cell, self.width)
+            for near_row in range(max(row - 1, 0), 
+                                  min(row + 2, self.height)):
+                for near_column in range(max(column - 1, 0), 
+                                         min(column + 2, self.width)):
+                    neighbour = near_row * self.width + near_column
+                    cost = distance[neighbour]
+                    if cost >= 0 and (best_cost is None or 
+                                      cost < best_cost):
+                        best_cost, best = cost, neighbour
+        else:
+            for neighbour, _ in self._neighbours[cell]:
+                cost = distance[neighbour]
+                if 0 <= cost < best_cost:
+                    best_cost, best = cost, neighbour
+                    
+        if best < 0:
+            return None
+        
+        row, column = divmod(best, self.width)
         
-        dir_name = os.path.dirname(os.path.abspath(__file__))
-        character_path = os.path.join(dir_name, "knight_character",\
-            "knight")
+        return ((column + 0.5) * self.cell_size, 
+                (row + 0.5) * self.cell_size)
 
-        # Initialize texture dictionaries
-        self.idle_textures = {
-            DIRECTION_UP: [], DIRECTION_DOWN: [], 
-            DIRECTION_RIGHT: [], DIRECTION_LEFT: []
-        }
-        self.walk_textures = {
-            DIRECTION_UP: [], DIRECTION_DOWN: [], 
-            DIRECTION_RIGHT: [], DIRECTION_LEFT: []
-        }
-        self.dash_textures = {
-            DIRECTION_UP: [], DIRECTION_DOWN: [], 
-            DIRECTION_RIGHT: [], DIRECTION_LEFT: []
-        }
-        self.death_textures = {
-            DIRECTION_UP: [], DIRECTION_DOWN: [], 
-            DIRECTION_RIGHT: [], DIRECTION_LEFT: []
-        }
-        self.hurt_textures = {
-            DIRECTION_UP: [], DIRECTION_DOWN: [], 
-            DIRECTION_RIGHT: [], DIRECTION_LEFT: []
-        }
-        self.heal_textures = {
-            DIRECTION_RIGHT: [], DIRECTION_LEFT: [],
-            DIRECTION_UP: [], DIRECTION_DOWN: []
-        }
 
-        # Load healing textures (12 frames)
-        for i in range(HEAL_FRAMES):
-            self.heal_textures[DIRECTION_RIGHT].append(
-                arcade.load_texture(f"{character_path}_right_heal{i}.png")
-            )
-            self.heal_textures[DIRECTION_LEFT].append(
-                arcade.load_texture(f"{character_path}_left_heal{i}.png")
-            )
-            self.heal_textures[DIRECTION_UP].append(
-                arcade.load_texture(f"{character_path}_up_heal{i}.png")
-            )
-            self.heal_textures[DIRECTION_DOWN].append(
-                arcade.load_texture(f"{character_path}_down_heal{i}.png")
-            )
+def _split_list(value):
+    """Split a comma separated property value into stripped items."""
+    
+    return [item.strip() for item in str(value).split(",") if item.strip()]
 
-        # Load 7 frame animations (idle, walk, dash, death)
-        for i in range(IDLE_WALK_RUN_DEATH_FRAMES):
-            
-            # Idle animations
-            self.idle_textures[DIRECTION_RIGHT].append(
-                arcade.load_texture(f"{character_path}_right_idle{i}.png")
-            )
-            self.idle_textures[DIRECTION_LEFT].append(
-                arcade.load_texture(f"{character_path}_left_idle{i}.png")
-            )
-            self.idle_textures[DIRECTION_UP].append(
-                arcade.load_texture(f"{character_path}_up_idle{i}.png")
-            )
-            self.idle_textures[DIRECTION_DOWN].append(
-                arcade.load_texture(f"{character_path}_down_idle{i}.png")
-            )
-            
-            # Walk animations
-            self.walk_textures[DIRECTION_RIGHT].append(
-                arcade.load_texture(f"{character_path}_right_run{i}.png")
-            )
-            self.walk_textures[DIRECTION_LEFT].append(
-                arcade.load_texture(f"{character_path}_left_run{i}.png")
-            )
-            self.walk_textures[DIRECTION_UP].append(
-                arcade.load_texture(f"{character_path}_up_run{i}.png")
-            )
-            self.walk_textures[DIRECTION_DOWN].append(
-                arcade.load_texture(f"{character_path}_down_run{i}.png")
-            )
-            
-            # Dash animations
-            self.dash_textures[DIRECTION_RIGHT].append(
-                arcade.load_texture(f"{character_path}_right_dash{i}.png")
-            )
-            self.dash_textures[DIRECTION_LEFT].append(
-                arcade.load_texture(f"{character_path}_left_dash{i}.png")
-            )
-            self.dash_textures[DIRECTION_UP].append(
-                arcade.load_texture(f"{character_path}_up_dash{i}.png")
-            )
-            self.dash_textures[DIRECTION_DOWN].append(
-                arcade.load_texture(f"{character_path}_down_dash{i}.png")
-            )
+
+class TrapPhaseTable:
+    """
+    Phase cycle of one kind of trap, read from layer properties.
+    
+    Every trap layer loops through named phases of fixed length. 
+    Entering a phase can show or hide the traps and play a sound, and
+    some phases hurt the player. See TRAP_DEFAULTS for the property 
+    format.
+    
+    Attributes:
+        names (tuple): Phase names in cycle order
+        durations (tuple): Length of each phase in seconds
+        damaging (tuple): Whether each phase hurts the player
+        show_on_enter (tuple): True/False to show/hide traps on 
+            entering each phase, None to leave them as they are
+        sounds (tuple): Sound attribute played on entering each 
+            phase, or None
+        start (int): Phase index the cycle starts in
+        cycle (float): Length of the whole cycle in seconds
+        offset (float): Seconds the layer's cycle starts ahead by
+        hurt_sound (str): Sound attribute played when a trap hurts
+    """
+    
+    def __init__(self, properties):
+        """
+        Parse a layer's trap properties.
+        
+        Args:
+            properties (dict): Trap properties of the layer
             
-            # Death animations
-            self.death_textures[DIRECTION_RIGHT].append(
-                arcade.load_texture(f"{character_path}_right_death{i}.png")
-            )
-            self.death_textures[DIRECTION_LEFT].append(
-                arcade.load_texture(f"{character_path}_left_death{i}.png")
-            )
-            self.death_textures[DIRECTION_UP].append(
-                arcade.load_texture(f"{character_path}_up_death{i}.png")
-            )
-            self.death_textures[DIRECTION_DOWN].append(
-                arcade.load_texture(f"{character_path}_down_death{i}.png")
-            )
+        Raises:
+            ValueError: If the phase table is missing or malformed
+        """
         
-        # Load hurt animations (4 frames)
-        for i in range(4):
-            self.hurt_textures[DIRECTION_RIGHT].append(
-                arcade.load_texture(f"{character_path}_right_hurt{i}.png")
-            )
-            self.hurt_textures[DIRECTION_LEFT].append(
-                arcade.load_texture(f"{character_path}_left_hurt{i}.png")
+        phases = [item.split() for item in 
+                  _split_list(properties.get("trap_phases", ""))]
+        if not phases or any(len(phase) != 2 for phase in phases):
+            raise ValueError(
+                f"Bad trap_phases {properties.get('trap_phases')!r}"
             )
-            self.hurt_textures[DIRECTION_UP].append(
-                arcade.load_texture(f"{character_path}_up_hurt{i}.png")
-            )
-            self.hurt_textures[DIRECTION_DOWN].append(
-                arcade.load_texture(f"{character_path}_down_hurt{i}.png")
+        
+        self.names = tuple(name for name, _ in phases)
+        self.durations = tuple(float(duration) for _, duration in phases)
+        
+        # A phase that takes no time would never let the cycle advance
+        if not all(math.isfinite(duration) and duration > 0 
+                   for duration in self.durations):
+            raise ValueError(
+                f"Trap phase durations must be positive in "
+                f"{properties.get('trap_phases')!r}"
             )
+        
+        damaging = set(_split_list(properties.get("trap_damage", "")))
+        self.damaging = tuple(name in damaging for name in self.names)
+        
+        show = set(_split_list(properties.get("trap_show_on", "")))
+        hide = set(_split_list(properties.get("trap_hide_on", "")))
+        self.show_on_enter = tuple(
+            True if name in show else False if name in hide else None
+            for name in self.names
+        )
+        
+        sounds = dict(
+            item.split() for item in 
+            _split_list(properties.get("trap_sounds", ""))
+        )
+        self.sounds = tuple(sounds.get(name) for name in self.names)
+        
+        self.start = self.names.index(
+            properties.get("trap_start", self.names[0])
+        )
+        self.cycle = sum(self.durations)
+        self.offset = float(properties.get("trap_offset", 0.0))
+        self.hurt_sound = properties.get("trap_hurt_sound")
+        
+        # Sounds are looked up as game attributes, so only allow the 
+        # sound effects the game loads
+        for sound in (*sounds.values(), self.hurt_sound):
+            if sound is not None and sound not in SOUND_EFFECTS:
+                raise ValueError(f"Unknown trap sound {sound!r}")
 
-    def character_animation(self, delta_time: float = 1 / 60):
+    def locate(self, offset):
         """
-        Update character animation based on current state.
+        Find where the cycle is a given time after it starts.
         
         Args:
-            delta_time (float): Time since last update
+            offset (float): Seconds since the cycle started
+            
+        Returns:
+            tuple: (phase index, seconds left in that phase)
         """
         
-        # Handle death animation
-        if self.is_dead:
-            self._handle_death_animation()
-            return
-        
-        # Update cooldowns
-        if self.heal_cooldown > 0:
-            self.heal_cooldown -= delta_time
+        phase = self.start
+        remaining = offset % self.cycle if self.cycle > 0 else 0.0
         
-        # Handle healing animation
-        if self.is_healing:
-            self._handle_healing_animation()
-            return
+        while remaining >= self.durations[phase]:
+            remaining -= self.durations[phase]
+            phase = (phase + 1) % len(self.names)
             
-        # Handle hurt animation
-        if self.is_hurt:
-            self._handle_hurt_animation()
-            return
+        return phase, self.durations[phase] - remaining
 
-        # Update facing direction based on movement
-        self._update_facing_direction()
 
-        # Update dash cooldown
-        if self.dash_cooldown > 0:
-            self.dash_cooldown -= delta_time
-
-        # Handle dash animation
-        if self.is_dashing:
-            self._handle_dash_animation()
-            return
-
-        # Handle regular movement animations
-        self._handle_standard_animation()
+class TrapGroup:
+    """
+    Traps of one layer that share a timer.
+    
+    Attributes:
+        layer (str): Layer the traps belong to
+        table (TrapPhaseTable): Phase cycle of the layer
+        sprite_list (arcade.SpriteList): The group's traps, shown and
+            hidden as a whole
+        layer_visible (bool): Whether the layer is drawn at all
+        phase (int): Index of the current phase
+        next_change (float): Scheduler time the phase ends at
+        changed_on (int): Scheduler update the phase last changed on
+        index (int): Position of the group in TrapScheduler.groups
+    """
+    
+    __slots__ = (
+        "layer", "table", "sprite_list", "layer_visible", "phase", 
+        "next_change", "changed_on", "index"
+    )
+    
+    def __init__(self, layer, table, offset, sprite_list, index):
+        """
+        Create a group part way into its cycle.
         
-    def _handle_drink_animation(self):
+        Args:
+            layer (str): Layer the traps belong to
+            table (TrapPhaseTable): Phase cycle of the layer
+            offset (float): Seconds the group's cycle starts ahead by
+            sprite_list (arcade.SpriteList): The group's traps
+            index (int): Position of the group in the scheduler
         """
-        Play the speed-flask drinking animation to completion.
+        
+        self.index = index
+        self.layer = layer
+        self.table = table
+        self.sprite_list = sprite_list
+        self.layer_visible = sprite_list.visible
+        self.phase, self.next_change = table.locate(offset)
+        self.changed_on = -1
 
-        While drinking:
-        - Blocks all other animations and inputs
-        - Uses the same frame sequence as healing for consistency
 
-        State transition:
-        - When elapsed >= drink_duration, clear is_drinking and reset 
-        texture
+class TrapScheduler:
+    """
+    Wake trap groups only when their phase is due to change.
+    
+    Trap layers are the ones named in TRAP_DEFAULTS plus any layer 
+    with a trap_phases property, and layer properties override the 
+    defaults. Tiles can set trap_group to time their traps apart from
+    the rest of the layer and trap_offset to shift that group's cycle.
+    
+    Groups wait in a priority queue ordered by the time their phase 
+    ends, so an update costs one comparison plus the transitions that
+    are due, however many traps the level has. Each group's traps 
+    share a sprite list, so showing or hiding them is a single flag.
+    
+    Attributes:
+        time (float): Seconds the scheduler has advanced
+        updates (int): Number of updates run
+        groups (list): Every TrapGroup of the level
+        layers (dict): Layer name -> (TrapPhaseTable, groups)
+        group_of (dict): Trap sprite -> its TrapGroup
+        changed (list): Groups that changed phase in the last update
+        phase_changes (int): Phase changes made since the start
+    """
+    
+    def __init__(self):
+        """Start with no traps."""
+        
+        self.time = 0.0
+        self.updates = 0
+        self.changed = []
+        self.phase_changes = 0
+        self.groups = []
+        self.layers = {}
+        self.group_of = {}
+        self._queue = []
+        self._damaging_groups = {}
+
+    @classmethod
+    def from_level(cls, level_data):
         """
+        Build the trap groups of a loaded level.
         
-        elapsed = time.time() - self.drink_start_time
+        Args:
+            level_data (LevelData): The loaded level
+            
+        Returns:
+            TrapScheduler: Scheduler holding the level's traps
+        """
         
-        if elapsed >= self.drink_duration:
-            self.is_drinking = False
-            self.cur_texture = 0
-            return
+        scheduler = cls()
+        for name, sprites in level_data.sprite_lists.items():
+            properties = dict(TRAP_DEFAULTS.get(name, {}))
+            properties.update(level_data.layer_properties.get(name) or {})
+            if "trap_phases" in properties:
+                scheduler.add_layer(
+                    name, TrapPhaseTable(properties), sprites
+                )
+                
+        return scheduler
 
-        frames = self.heal_textures[self.facing_direction]
-        idx = min(int(elapsed / self.drink_duration * len(frames)), \
-            len(frames) - 1)
+    def add_layer(self, name, table, sprite_list):
+        """
+        Group a layer's traps by their trap_group tile property.
+        
+        A layer that is all one group keeps its own sprite list, 
+        otherwise each group gets a new list. See install().
+        
+        Args:
+            name (str): Layer name
+            table (TrapPhaseTable): Phase cycle of the layer
+            sprite_list (arcade.SpriteList): Trap sprites in the layer
+        """
         
-        self.texture = frames[idx]
+        members = OrderedDict()
+        for sprite in sprite_list:
+            key = (sprite.properties or {}).get("trap_group", "")
+            members.setdefault(key, []).append(sprite)
+        
+        groups = []
+        for key, sprites in members.items():
+            if len(members) == 1:
+                group_list = sprite_list
+            else:
+                group_list = arcade.SpriteList()
+                group_list.extend(sprites)
+                group_list.visible = sprite_list.visible
+            
+            offset = table.offset + float(
+                (sprites[0].properties or {}).get("trap_offset", 0.0)
+            )
+            group = TrapGroup(
+                name, table, offset, group_list, len(self.groups)
+            )
+            groups.append(group)
+            
+            for sprite in sprites:
+                self.group_of[sprite] = group
+            heapq.heappush(
+                self._queue, (group.next_change, group.index, group)
+            )
+            self.groups.append(group)
         
-    def _handle_death_animation(self):
+        self.layers[name] = (table, groups)
+        self._damaging_groups[name] = sum(
+            table.damaging[group.phase] for group in groups
+        )
+
+    def install(self, scene):
         """
-        Manage death animation sequence.
+        Draw split layers through their group sprite lists.
+        
+        Each split layer is swapped in the scene for one sprite list 
+        per group, named "<layer>:<index>", so the groups can be shown
+        and hidden separately.
         
-        This method will:
-        1. Initializes death timing on first call
-        2. Calculates elapsed time since death started
-        3. Determines current animation frame based on progress
-        4. Sets final frame and marks death completion
+        Args:
+            scene (arcade.Scene): Scene holding the trap layers
         """
         
-        # Initialize death timing if first frame of death animation
-        if not hasattr(self, 'death_start_time'):
-            self.death_start_time = time.time()
-            self.death_completed = False
+        for name, (table, groups) in self.layers.items():
+            if len(groups) < 2 or name not in scene:
+                continue
+            
+            previous = name
+            for index, group in enumerate(groups):
+                group_name = f"{name}:{index}"
+                scene.add_sprite_list_after(
+                    group_name, previous, sprite_list=group.sprite_list
+                )
+                previous = group_name
+            scene.remove_sprite_list_by_name(name)
+
+    def update(self, delta_time):
+        """
+        Advance time and change phase for the groups that are due.
         
-        # Calculate animation progress from 0.0 to 1.0
-        elapsed = time.time() - self.death_start_time
-        death_duration = 1.0  # Total time for death animation
+        Args:
+            delta_time (float): Time since last update
+            
+        Returns:
+            list: Sound attributes to play for phases entered, each 
+            listed once
+        """
         
-        # Get number of frames in death animation for current direction
-        death_frames = len(self.death_textures[self.facing_direction])
+        # Allow for rounding in the summed steps so phases end on 
+        # the update they are due
+        self.time += delta_time
+        self.updates += 1
+        now = self.time + TRAP_TIME_EPSILON
         
-        if elapsed < death_duration:
+        queue = self._queue
+        changed = self.changed = []
+        sounds = []
+        passes = {}
+        deferred = []
+        while queue and queue[0][0] <= now:
+            entry = heapq.heappop(queue)
+            _, order, group = entry
             
-            # Calculate current frame based on progress through 
-            # animation
-            frame = min(
-                int(elapsed / death_duration * death_frames), 
-                death_frames - 1
-            )
+            # Advance a group at most one whole cycle per update, the 
+            # rest is caught up on the next ones
+            table = group.table
+            passes[order] = passes.get(order, 0) + 1
+            if passes[order] > len(table.names):
+                deferred.append(entry)
+                continue
             
-            # Set texture to current death animation frame
-            self.texture = self.death_textures[self.facing_direction]\
-                [frame]
+            damaging = table.damaging
+            self._damaging_groups[group.layer] -= damaging[group.phase]
+            group.phase = (group.phase + 1) % len(table.names)
+            self._damaging_groups[group.layer] += damaging[group.phase]
+            group.next_change += table.durations[group.phase]
+            group.changed_on = self.updates
+            changed.append(group)
             
-        else:
+            show = table.show_on_enter[group.phase]
+            if show is not None:
+                group.sprite_list.visible = show and group.layer_visible
             
-            # Animation complete - show final frame
-            frame = death_frames - 1
-            self.texture = self.death_textures[self.facing_direction]\
-                [frame]
+            sound = table.sounds[group.phase]
+            if sound is not None and sound not in sounds:
+                sounds.append(sound)
             
-            # Mark death as completed if not already done
-            if not self.death_completed:
-                self.death_completed = True
-                self.death_complete_time = time.time()
+            heapq.heappush(queue, (group.next_change, order, group))
+        
+        for entry in deferred:
+            heapq.heappush(queue, entry)
+        self.phase_changes += len(changed)
+                
+        return sounds
 
-    def _handle_healing_animation(self):
+    def is_damaging(self, group):
         """
-        Manage healing animation sequence.
+        Check whether a group hurts the player during this update.
         
-        This method:
-        1. Calculates elapsed time since healing started
-        2. Ends animation when duration is reached
-        3. Determines current frame based on progress
-        4. Updates character texture
+        Groups do no damage on the update they change phase.
+        
+        Args:
+            group (TrapGroup): Group to check
+            
+        Returns:
+            bool: True if the group's traps currently do damage
+        """
+        
+        return (group.table.damaging[group.phase] 
+                and group.changed_on != self.updates)
+
+    def layer_damaging(self, name):
         """
+        Check whether any group of a layer is in a damaging phase.
         
-        # Calculate time since healing started
-        elapsed = time.time() - self.heal_start_time
+        Kept as a running count, so this does not visit the groups. 
+        Groups that only just entered the phase are filtered out by 
+        damaging_sprites.
         
-        # Check if healing animation duration has completed
-        if elapsed >= self.heal_duration:
-            
-            # Reset animation state
-            self.is_healing = False
-            self.cur_texture = 0
-            
-        else:
+        Args:
+            name (str): Layer name
             
-            # Calculate current animation frame
-            num_frames = len(self.heal_textures[self.facing_direction])
-            frame = min(
-                int(elapsed / self.heal_duration * num_frames),
-                num_frames - 1
-            )
+        Returns:
+            bool: True if the layer may currently hurt the player
+        """
+        
+        return self._damaging_groups[name] > 0
+
+    def damaging_sprites(self, sprites):
+        """
+        Keep the traps whose group hurts during this update.
+        
+        Args:
+            sprites (list): Trap sprites, e.g. ones touching the player
             
-            # Update to current healing frame
-            self.texture = self.heal_textures[self.facing_direction][frame]
+        Returns:
+            list: The sprites that currently do damage
+        """
+        
+        return [
+            sprite for sprite in sprites 
+            if self.is_damaging(self.group_of[sprite])
+        ]
+
 
-    def _handle_hurt_animation(self):
+class HazardIndex:
+    """
+    Vectorized trap hit tests over every hazard of a level.
+    
+    Needs NumPy. The hit box bounds of all trap sprites are kept in 
+    one contiguous array per side along with the index of each trap's
+    group, and a per-group flag tracks which groups are damaging. 
+    hits() tests any number of actors against all hazards in one 
+    array operation and only runs the exact polygon check on the 
+    overlaps it finds.
+    
+    Attributes:
+        sprites (list): Trap sprites, in array order
+        left, bottom, right, top (numpy.ndarray): Hit box bounds of 
+            each hazard
+        group_index (numpy.ndarray): Group index of each hazard
+        active (numpy.ndarray): Whether each group is in a damaging 
+            phase
+    """
+    
+    def __init__(self, scheduler):
         """
-        Manage hurt animation sequence.
+        Index the traps of a scheduler.
         
-        This method:
-        1. Calculates elapsed time since damage taken
-        2. Ends animation when duration is reached
-        3. Determines current frame based on progress
-        4. Updates character texture
+        Args:
+            scheduler (TrapScheduler): Scheduler holding the traps
         """
         
-        # Calculate time since hurt started
-        elapsed = time.time() - self.hurt_start_time
+        self.scheduler = scheduler
+        self.sprites = list(scheduler.group_of)
         
-        # Check if hurt animation duration has completed
-        if elapsed >= self.hurt_duration:
-            
-            # Reset animation state
-            self.is_hurt = False
-            self.cur_texture = 0
+        bounds = np.array(
+            [(sprite.left, sprite.bottom, sprite.right, sprite.top) 
+             for sprite in self.sprites],
+            dtype=np.float64
+        ).reshape(-1, 4)
+        self.left, self.bottom, self.right, self.top = (
+            np.ascontiguousarray(column) for column in bounds.T
+        )
+        self.group_index = np.array(
+            [scheduler.group_of[sprite].index for sprite in self.sprites],
+            dtype=np.int32
+        )
+        self.active = np.array(
+            [group.table.damaging[group.phase] 
+             for group in scheduler.groups], 
+            dtype=bool
+        )
+        self._hazard_active = self.active[self.group_index]
+        self._seen_changes = scheduler.phase_changes
+
+    def _sync(self):
+        """Read every group's phase again if any has changed since."""
+        
+        scheduler = self.scheduler
+        if self._seen_changes == scheduler.phase_changes:
+            return
+        
+        # Phases also change on updates where no trap was tested, so 
+        # rebuild from the groups rather than from the last changes
+        groups = scheduler.groups
+        self.active = np.fromiter(
+            (group.table.damaging[group.phase] for group in groups),
+            dtype=bool, count=len(groups)
+        )
+        self._hazard_active = self.active[self.group_index]
+        self._seen_changes = scheduler.phase_changes
+
+    def hits(self, actors):
+        """
+        Find the damaging traps touching each actor.
+        
+        Groups that changed phase on this update do no damage, as with
+        TrapScheduler.is_damaging.
+        
+        Args:
+            actors (list): Sprites to test, e.g. [player]
             
+        Returns:
+            list: For each actor, the damaging trap sprites it touches
+        """
+        
+        self._sync()
+        if not len(self.sprites):
+            return [[] for _ in actors]
+        
+        hazard_active = self._hazard_active
+        if self.scheduler.changed:
+            active = self.active.copy()
+            active[[group.index for group in self.scheduler.changed]] = \
+                False
+            hazard_active = active[self.group_index]
+        
+        if len(actors) == 1:
+            # A lone actor compares as plain floats, which saves 
+            # building its bounds array on every update
+            actor = actors[0]
+            left, bottom = actor.left, actor.bottom
+            right, top = actor.right, actor.top
+            rows = repeat(0)
+            indices = np.flatnonzero(
+                (left <= self.right) & (right >= self.left)
+                & (bottom <= self.top) & (top >= self.bottom)
+                & hazard_active
+            )
         else:
+            # One column per side, one row per actor
+            left, bottom, right, top = np.array(
+                [(actor.left, actor.bottom, actor.right, actor.top) 
+                 for actor in actors],
+                dtype=np.float64
+            ).reshape(-1, 4, 1).transpose(1, 0, 2)
             
-            # Calculate current animation frame
-            num_frames = len(self.hurt_textures[self.facing_direction])
-            frame = min(
-                int(elapsed / self.hurt_duration * num_frames),
-                num_frames - 1
+            # Overlap of every actor box with every active hazard box
+            rows, indices = np.nonzero(
+                (left <= self.right) & (right >= self.left)
+                & (bottom <= self.top) & (top >= self.bottom)
+                & hazard_active
             )
+        
+        results = [[] for _ in actors]
+        for row, index in zip(rows, indices):
+            sprite = self.sprites[index]
+            if arcade.check_for_collision(actors[row], sprite):
+                results[row].append(sprite)
             
-            # Update to current hurt frame
-            self.texture = self.hurt_textures[self.facing_direction][frame]
+        return results
 
-    def _update_facing_direction(self):
+
+class LevelPreloader:
+    """
+    Prepare upcoming levels on a background thread.
+    
+    Reading the compiled level, decoding textures and creating sprites
+    all happen on the worker, so switching levels on the main thread 
+    only has to build the sprite lists.
+    """
+    
+    def __init__(self):
+        """Start with no levels being prepared."""
+        
+        self._executor = ThreadPoolExecutor(
+            max_workers=1, thread_name_prefix="level-preload"
+        )
+        self._pending = {}
+
+    def request(self, map_path, streamed=None):
         """
-        Update character's facing direction based on movement.
+        Start preparing a level unless it is already underway.
         
-        This method:
-        1. Determines primary movement direction
-        2. Sets both direction and facing_direction properties
-        Note: Facing direction takes precedence over movement direction
-        for animations when not moving.
+        Args:
+            map_path (str): Path of the .tmx file
+            streamed (bool): Passed on to prepare_level()
         """
         
-        # Vertical movement takes precedence
-        if self.change_y > 0:
-            self.direction = DIRECTION_UP
-            self.facing_direction = DIRECTION_UP
-            
-        elif self.change_y < 0:
-            self.direction = DIRECTION_DOWN
-            self.facing_direction = DIRECTION_DOWN
-            
-        # Horizontal movement
-        elif self.change_x < 0:
-            self.direction = DIRECTION_LEFT
-            self.facing_direction = DIRECTION_LEFT
+        if map_path not in self._pending:
+            self._pending[map_path] = self._executor.submit(
+                prepare_level, map_path, streamed
+            )
+
+    def take(self, map_path):
+        """
+        Hand over a preloaded level, waiting for it if still running.
+        
+        Each prepared level can only be taken once since its sprites 
+        end up in the game's scene.
+        
+        Args:
+            map_path (str): Path of the .tmx file
             
-        elif self.change_x > 0:
-            self.direction = DIRECTION_RIGHT
-            self.facing_direction = DIRECTION_RIGHT
+        Returns:
+            PreparedLevel: The level, or None when it was never 
+            requested or failed to load
+        """
+        
+        future = self._pending.pop(map_path, None)
+        if future is None:
+            return None
+        
+        try:
+            return future.result()
+        except Exception:
+            # Fall back to a normal synchronous load
+            return None
+
+    def shutdown(self):
+        """Stop the worker thread, dropping queued requests."""
+        
+        self._executor.shutdown(wait=False, cancel_futures=True)
+        self._pending.clear()
+
 
-    def _handle_dash_animation(self):
+class InputRecorder:
+    """
+    Record key events against the game tick they happened before.
+    
+    Attributes:
+        path (str): File the recording is saved to
+        events (list): (tick, key, pressed) tuples in order
+    """
+    
+    def __init__(self, path):
         """
-        Manage dash animation sequence.
+        Start an empty recording.
         
-        This method:
-        1. Advances animation frame counter
-        2. Checks for dash completion conditions
-        3. Resets state when dash ends
-        4. Updates texture to current dash frame
+        Args:
+            path (str): File the recording is saved to
         """
         
-        # Advance animation counter
-        self.cur_texture += 1
+        self.path = path
+        self.events = []
+
+    def record(self, tick, key, pressed):
+        """
+        Add one key event.
         
-        # Calculate total frames in dash animation
-        dash_frames = len(self.dash_textures[self.facing_direction])\
-            * UPDATES_PER_FRAME
+        Args:
+            tick (int): Number of steps run before the event
+            key (int): Keycode of the key
+            pressed (bool): True for a press, False for a release
+        """
         
-        # Check dash completion conditions:
-        # - Time-based expiration
-        # - Animation cycle completion
+        self.events.append((tick, key, pressed))
+
+    def save(self):
+        """Write the recording to its file."""
         
-        current_time = time.time()
-        dash_time_expired = current_time - self.dash_start_time\
-            >= self.dash_duration
-        animation_complete = self.cur_texture >= dash_frames
+        event = struct.Struct(INPUT_RECORD_EVENT)
+        with open(self.path, "wb") as f:
+            f.write(struct.pack(
+                INPUT_RECORD_HEADER, INPUT_RECORD_MAGIC, 
+                INPUT_RECORD_VERSION
+            ))
+            for tick, key, pressed in self.events:
+                f.write(event.pack(tick, key, pressed))
+
+
+def load_input_recording(path):
+    """
+    Read the key events of a recorded session.
+    
+    Args:
+        path (str): File written by InputRecorder.save
         
-        if dash_time_expired or animation_complete:
-            
-            # End dash state
-            self.is_dashing = False
-            self.cur_texture = 0
-            self.change_x = 0
-            self.change_y = 0
-            
-        else:
-            
-            # Calculate current animation frame
-            frame = min(
-                self.cur_texture // UPDATES_PER_FRAME,
-                len(self.dash_textures[self.facing_direction]) - 1
-            )
-            
-            # Update to current dash frame
-            self.texture = self.dash_textures[self.facing_direction][frame]
+    Returns:
+        list: (tick, key, pressed) tuples in order
+        
+    Raises:
+        ValueError: If the file is not a recording this version reads
+    """
+    
+    with open(path, "rb") as f:
+        data = f.read()
+    
+    header_size = struct.calcsize(INPUT_RECORD_HEADER)
+    if len(data) < header_size:
+        raise ValueError(f"{path} is too short to be an input recording")
+    
+    magic, version = struct.unpack_from(INPUT_RECORD_HEADER, data)
+    if magic != INPUT_RECORD_MAGIC or version != INPUT_RECORD_VERSION:
+        raise ValueError(f"{path} is not a version "
+                         f"{INPUT_RECORD_VERSION} input recording")
+    
+    if (len(data) - header_size) % struct.calcsize(INPUT_RECORD_EVENT):
+        raise ValueError(f"{path} ends partway through a key event")
+    
+    return [
+        (tick, key, bool(pressed))
+        for tick, key, pressed in struct.iter_unpack(
+            INPUT_RECORD_EVENT, data[header_size:]
+        )
+    ]
 
-    def _handle_standard_animation(self):
+
+class InputReplay:
+    """
+    Feed recorded key events back into a game tick by tick.
+    
+    Passed as the on_tick callback of HeadlessGame.run, it calls the 
+    game's own key handlers so the replay takes the same paths as the
+    original session.
+    
+    Attributes:
+        events (list): (tick, key, pressed) tuples in order
+        position (int): Index of the next event to replay
+    """
+    
+    def __init__(self, events):
         """
-        Manage standard idle and walking animations.
+        Prepare to replay a recording from the start.
         
-        This method:
-        1. Advances animation frame counter
-        2. Resets counter when animation cycle completes
-        3. Selects appropriate animation set (idle or walk)
-        4. Updates character texture
+        Args:
+            events (list): (tick, key, pressed) tuples in order
         """
         
-        # Advance animation counter
-        self.cur_texture += 1
-        
-        # Calculate maximum frames in animation cycle
-        max_frame = 7 * UPDATES_PER_FRAME
-        
-        # Handle idle animation (no movement)
-        if self.change_x == 0 and self.change_y == 0:
-            # Reset counter when animation cycle completes
-            if self.cur_texture >= max_frame:
-                self.cur_texture = 0
-            
-            # Convert counter to frame index
-            frame = self.cur_texture // UPDATES_PER_FRAME
-            # Set idle texture for current direction
-            self.texture = self.idle_textures[self.direction][frame]
+        self.events = events
+        self.position = 0
+
+    @property
+    def last_tick(self):
+        """
+        Get the tick of the final recorded event.
         
-        # Handle walking animation
-        else:
-            # Reset counter when animation cycle completes
-            if self.cur_texture >= max_frame:
-                self.cur_texture = 0
-            
-            # Convert counter to frame index
-            frame = self.cur_texture // UPDATES_PER_FRAME
-            # Set walking texture for current direction
-            self.texture = self.walk_textures[self.direction][frame]
-    
-    def heal(self):
+        Returns:
+            int: Tick number, or 0 for an empty recording
         """
-        Start the healing animation and apply health restoration.
+        
+        return self.events[-1][0] if self.events else 0
 
-        Conditions for starting:
-        - Player is alive (not self.is_dead)
-        - Not currently in hurt, dash, another heal, or drinking state
+    def __call__(self, game):
         """
+        Replay every event recorded for the game's current tick.
         
-        # Only allow healing when fully idle
-        if not (self.is_dead or self.is_hurt or self.is_dashing
-                or self.is_healing or self.is_drinking):
-            
-            self.is_healing = True
-            self.heal_start_time = time.time()
-            self.hurt_count = max(0, self.hurt_count - self.heal_amount)
-
-    def drink_speed(self):
+        Args:
+            game (GameLogic): Game about to run its next step
         """
-        Start the speed-flask drinking animation and grant speed boost.
+        
+        while (self.position < len(self.events) 
+               and self.events[self.position][0] <= game.tick):
+            _, key, pressed = self.events[self.position]
+            if pressed:
+                game.on_key_press(key, 0)
+            else:
+                game.on_key_release(key, 0)
+            self.position += 1
 
-        Conditions for starting:
-        - Player is alive
-        - Not currently in hurt, dash, healing, or another drinking 
-        state
-        """
+
+def percentile(sorted_values, percent):
+    """
+    Pick the nearest-rank percentile of already sorted values.
+    
+    Args:
+        sorted_values (list): Values in ascending order
+        percent (float): Percentile from 0 to 100
         
-        if not (self.is_dead or self.is_hurt or self.is_dashing
-                or self.is_healing or self.is_drinking):
-            
-            self.is_drinking = True
-            self.drink_start_time = time.time()
-            self.apply_speed_boost()
+    Returns:
+        float: The percentile value, or 0.0 when there are no values
+    """
+    
+    if not sorted_values:
+        return 0.0
+    
+    # The smallest value with at least percent% of values at or below
+    rank = math.ceil(percent / 100 * len(sorted_values))
+    return sorted_values[min(max(0, rank - 1), len(sorted_values) - 1)]
 
-    def dash(self):
+
+class FrameProfiler:
+    """
+    Time the phases of each frame while profiling is enabled.
+    
+    A frame's phases are timed back to back: start() begins timing 
+    and each mark(phase) closes the phase that just ran. A phase that
+    runs more than once in a frame, e.g. over several fixed steps, is
+    added up. end_frame() files the frame away.
+    
+    Attributes:
+        enabled (bool): Whether timings are being taken
+        recent (deque): Latest frames, used for rolling percentiles
+        frames (deque): Frames kept for export
+        phases (list): Phase names in the order first seen
+    """
+    
+    def __init__(self, window=PROFILER_WINDOW, history=PROFILER_HISTORY):
         """
-        Initiate dash ability if possible.
+        Start with profiling disabled.
         
-        Conditions:
-        - Player not dead
-        - Not currently dashing
-        - Dash cooldown expired
+        Args:
+            window (int): Frames used for the rolling percentiles
+            history (int): Frames kept for export
         """
         
-        if (not self.is_dead and not self.is_dashing 
-            and self.dash_cooldown <= 0):
-                
-            self.is_dashing = True
-            self.dash_cooldown = self.dash_cooldown_time
-            self.cur_texture = 0
-            self.dash_start_time = time.time()
-            self.is_hurt = False
-            self.cur_texture = 0
+        self._enabled = False
+        self.recent = deque(maxlen=window)
+        self.frames = deque(maxlen=history)
+        self.phases = []
+        self._current = {}
+        self._last = 0.0
 
-            # Set dash vector based on facing direction
-            if self.facing_direction == DIRECTION_RIGHT:
-                self.change_x = self.dash_speed
-                self.change_y = 0
-                
-            elif self.facing_direction == DIRECTION_LEFT:
-                self.change_x = -self.dash_speed
-                self.change_y = 0
-                
-            elif self.facing_direction == DIRECTION_UP:
-                self.change_x = 0
-                
-                self.change_y = self.dash_speed
-            elif self.facing_direction == DIRECTION_DOWN:
-                self.change_x = 0
-                
-                self.change_y = -self.dash_speed
+    @property
+    def enabled(self):
+        """bool: Whether timings are being taken."""
+        
+        return self._enabled
 
-            # Play dash sound if available
-            if hasattr(self, "dash_sound"):
-                self.dash_sound.play()
+    @enabled.setter
+    def enabled(self, enabled):
+        # A frame cut short by toggling must not leak into the next one
+        if enabled != self._enabled:
+            self._current = {}
+            self._last = time.perf_counter()
+        self._enabled = enabled
 
-    def hurt(self, damage_amount=1):
+    def start(self):
+        """Begin timing the next phase from now."""
+        
+        if self.enabled:
+            self._last = time.perf_counter()
+
+    def mark(self, phase):
         """
-        Apply damage to player if conditions met.
+        Charge the time since the last mark to a phase.
         
         Args:
-            damage_amount (int): Amount of damage to apply
-            
-        Returns:
-            bool: True if damage was applied, False otherwise
+            phase (str): Name of the phase that just finished
         """
         
-        current_time = time.time()
-        invincible_period = current_time - self.last_hurt_time <= \
-            self.invincibility_duration
+        if not self.enabled:
+            return
         
-        if self.is_hurt:
-            self.is_healing = False
-            self.is_drinking = False
+        now = time.perf_counter()
+        elapsed = (now - self._last) * 1000
+        self._last = now
         
-        if (not self.is_dead and not self.is_hurt 
-            and not self.is_dashing and not self.is_healing 
-            and not invincible_period
-            and not self.invincible):
-            
-            # Set hurt state
-            self.is_hurt = True
-            self.hurt_start_time = current_time
-            self.last_hurt_time = current_time
-            self.hurt_count += damage_amount
-            self.change_x = 0
-            self.change_y = 0
-            
-            # Apply knockback based on facing direction
-            knockback = 20
-            if self.facing_direction == DIRECTION_RIGHT:
-                self.center_x -= knockback
-            elif self.facing_direction == DIRECTION_LEFT:
-                self.center_x += knockback
-            elif self.facing_direction == DIRECTION_UP:
-                self.center_y -= knockback
-            elif self.facing_direction == DIRECTION_DOWN:
-                self.center_y += knockback
-                
-            # Check for death
-            if self.hurt_count >= self.max_hits_before_death:
-                self.die()
-            
-            # Damage applied
-            return True
+        if phase in self._current:
+            self._current[phase] += elapsed
+        else:
+            self._current[phase] = elapsed
+            if phase not in self.phases:
+                self.phases.append(phase)
+
+    def end_frame(self):
+        """Record the phases timed since the previous frame."""
         
-        # No damage applied
-        return False
-                
-    def die(self):
-        """Set player to death state."""
+        if not self.enabled or not self._current:
+            return
         
-        self.is_dead = True
-        self.death_start_time = time.time()
-        self.change_x = 0
-        self.change_y = 0
-        self.is_dashing = False
-        self.cur_texture = 0
-        self.texture = self.death_textures[self.facing_direction][0]
+        self._current["total"] = sum(self._current.values())
+        self.recent.append(self._current)
+        self.frames.append(self._current)
+        self._current = {}
 
-    def apply_speed_boost(self):
-        """Apply speed boost effect to player."""
+    def percentiles(self):
+        """
+        Get the rolling p50 and p99 of every phase.
         
-        if not self.is_dead:
-            self.is_speed_boosted = True
-            self.speed_boost_start_time = time.time()
+        Returns:
+            dict: Phase name -> (p50, p99) in milliseconds, with the 
+            frame total last
+        """
+        
+        stats = {}
+        for phase in self.phases + ["total"]:
+            values = sorted(
+                frame.get(phase, 0.0) for frame in self.recent
+            )
+            stats[phase] = (percentile(values, 50), percentile(values, 99))
+        
+        return stats
 
-    def update_speed_boost(self):
-        """Update speed boost duration and expiration."""
+    def export(self, path):
+        """
+        Write every kept frame to a CSV or JSON file.
         
-        if self.is_speed_boosted:
-            elapsed = time.time() - self.speed_boost_start_time
-            if elapsed >= self.speed_boost_duration:
-                self.is_speed_boosted = False
+        The format follows the file extension; anything other than 
+        .json is written as CSV with one row per frame.
+        
+        Args:
+            path (str): Output file
+        """
+        
+        columns = self.phases + ["total"]
+        
+        if path.endswith(".json"):
+            with open(path, "w") as f:
+                json.dump({
+                    "phases": columns,
+                    "frames": [
+                        [frame.get(phase, 0.0) for phase in columns]
+                        for frame in self.frames
+                    ]
+                }, f)
+            return
+        
+        with open(path, "w", newline="") as f:
+            writer = csv.writer(f)
+            writer.writerow(["frame"] + columns)
+            for index, frame in enumerate(self.frames):
+                writer.writerow(
+                    [index] 
+                    + [f"{frame.get(phase, 0.0):.4f}" for phase in columns]
+                )
 
 
-class Game(arcade.Window):
+class GameLogic:
     """
-    Main game class managing game state, levels, and rendering.
+    Game state, levels and rules without a window or audio device.
+    
+    Everything that happens in on_update lives here so the game can be
+    simulated headlessly; Game adds the window, camera, HUD and sound
+    on top.
     
     Attributes:
         current_level (int): Current level number
@@ -693,28 +4449,56 @@ class Game(arcade.Window):
         physics_engine: Physics system
         Various sprite lists for game objects
         Sound effects and music
+        audio (AudioManager): Loads the sounds, None when silent
+        game_over (bool): Set once the player has died or finished
+        tick (int): Number of fixed steps run so far
+        input_recorder (InputRecorder): Records key events when set
+        profiler (FrameProfiler): Per-phase frame timings
     """
     
-    def __init__(self):
-        """Initialize game window and resources."""
+    def __init__(self, input_recorder=None, profile_path=None, 
+                 stream_budget=None):
+        """
+        Initialize game state and load the first level.
+        
+        Args:
+            input_recorder (InputRecorder): Records the session's key 
+                events, if given
+            profile_path (str): Profile every frame and export the 
+                timings here at the end, if given
+            stream_budget (int): Stream every level's chunks within 
+                this many bytes of sprite and GPU data, if given. 
+                Otherwise only large maps are streamed, within 
+                STREAM_RESIDENCY_BUDGET
+        """
         
-        super().__init__(SCREEN_WIDTH, SCREEN_HEIGHT, SCREEN_TITLE)
-        arcade.set_background_color(arcade.color.BLACK)
-
         # Game state
         self.current_level = 1
         self.keys_collected = 0
+        self.game_over = False
+
+        # Simulated time, stepped in fixed increments
+        self.clock = GameClock()
+        self.accumulator = 0.0
+        self.tick = 0
+        self.previous_player_position = None
 
         # Scene and physics
         self.scene = None
         self.player = None
         self.physics_engine = None
-
-        # Camera system
-        self.camera = arcade.Camera2D()
+        
+        # Next level is prepared in the background
+        self.level_preloader = LevelPreloader()
 
         # Input handling
         self.held_keys = set()
+        self.input_recorder = input_recorder
+
+        # Frame timings, on from the start when they will be exported
+        self.profiler = FrameProfiler()
+        self.profile_path = profile_path
+        self.profiler.enabled = profile_path is not None
 
         # Sprite lists
         self.peak_list = arcade.SpriteList()
@@ -726,46 +4510,50 @@ class Game(arcade.Window):
         self.keys_list = arcade.SpriteList()
         self.tunnel_door_list = arcade.SpriteList()
 
-        # UI elements
-        self.health_label = arcade.Text(
-            "", 0, 0, arcade.color.WHITE, 12, 
-            anchor_x="center", anchor_y="center"
-        )
-        self.key_label = arcade.Text(
-            "", 0, 0, arcade.color.GOLD, 12,
-            anchor_x="center", anchor_y="center"
-        )
-
         # Load sound effects
         self._load_sounds()
 
-        # Trap system timers
-        self.peak_timer = 0.0
-        self.peak_state = "wait" # States: "wait", "active", "cooldown"
-        self.arrow_timer = 0.0
-        self.arrow_state = "wait" # States: "short", "wait", "long"
-        self.flame_timer = 0.0
-        self.flame_state = "wait" # States: "short", "wait", "long"
+        # Trap timing and hit testing, rebuilt for every level
+        self.trap_scheduler = None
+        self.hazard_index = None
+        
+        # Static layers drawn chunk by chunk, rebuilt for every level
+        self.chunked_layers = []
+        
+        # Chunks of large levels are loaded around the camera
+        self.stream_budget = stream_budget
+        self.chunk_streamer = None
+        
+        # Enemies of the current level and their paths to the player
+        self.enemies = None
+        self.flow_field = None
 
         # Initialize game
         self.setup()
 
     def _load_sounds(self):
-        """Load all game sound effects."""
-        
-        self.heal_sound = arcade.Sound("music_and_sound/heal.wav")
-        self.key_sound = arcade.Sound("music_and_sound/key.wav")
-        self.speed_sound = arcade.Sound("music_and_sound/speed.wav")
-        self.dash = arcade.Sound("music_and_sound/dash.wav")
-        self.hurt_peak = arcade.Sound("music_and_sound/hurt_peak.mp3")
-        self.hurt_arrow = arcade.Sound("music_and_sound/hurt_arrow.mp3")
-        self.peak = arcade.Sound("music_and_sound/peak.mp3")
-        self.arrow = arcade.Sound("music_and_sound/arrow.mp3")
-        self.flamethrower = arcade.Sound("music_and_sound/flamethrower.mp3")
-        self.background_music = arcade.Sound\
-            ("music_and_sound/background_music.mp3")
-        self.level_complete = arcade.Sound\
-            ("music_and_sound/level_complete.wav")
+        """Start loading all game sound effects in the background."""
+        
+        self.audio = AudioManager()
+        self.heal_sound = self.audio.effect("music_and_sound/heal.wav")
+        self.key_sound = self.audio.effect("music_and_sound/key.wav")
+        self.speed_sound = self.audio.effect("music_and_sound/speed.wav")
+        self.dash = self.audio.effect("music_and_sound/dash.wav")
+        self.hurt_peak = self.audio.effect("music_and_sound/hurt_peak.mp3")
+        self.hurt_arrow = self.audio.effect(
+            "music_and_sound/hurt_arrow.mp3"
+        )
+        self.peak = self.audio.effect("music_and_sound/peak.mp3")
+        self.arrow = self.audio.effect("music_and_sound/arrow.mp3")
+        self.flamethrower = self.audio.effect(
+            "music_and_sound/flamethrower.mp3"
+        )
+        self.background_music = self.audio.music(
+            "music_and_sound/background_music.mp3"
+        )
+        self.level_complete = self.audio.effect(
+            "music_and_sound/level_complete.wav"
+        )
         self.background_music_player = None
 
     def setup(self):
@@ -784,56 +4572,82 @@ class Game(arcade.Window):
         # Reset keys for new level
         self.keys_collected = 0
         
-        # Reset trap timers
-        self.peak_timer = 0.0
-        self.peak_state = "wait"
-        self.arrow_timer = 0.0
-        self.arrow_state = "wait"
-        self.flame_timer = 0.0
-        self.flame_state = "wait"
-        
         # Build map path
-        map_path = os.path.join(
-            os.path.dirname(__file__),
-            f"Level_{level_number}.tmx"
-        )
+        map_path = self._level_map_path(level_number)
 
         # Configure tilemap layers
         layer_options = {
             "Foreground Fake Walls": {},
-            "Walls": {"use_spatial_hash": True},
-            "Collision Items": {"use_spatial_hash": True},
-            "Boundary Walls": {"use_spatial_hash": True},
-            "Non Collision Items": {},
+            "Walls": {"use_spatial_hash": True, "chunked": True},
+            "Collision Items": {"use_spatial_hash": True, "chunked": True},
+            "Boundary Walls": {"use_spatial_hash": True, "chunked": True},
+            "Non Collision Items": {"chunked": True},
             "Peaks": {},
             "Arrow": {},
-            "Slow Speed Items": {},
+            "Slow Speed Items": {"chunked": True},
             "Small Health Flasks": {},
             "Small Speed Flasks": {},
             "Keys": {},
             "Walls On Top of Boundary": {},
             "Tunnel Door": {},
             "Flamethrower": {},
-            "Background": {},
-            "Floor": {},
+            "Background": {"chunked": True},
+            "Floor": {"chunked": True},
             "Tunnel": {}
         }
         
-        # Load tilemap
-        tilemap = arcade.load_tilemap(
-            map_path,
-            scaling=TILE_SCALING,
-            layer_options=layer_options
-        )
+        # Use the preloaded level when there is one, otherwise load 
+        # it from its compiled cache now
+        streamed = True if self.stream_budget else None
+        prepared_level = self.level_preloader.take(map_path)
+        if prepared_level is None:
+            prepared_level = prepare_level(map_path, streamed)
+        level_data = prepared_level.build(layer_options)
+        
+        # Stream the level's chunks in around the camera if it is 
+        # too large to load whole
+        if self.chunk_streamer is not None:
+            self.chunk_streamer.shutdown()
+        self.chunk_streamer = None
+        if prepared_level.streamed:
+            self.chunk_streamer = ChunkStreamer(
+                prepared_level, level_data.sprite_lists,
+                self.stream_budget or STREAM_RESIDENCY_BUDGET
+            )
         
         # Initialize scene
-        self.scene = arcade.Scene.from_tilemap(tilemap)
+        self.scene = arcade.Scene.from_tilemap(level_data)
         
         # Handle foreground layers
-        self._process_foreground_layers(tilemap)
+        self._process_foreground_layers(level_data)
+        
+        # Static layers the camera culls while drawing
+        self.chunked_layers = [
+            sprite_list for sprite_list in level_data.sprite_lists.values()
+            if isinstance(sprite_list, ChunkedSpriteList)
+        ] + [self.foreground_layers]
         
         # Initialize game objects
-        self._initialize_game_objects(tilemap)
+        self._initialize_game_objects(level_data)
+        
+        # Time every trap group from the start of its cycle
+        self.trap_scheduler = TrapScheduler.from_level(level_data)
+        self.trap_scheduler.install(self.scene)
+        
+        # Test hazards in bulk when NumPy is available
+        self.hazard_index = (
+            HazardIndex(self.trap_scheduler) if np is not None else None
+        )
+        
+        # Index walls, hazards, pickups and any extra trap layers by 
+        # tile
+        self.tile_grid = TileGrid.from_level(
+            level_data, 
+            GRID_LAYERS + tuple(
+                name for name in self.trap_scheduler.layers 
+                if name not in GRID_LAYERS
+            )
+        )
         
         # Initialize player
         self._initialize_player(level_number)
@@ -841,74 +4655,122 @@ class Game(arcade.Window):
         # Set up physics engine
         self._setup_physics()
         
-        # Initialize camera
-        self.camera = arcade.Camera2D()
-
+        # Spawn enemies, which walk against all walls at once
+        self.tile_grid.add_layer(SOLID_GRID_LAYER, self.static_collision)
+        self.enemies = EnemySwarm.from_level(level_data)
+        self.scene.add_sprite_list_before(
+            "Enemies", "Player", sprite_list=self.enemies.sprite_list
+        )
+        
+        # Paths to the player are only worked out once there are 
+        # enemies to follow them
+        self.flow_field = None
+        
+        # Nothing to interpolate from after moving to a new level
+        self.previous_player_position = self.player.position
+        
         # Play background music
         self._play_background_music()
+        
+        # Start preparing the next level while this one is played
+        if level_number < MAX_LEVEL:
+            self.level_preloader.request(
+                self._level_map_path(level_number + 1), streamed
+            )
 
-    def _process_foreground_layers(self, tilemap):
-        """Process foreground layers for proper rendering."""
+    def _level_map_path(self, level_number):
+        """Return the .tmx path for a level number."""
         
-        # Extract foreground layers
-        foreground_fake_walls = tilemap.sprite_lists.get(
-            "Foreground Fake Walls", arcade.SpriteList()
-        )
-        walls_on_top = tilemap.sprite_lists.get(
-            "Walls On Top of Boundary", arcade.SpriteList()
+        return os.path.join(
+            os.path.dirname(__file__),
+            f"Level_{level_number}.tmx"
         )
 
-        # Combine into single sprite list
-        self.foreground_layers = arcade.SpriteList()
-        self.foreground_layers.extend(foreground_fake_walls)
-        self.foreground_layers.extend(walls_on_top)
+    def _process_foreground_layers(self, level_data):
+        """Process foreground layers for proper rendering."""
+        
+        # Combine foreground layers into single sprite list, drawn by chunk
+        self.foreground_layers = ChunkedSpriteList(
+            [
+                sprite
+                for name in FOREGROUND_LAYERS
+                for sprite in level_data.sprite_lists.get(name, ())
+            ],
+            CHUNK_SIZE_TILES * level_data.tile_width * TILE_SCALING
+        )
         
         # Remove from main scene to prevent double rendering
-        self.scene.remove_sprite_list_by_name("Foreground Fake Walls")
-        self.scene.remove_sprite_list_by_name("Walls On Top of Boundary")
+        for name in FOREGROUND_LAYERS:
+            self.scene.remove_sprite_list_by_name(name)
+
+    def set_layer_visible(self, name, visible):
+        """
+        Show or hide a whole scene layer.
+        
+        Only the layer's sprite list flag changes, which the scene 
+        checks once per draw, so no sprite or buffer is touched. Calls 
+        that would not change anything return straight away.
+        
+        Args:
+            name (str): Scene layer name
+            visible (bool): Whether the layer is drawn
+            
+        Returns:
+            bool: Whether the visibility changed
+        """
+        
+        if name not in self.scene:
+            return False
+        
+        sprite_list = self.scene[name]
+        if sprite_list.visible == visible:
+            return False
+        
+        sprite_list.visible = visible
+        return True
 
-    def _initialize_game_objects(self, tilemap):
-        """Initialize game objects from tilemap."""
+    def _initialize_game_objects(self, level_data):
+        """Initialize game objects from the loaded level."""
         
         # Peaks (damage traps)
-        self.peak_list = tilemap.sprite_lists.get(
+        self.peak_list = level_data.sprite_lists.get(
             "Peaks", arcade.SpriteList()
         )
         for peak in self.peak_list:
-            peak.properties = {"damage": True, "damage_amount": 1}
+            peak.properties.update({"damage": True, "damage_amount": 1})
 
         # Arrows (damage traps)
-        self.arrow_list = tilemap.sprite_lists.get(
+        self.arrow_list = level_data.sprite_lists.get(
             "Arrow", arcade.SpriteList()
         )
         for arrow in self.arrow_list:
-            arrow.properties = {"damage": True, "damage_amount": 1}
+            arrow.properties.update({"damage": True, "damage_amount": 1})
 
         # Flamethrowers (damage traps)
-        self.flamethrower_list = tilemap.sprite_lists.get(
+        self.flamethrower_list = level_data.sprite_lists.get(
             "Flamethrower", arcade.SpriteList()
         )
         for flame in self.flamethrower_list:
-            flame.properties = {"damage": True, "damage_amount": 1}
+            flame.properties.update({"damage": True, "damage_amount": 1})
 
-        # Other objects inside of the tilemap
-        self.slow_list = tilemap.sprite_lists.get(
+        # Other objects inside of the level
+        self.slow_list = level_data.sprite_lists.get(
             "Slow Speed Items", arcade.SpriteList()
         )
         
-        self.flask_list = tilemap.sprite_lists.get(
+        self.flask_list = level_data.sprite_lists.get(
             "Small Health Flasks", arcade.SpriteList()
         )
         
-        self.speed_flask_list = tilemap.sprite_lists.get(
+        self.speed_flask_list = level_data.sprite_lists.get(
             "Small Speed Flasks", arcade.SpriteList()
         )
         
-        self.keys_list = tilemap.sprite_lists.get(
+        self.keys_list = level_data.sprite_lists.get(
             "Keys", arcade.SpriteList()
         )
         
-        self.tunnel_door_list = tilemap.sprite_lists.get(
+        self.tunnel_door_list = level_data.sprite_lists.get(
             "Tunnel Door", arcade.SpriteList()
         )
         
@@ -922,15 +4784,12 @@ class Game(arcade.Window):
             and not self.player.is_dead 
             and self.keys_collected >= KEY_COUNT
             and "Tunnel" in self.scene
-            and arcade.check_for_collision_with_list(
-                self.player, self.scene["Tunnel"]
-            )):
-            for tunnel in self.scene["Tunnel"]:
-                tunnel.visible = False
+            and self.tile_grid.collisions("Tunnel", self.player)):
+            self.set_layer_visible("Tunnel", False)
 
         # Create new player if needed
         if not hasattr(self, 'player') or self.player is None:
-            self.player = PlayerCharacter()
+            self.player = PlayerCharacter(self.clock)
             self.player.center_x = 1700
             self.player.center_y = 350
             self.player.dash_sound = self.dash
@@ -940,7 +4799,7 @@ class Game(arcade.Window):
             self.player.is_dead = False
             self.player.is_hurt = False
             self.player.is_dashing = False
-            self.player.cur_texture = 0
+            self.player.restart_animation()
             self.player.change_x = 0
             self.player.change_y = 0
 
@@ -963,16 +4822,17 @@ class Game(arcade.Window):
     def _setup_physics(self):
         """Set up physics engine for collision detection."""
         
-        # Combine collision layers
-        collision_layers = arcade.SpriteList()
-        collision_layers.extend(self.scene["Walls"])
-        collision_layers.extend(self.scene["Collision Items"])
-        collision_layers.extend(self.scene["Boundary Walls"])
+        # Combine collision layers into one spatially hashed list
+        self.static_collision = build_static_collision([
+            self.scene["Walls"],
+            self.scene["Collision Items"],
+            self.scene["Boundary Walls"]
+        ])
 
         # Create physics engine
         self.physics_engine = arcade.PhysicsEngineSimple(
             self.player, 
-            collision_layers
+            self.static_collision
         )
 
     def _play_background_music(self):
@@ -983,102 +4843,115 @@ class Game(arcade.Window):
             not self.background_music_player.playing
         )
         if should_play:
-            self.background_music_player = self.background_music.play\
-                (loop=True)
-
-    def draw_health_bar(self):
-        """Draw player health bar above character."""
-        
-        # Calculate bar position
-        bar_left = self.player.center_x - HEALTHBAR_WIDTH / 2
-        bar_bottom = (
-            self.player.center_y + 
-            HEALTHBAR_OFFSET_Y - 
-            HEALTHBAR_HEIGHT / 2
-        )
-
-        # Draw background (red)
-        arcade.draw_lbwh_rectangle_filled(
-            bar_left,
-            bar_bottom,
-            HEALTHBAR_WIDTH,
-            HEALTHBAR_HEIGHT,
-            arcade.color.RED
-        )
-
-        # Calculate health width
-        health_percent = 1 - (
-            self.player.hurt_count / 
-            self.player.max_hits_before_death
-        )
-        
-        health_width = HEALTHBAR_WIDTH * health_percent
+            self.background_music_player = self.background_music.play()
             
-        # Draw health (green)
-        arcade.draw_lbwh_rectangle_filled(
-            bar_left,
-            bar_bottom,
-            health_width,
-            HEALTHBAR_HEIGHT,
-            arcade.color.GREEN
-        )
+            # arcade cannot loop a streamed sound, so start the track 
+            # again each time it ends
+            if self.background_music_player is not None:
+                self.background_music_player.push_handlers(
+                    on_player_eos=self._play_background_music
+                )
 
-        # Position and draw health text
-        self.health_label.x = self.player.center_x
-        self.health_label.y = self.player.center_y + HEALTHBAR_OFFSET_Y
-        self.health_label.draw()
-    
-    def draw_key_count(self):
-        """Draw key count UI element."""
+    def on_update(self, delta_time):
+        """
+        Run as many fixed steps as the elapsed time covers.
+        
+        Leftover time carries over to the next frame. After a long 
+        stall only MAX_STEPS_PER_FRAME steps are caught up, so a frame
+        spike slows the game down briefly instead of skipping ahead 
+        past hits and invincibility windows.
+        
+        Args:
+            delta_time (float): Time since last update
+        """
         
-        self.key_label.text = f"Keys: {self.keys_collected}/{self.total_keys}"
-        self.key_label.x = self.player.center_x
-        self.key_label.y = self.player.center_y + HEALTHBAR_OFFSET_Y + 20
-        self.key_label.draw()
+        self.accumulator += delta_time
+        
+        steps = 0
+        while (self.accumulator >= FIXED_TIMESTEP 
+               and steps < MAX_STEPS_PER_FRAME 
+               and not self.game_over):
+            self.fixed_update(FIXED_TIMESTEP)
+            self.accumulator -= FIXED_TIMESTEP
+            steps += 1
+        
+        # Drop any backlog the step limit did not get through
+        if self.accumulator >= FIXED_TIMESTEP:
+            self.accumulator %= FIXED_TIMESTEP
 
-    def on_draw(self):
-        """Render the game scene."""
+    @property
+    def interpolation_alpha(self):
+        """
+        Fraction of a step the accumulator holds beyond the last one.
         
-        self.clear()
-        self.camera.use()
-        self.scene.draw()
-        self.foreground_layers.draw()
-        self.draw_health_bar()
-        self.draw_key_count()
+        Returns:
+            float: Value from 0.0 to 1.0 used to blend rendering 
+            between the previous and current step
+        """
+        
+        return self.accumulator / FIXED_TIMESTEP
 
-    def on_update(self, delta_time):
-        """Update game state each frame.
+    def fixed_update(self, delta_time):
+        """Advance the game by one fixed step.
         
         Args:
-            delta_time (float): Time since last update
+            delta_time (float): Length of the step in seconds
         """
         
+        # Remember where the player was for render interpolation
+        self.previous_player_position = self.player.position
+        self.clock.advance(delta_time)
+        self.tick += 1
+        
+        profiler = self.profiler
+        profiler.start()
+        
         # Handle player movement input
         self._handle_player_movement()
+        profiler.mark("update.movement")
         
         # Update physics and animations
         self.physics_engine.update()
-        self.scene.update_animation(delta_time)
+        profiler.mark("update.physics")
+        self.update_scene_animation(delta_time)
+        profiler.mark("update.scene_animation")
         self.player.character_animation(delta_time)
         self.player.update_speed_boost()
+        profiler.mark("update.character_animation")
         
         # Update trap systems
-        self.update_peak_system(delta_time)
-        self.update_arrow_system(delta_time)
-        self.update_flame_system(delta_time)
+        self.update_trap_systems(delta_time)
+        profiler.mark("update.traps")
+        
+        # Update enemies
+        self.update_player_attack()
+        profiler.mark("update.attack")
+        
+        self.update_enemies(delta_time)
+        profiler.mark("update.enemies")
 
         # Handle key collection
         self._handle_key_collection()
+        profiler.mark("update.keys")
         
         # Handle death state
         self._handle_death()
+        profiler.mark("update.death")
         
         # Handle level progression
         self._handle_level_progression()
+        profiler.mark("update.progression")
         
-        # Update camera position
-        self.camera.position = self.player.position
+    def update_scene_animation(self, delta_time):
+        """
+        Advance animated tiles in the scene.
+        
+        Args:
+            delta_time (float): Time since last update
+        """
         
+        self.scene.update_animation(delta_time)
+
     def _handle_player_movement(self):
         """Process player movement based on input."""
         
@@ -1090,7 +4963,9 @@ class Game(arcade.Window):
         elif (
             not self.player.is_dashing and 
             not self.player.is_healing and
-            not self.player.is_hurt
+            not self.player.is_drinking and
+            not self.player.is_hurt and
+            not self.player.is_attacking
         ):
             # Reset movement
             self.player.change_x = 0
@@ -1106,9 +4981,7 @@ class Game(arcade.Window):
                 self.player.dash_speed = PLAYER_SPEED_BOOST
 
             # Apply slow effect in slow zones
-            if arcade.check_for_collision_with_list(
-                self.player, self.slow_list
-            ):
+            if self.tile_grid.collisions("Slow Speed Items", self.player):
                 current_speed /= 2.0
 
             # Process movement keys
@@ -1140,13 +5013,14 @@ class Game(arcade.Window):
         if not self.player.is_dead and self.keys_list:
             
             # Check for collisions with keys
-            keys_collected = arcade.check_for_collision_with_list(
-                self.player, self.keys_list
+            keys_collected = self.tile_grid.collisions(
+                "Keys", self.player
             )
                 
             for key_sprite in keys_collected:
             
                 # Collect key
+                self.tile_grid.remove("Keys", key_sprite)
                 key_sprite.remove_from_sprite_lists()
                 self.keys_collected += 1
                 self.key_sound.play()
@@ -1159,9 +5033,8 @@ class Game(arcade.Window):
                     self.tunnel_door_list = arcade.SpriteList()
 
             # Reveal tunnel when enough keys collected
-            if self.keys_collected >= KEY_COUNT and "Tunnel" in self.scene:
-                for tunnel in self.scene["Tunnel"]:
-                    tunnel.visible = True
+            if self.keys_collected >= KEY_COUNT:
+                self.set_layer_visible("Tunnel", True)
 
     def _handle_death(self):
         """Handle player death state."""
@@ -1169,9 +5042,33 @@ class Game(arcade.Window):
         if self.player.is_dead and self.player.death_completed:
             
             # Wait 1 second after death animation completes
-            if time.time() - self.player.death_complete_time >= 1.0:
-                arcade.close_window()
-                sys.exit(0)
+            if self.clock.time() - self.player.death_complete_time >= 1.0:
+                self._end_game()
+
+    def _end_game(self):
+        """Stop the game once the player has died or finished."""
+        
+        self.game_over = True
+        self._stop_workers()
+        self._save_session()
+
+    def _stop_workers(self):
+        """Stop the level, chunk and sound loading threads."""
+        
+        self.level_preloader.shutdown()
+        if self.chunk_streamer is not None:
+            self.chunk_streamer.shutdown()
+        if self.audio is not None:
+            self.audio.shutdown()
+
+    def _save_session(self):
+        """Write out the input recording and profile, if enabled."""
+        
+        if self.input_recorder is not None:
+            self.input_recorder.save()
+        
+        if self.profile_path is not None:
+            self.profiler.export(self.profile_path)
 
     def _handle_level_progression(self):
         """Handle level progression through tunnels."""
@@ -1181,9 +5078,7 @@ class Game(arcade.Window):
             not self.player.is_dead and 
             self.keys_collected >= KEY_COUNT and 
             "Tunnel" in self.scene and 
-            arcade.check_for_collision_with_list(
-                self.player, self.scene["Tunnel"]
-            )
+            self.tile_grid.collisions("Tunnel", self.player)
         ):
             
             if self.current_level < MAX_LEVEL:
@@ -1194,12 +5089,15 @@ class Game(arcade.Window):
                 
             else:
                 # Game completed
-                arcade.close_window()
-                sys.exit()
+                self._end_game()
         
-    def update_peak_system(self, delta_time):
+    def update_trap_systems(self, delta_time):
         """
-        Update peak trap activation cycle.
+        Advance every trap group and apply trap damage.
+        
+        Traps stop where they are once the player has died. A group
+        only does damage on updates where it stays in a damaging 
+        phase, not on the update it changes phase.
         
         Args:
             delta_time (float): Time since last update
@@ -1207,165 +5105,96 @@ class Game(arcade.Window):
         
         if self.player.is_dead:
             return
-
-        # State durations and transitions
-        durations = {
-            # Waiting period
-            "wait": 4.2,
-            
-            # Damage period
-            "active": 2.0,
-            
-            # Recovery period
-            "cooldown": 0.2
-        }
         
-        next_state = {
-            "wait": "active",
-            "active": "cooldown",
-            "cooldown": "wait"
-        }
-
-        # Update timer
-        self.peak_timer += delta_time
-
-        # Process current state
-        if self.peak_timer < durations[self.peak_state]:
+        scheduler = self.trap_scheduler
+        
+        # Play each phase entry sound once, however many groups 
+        # entered that phase
+        for sound in scheduler.update(delta_time):
+            getattr(self, sound).play()
+        
+        damaging_layers = [
+            name for name in scheduler.layers 
+            if scheduler.layer_damaging(name)
+        ]
+        if not damaging_layers:
+            return
+        
+        # Find every damaging trap under the player in one pass when 
+        # the hazard index is available
+        touching = None
+        if self.hazard_index is not None:
+            touching = self.hazard_index.hits([self.player])[0]
+        
+        # Damage from traps the player is standing in
+        for name in damaging_layers:
+            table = scheduler.layers[name][0]
             
-            # Damage during active phase
-            if (self.peak_state == "active" and 
-                arcade.check_for_collision_with_list(
-                    self.player, self.peak_list)
-                ):
-                
-                if self.player.hurt():
-                    self.hurt_peak.play()
-                    
-        else:
+            if touching is None:
+                traps = scheduler.damaging_sprites(
+                    self.tile_grid.collisions(name, self.player)
+                )
+            else:
+                traps = [
+                    trap for trap in touching 
+                    if scheduler.group_of[trap].layer == name
+                ]
+            if not traps:
+                continue
             
-            # Transition to next state
-            self.peak_timer -= durations[self.peak_state]
-            self.peak_state = next_state[self.peak_state]
+            damage = traps[0].properties.get("damage_amount", 1)
+            if self.player.hurt(damage) and table.hurt_sound:
+                getattr(self, table.hurt_sound).play()
 
-            # Handle state-specific actions
-            if self.peak_state == "active":
-                
-                # Activate peaks
-                for p in self.peak_list:
-                    p.visible = True
-                self.peak.play()
-                
-                
-            elif self.peak_state == "cooldown":
-                # Deactivate peaks
-                for p in self.peak_list:
-                    p.visible = False
-                    
-    def update_arrow_system(self, delta_time):
+    def update_player_attack(self):
         """
-        Update arrow trap activation cycle.
+        Apply the player's blow to whatever is under it.
         
-        Args:
-            delta_time (float): Time since last update
+        Enemies are found through the swarm's spatial hash and 
+        destructibles through the tile grid, so the cost follows what
+        is near the blow rather than what is on screen.
         """
         
-        # State durations and transitions
-        durations = {
-            
-            # Brief damage window
-            "short": 0.1,
-            
-            # Waiting period
-            "wait": 2.0,
-            
-            # Longer damage window
-            "long": 0.3
-        }
+        blow = self.player.attack_hit()
+        if blow is None:
+            return
         
-        next_state = {
-            "short": "wait",
-            "wait": "long",
-            "long": "short"
-        }
-
-        # Update timer
-        self.arrow_timer += delta_time
-
-        # Process current state
-        if self.arrow_timer < durations[self.arrow_state]:
-            
-            # Damage during active phases
-            if self.arrow_state in ("short", "long"):
-                
-                if arcade.check_for_collision_with_list(
-                    self.player, self.arrow_list
-                ):
-                    
-                    if self.player.hurt():
-                        self.hurt_arrow.play()
-        else:
-            
-            # Transition to next state
-            self.arrow_timer -= durations[self.arrow_state]
-            self.arrow_state = next_state[self.arrow_state]
-
-            # Play sound when entering long state
-            if self.arrow_state == "long":
-                self.arrow.play()
+        box, damage = blow
+        for index in self.enemies.in_box(*box):
+            self.enemies.hurt(index, damage)
+        
+        # The grid returns everything in the cells under the blow, so 
+        # only break what the blow actually reaches
+        left, bottom, right, top = box
+        for sprite in self.tile_grid.sprites_in(DESTRUCTIBLE_LAYER, *box):
+            if sprite.right < left or sprite.left > right or \
+                    sprite.top < bottom or sprite.bottom > top:
+                continue
+            self.tile_grid.remove(DESTRUCTIBLE_LAYER, sprite)
+            sprite.remove_from_sprite_lists()
 
-    def update_flame_system(self, delta_time):
+    def update_enemies(self, delta_time):
         """
-        Update flamethrower trap activation cycle.
+        Advance every enemy and apply the damage of their attacks.
         
         Args:
             delta_time (float): Time since last update
         """
         
-        # State durations and transitions
-        durations = {
-            # Brief flame burst
-            "short": 0.15,
-            
-            # Waiting period
-            "wait": 2.0,
-            
-            # Sustained flame
-            "long": 0.3
-        }
+        if not len(self.enemies):
+            return
         
-        next_state = {
-            "short": "wait",
-            "wait": "long",
-            "long": "short"
-        }
-
-        # Update timer
-        self.flame_timer += delta_time
-
-        # Process current state
-        if self.flame_timer < durations[self.flame_state]:
-            
-            # Damage during active phases
-            if self.flame_state in ("short", "long"):
-                
-                if arcade.check_for_collision_with_list(
-                    self.player, self.flamethrower_list
-                ):
-                    
-                    if self.player.hurt():
-                        
-                        # Reuse arrow hurt sound
-                        self.hurt_arrow.play()
-                        
-        else:
-            
-            # Transition to next state
-            self.flame_timer -= durations[self.flame_state]
-            self.flame_state = next_state[self.flame_state]
-
-            # Play sound when entering long state
-            if self.flame_state == "long":
-                self.flamethrower.play()
+        if self.flow_field is None:
+            self.flow_field = FlowField(self.tile_grid)
+        
+        # Paths only change when the player enters another cell
+        self.flow_field.update(self.player.center_x, self.player.center_y)
+        
+        damage = self.enemies.update(
+            delta_time, self.player, self.tile_grid, self.flow_field
+        )
+        if damage and self.player.hurt(damage):
+            self.hurt_arrow.play()
 
     def on_key_press(self, key, modifiers):
         """
@@ -1376,12 +5205,19 @@ class Game(arcade.Window):
             modifiers (int): Modifier keys state
         """
         
+        if self.input_recorder is not None:
+            self.input_recorder.record(self.tick, key, True)
+        
         self.held_keys.add(key)
         
         # Dash ability
         if key in (arcade.key.LSHIFT, arcade.key.RSHIFT):
             self.player.dash()
             
+        # Melee attack
+        elif key == arcade.key.SPACE:
+            self.player.attack()
+            
         # Interaction key (E)
         elif key == arcade.key.E:
             self._handle_interactions()
@@ -1391,8 +5227,8 @@ class Game(arcade.Window):
         
         # Health flask collection
         if self.flask_list:
-            flasks_nearby = arcade.check_for_collision_with_list(
-                self.player, self.flask_list
+            flasks_nearby = self.tile_grid.collisions(
+                "Small Health Flasks", self.player
             )
             
             if flasks_nearby:
@@ -1400,23 +5236,25 @@ class Game(arcade.Window):
                 self.heal_sound.play()
                 
                 for flask in flasks_nearby:
+                    self.tile_grid.remove("Small Health Flasks", flask)
                     flask.remove_from_sprite_lists()
 
         # Speed flask collection
         if self.speed_flask_list:
-            speed_flasks_nearby = arcade.check_for_collision_with_list(
-                self.player, self.speed_flask_list
+            speed_flasks_nearby = self.tile_grid.collisions(
+                "Small Speed Flasks", self.player
             )
             
             if speed_flasks_nearby:
                 self.player.apply_speed_boost()
-                self.player.is_healing = True
-                self.player.heal_start_time = time.time()
+                self.player.is_drinking = True
+                self.player.drink_start_time = self.clock.time()
                 self.player.change_x = 0
                 self.player.change_y = 0
                 self.speed_sound.play()
                 
                 for flask in speed_flasks_nearby:
+                    self.tile_grid.remove("Small Speed Flasks", flask)
                     flask.remove_from_sprite_lists()
 
     def on_key_release(self, key, modifiers):
@@ -1428,10 +5266,425 @@ class Game(arcade.Window):
             modifiers (int): Modifier keys state
         """
         
+        if self.input_recorder is not None:
+            self.input_recorder.record(self.tick, key, False)
+        
         self.held_keys.discard(key)
 
+
+class Hud:
+    """
+    Health bar and key count drawn above the player in screen space.
+    
+    The game camera keeps the player in the middle of the screen, so 
+    the HUD sits at a fixed offset from the centre and draws through 
+    its own camera. The bar is a persistent shape list rebuilt only 
+    when the health changes, and the key text is only re-laid out 
+    when the count changes.
+    
+    Attributes:
+        camera (arcade.Camera2D): Screen space camera
+        health_bar (arcade.shape_list.ShapeElementList): Bar geometry
+        health_label (arcade.Text): Health text on the bar
+        key_label (arcade.Text): Key count text above the bar
+    """
+    
+    def __init__(self):
+        """Create the HUD camera, bar and labels."""
+        
+        self.camera = arcade.Camera2D()
+        center_x, center_y = self.camera.position
+        self.bar_x = center_x
+        self.bar_y = center_y + HEALTHBAR_OFFSET_Y
+        
+        self.health_bar = arcade.shape_list.ShapeElementList()
+        self.health_label = arcade.Text(
+            "", self.bar_x, self.bar_y, arcade.color.WHITE, 12, 
+            anchor_x="center", anchor_y="center"
+        )
+        self.key_label = arcade.Text(
+            "", self.bar_x, self.bar_y + 20, arcade.color.GOLD, 12,
+            anchor_x="center", anchor_y="center"
+        )
+        
+        # Values currently shown, None until first update
+        self._health = None
+        self._keys = None
+
+    def update(self, health_percent, keys_collected, total_keys):
+        """
+        Bring the HUD up to date, rebuilding only what changed.
+        
+        Args:
+            health_percent (float): Health left, from 0 to 1
+            keys_collected (int): Keys picked up so far
+            total_keys (int): Keys in the level
+        """
+        
+        if health_percent != self._health:
+            self._health = health_percent
+            
+            # Background (red) with the health left (green) on top,
+            # both growing from the left edge of the bar
+            bar_left = self.bar_x - HEALTHBAR_WIDTH / 2
+            health_width = HEALTHBAR_WIDTH * health_percent
+            self.health_bar = arcade.shape_list.ShapeElementList()
+            self.health_bar.append(arcade.shape_list.create_rectangle_filled(
+                self.bar_x, self.bar_y, 
+                HEALTHBAR_WIDTH, HEALTHBAR_HEIGHT, arcade.color.RED
+            ))
+            if health_width > 0:
+                self.health_bar.append(
+                    arcade.shape_list.create_rectangle_filled(
+                        bar_left + health_width / 2, self.bar_y,
+                        health_width, HEALTHBAR_HEIGHT, arcade.color.GREEN
+                    )
+                )
+        
+        keys = (keys_collected, total_keys)
+        if keys != self._keys:
+            self._keys = keys
+            self.key_label.text = f"Keys: {keys_collected}/{total_keys}"
+
+    def draw(self):
+        """Draw the bar and labels through the HUD camera."""
+        
+        self.camera.use()
+        self.health_bar.draw()
+        self.health_label.draw()
+        self.key_label.draw()
+
+
+class Game(GameLogic, arcade.Window):
+    """
+    Playable game: the game logic rendered in a window with sound.
+    
+    Attributes:
+        camera (arcade.Camera2D): Camera following the player
+        hud (Hud): Health bar and key count above the player
+        show_profile (bool): Whether the profiling overlay is shown
+    """
+    
+    def __init__(self, input_recorder=None, profile_path=None, 
+                 stream_budget=None):
+        """
+        Initialize game window and resources.
+        
+        Args:
+            input_recorder (InputRecorder): Records the session's key 
+                events, if given
+            profile_path (str): Profile every frame and export the 
+                timings here at the end, if given
+            stream_budget (int): Stream every level's chunks within 
+                this many bytes of sprite and GPU data, if given
+        """
+        
+        arcade.Window.__init__(
+            self, SCREEN_WIDTH, SCREEN_HEIGHT, SCREEN_TITLE
+        )
+        arcade.set_background_color(arcade.color.BLACK)
+
+        # Camera system
+        self.camera = arcade.Camera2D()
+
+        # UI elements
+        self.hud = Hud()
+
+        # Profiling overlay, toggled with F3
+        self.show_profile = False
+        # One text per column, so numbers line up whatever the font
+        self.profile_columns = [
+            arcade.Text(
+                "", x, SCREEN_HEIGHT - 10, arcade.color.WHITE, 11,
+                width=width, multiline=True, anchor_y="top", align=align
+            )
+            for x, width, align in PROFILER_OVERLAY_COLUMNS
+        ]
+        self._profile_frames = 0
+
+        # Initialize game
+        GameLogic.__init__(
+            self, input_recorder, profile_path, stream_budget
+        )
+
+    def load_level(self, level_number):
+        """
+        Load specified game level and reset the camera.
+        
+        Args:
+            level_number (int): Level number to load
+        """
+        
+        super().load_level(level_number)
+        self.camera = arcade.Camera2D()
+
+    def draw_hud(self):
+        """Update the HUD to the player's state and draw it."""
+        
+        health_percent = 1 - (
+            self.player.hurt_count / 
+            self.player.max_hits_before_death
+        )
+        self.hud.update(health_percent, self.keys_collected, self.total_keys)
+        self.hud.draw()
+
+    def on_draw(self):
+        """Render the game scene."""
+        
+        # Draw the player part way between its last two steps
+        position = self.player.position
+        previous_x, previous_y = self.previous_player_position
+        alpha = self.interpolation_alpha
+        self.player.position = (
+            previous_x + (position[0] - previous_x) * alpha,
+            previous_y + (position[1] - previous_y) * alpha
+        )
+        self.camera.position = self.player.position
+        
+        # Only draw the static chunks the camera can see. The world 
+        # area is worked out here as Camera2D.aabb() offsets the 
+        # viewport rather than the projection
+        x, y = self.camera.position
+        projection = self.camera.projection
+        view = arcade.types.LRBT(
+            x + projection.left, x + projection.right,
+            y + projection.bottom, y + projection.top
+        )
+        for layer in self.chunked_layers:
+            layer.view = view
+        
+        profiler = self.profiler
+        profiler.start()
+        
+        # Load the chunks coming into view of a streamed level
+        if self.chunk_streamer is not None:
+            self.chunk_streamer.update(view)
+            profiler.mark("draw.stream")
+        
+        self.clear()
+        self.camera.use()
+        profiler.mark("draw.clear")
+        self.scene.draw()
+        profiler.mark("draw.scene")
+        self.foreground_layers.draw()
+        profiler.mark("draw.foreground")
+        self.draw_hud()
+        profiler.mark("draw.hud")
+        
+        # Restore the simulated position
+        self.player.position = position
+        
+        profiler.end_frame()
+        if self.show_profile:
+            self.draw_profile_overlay()
+
+    def draw_profile_overlay(self):
+        """Draw rolling phase timings in the top left of the screen."""
+        
+        # Re-lay out the text only every few frames
+        if self._profile_frames % PROFILER_OVERLAY_REFRESH == 0:
+            rows = [("phase", "p50 ms", "p99 ms")] + [
+                (phase, f"{p50:.2f}", f"{p99:.2f}")
+                for phase, (p50, p99) 
+                in self.profiler.percentiles().items()
+            ]
+            for column, cells in zip(self.profile_columns, zip(*rows)):
+                column.text = "\n".join(cells)
+        self._profile_frames += 1
+        
+        self.default_camera.use()
+        height = self.profile_columns[0].content_height
+        x, width, _ = PROFILER_OVERLAY_COLUMNS[-1]
+        arcade.draw_lbwh_rectangle_filled(
+            0, SCREEN_HEIGHT - height - 20, x + width + 10, height + 20,
+            (0, 0, 0, 180)
+        )
+        for column in self.profile_columns:
+            column.draw()
+
+    def on_key_press(self, key, modifiers):
+        """
+        Handle profiling keys, passing everything else to the game.
+        
+        F3 toggles the profiling overlay and F4 exports the frames 
+        profiled so far.
+        
+        Args:
+            key (int): Keycode of pressed key
+            modifiers (int): Modifier keys state
+        """
+        
+        if key == arcade.key.F3:
+            self.show_profile = not self.show_profile
+            self.profiler.enabled = (
+                self.show_profile or self.profile_path is not None
+            )
+            self._profile_frames = 0
+            
+        elif key == arcade.key.F4:
+            self.profiler.export(self.profile_path or PROFILER_EXPORT_PATH)
+            
+        else:
+            super().on_key_press(key, modifiers)
+
+    def on_close(self):
+        """
+        Stop the loading threads and save any recording or profile 
+        when the window is closed.
+        """
+        
+        self._stop_workers()
+        self._save_session()
+        super().on_close()
+
+    def _end_game(self):
+        """Close the window and exit once the game is over."""
+        
+        super()._end_game()
+        arcade.close_window()
+        sys.exit(0)
+
+
+class SilentSound:
+    """Stand-in for arcade.Sound that plays nothing."""
+    
+    def play(self, *args, **kwargs):
+        """Ignore the request, returning no media player."""
+        
+        return None
+
+
+class HeadlessGame(GameLogic):
+    """
+    Game logic driven by a fixed timestep with no window or audio.
+    
+    Used to simulate whole sessions as fast as the CPU allows, e.g.
+    for balance testing. Input is fed through on_key_press and 
+    on_key_release, typically from the on_tick callback of run(), 
+    such as an InputReplay of a recorded session.
+    """
+
+    def _load_sounds(self):
+        """Use silent stand-ins for every sound effect."""
+        
+        self.audio = None
+        silent = SilentSound()
+        for name in (*SOUND_EFFECTS, "background_music"):
+            setattr(self, name, silent)
+        self.background_music_player = None
+
+    def update_scene_animation(self, delta_time):
+        """
+        Skip tile animation, which only changes what is drawn.
+        
+        Args:
+            delta_time (float): Time since last update
+        """
+        
+        pass
+
+    def run(self, max_ticks, delta_time=FIXED_TIMESTEP, on_tick=None):
+        """
+        Step the game until it ends or max_ticks updates have run.
+        
+        Args:
+            max_ticks (int): Upper bound on simulated updates
+            delta_time (float): Fixed timestep for each update
+            on_tick (callable): Called as on_tick(game) before each 
+                update, e.g. to press or release keys
+            
+        Returns:
+            int: Number of updates simulated
+        """
+        
+        start_tick = self.tick
+        while not self.game_over and self.tick - start_tick < max_ticks:
+            if on_tick is not None:
+                on_tick(self)
+            self.fixed_update(delta_time)
+            self.profiler.end_frame()
+        
+        return self.tick - start_tick
+
+    def close(self):
+        """Stop the loading threads and save the session."""
+        
+        self._stop_workers()
+        self._save_session()
+
+    def summary(self):
+        """
+        Describe the state of the simulated session.
+        
+        Returns:
+            dict: Tick count, level, keys and player health
+        """
+        
+        return {
+            "ticks": self.tick,
+            "level": self.current_level,
+            "keys": self.keys_collected,
+            "hurt_count": self.player.hurt_count,
+            "dead": self.player.is_dead,
+            "game_over": self.game_over
+        }
+
+
 if __name__ == "__main__":
     """Main entry point for the game."""
     
-    window = Game()
-    arcade.run()
\ No newline at end of file
+    parser = argparse.ArgumentParser(description=SCREEN_TITLE)
+    parser.add_argument(
+        "--build-atlas", action="store_true",
+        help="rebuild the packed knight atlas and exit"
+    )
+    parser.add_argument(
+        "--headless", action="store_true",
+        help="simulate a session without a window or sound"
+    )
+    parser.add_argument(
+        "--record", metavar="PATH",
+        help="save the session's key events to PATH"
+    )
+    parser.add_argument(
+        "--replay", metavar="PATH",
+        help="replay recorded key events headlessly"
+    )
+    parser.add_argument(
+        "--profile", metavar="PATH",
+        help="export per-frame phase timings to PATH (.csv or .json)"
+    )
+    parser.add_argument(
+        "--stream-budget", metavar="MB", type=int,
+        help="stream every level's chunks around the camera, keeping "
+             "at most about MB of sprite and GPU data loaded"
+    )
+    args = parser.parse_args()
+    
+    stream_budget = (
+        args.stream_budget * 1024 * 1024 if args.stream_budget else None
+    )
+    
+    # Rebuild the packed knight atlas and exit
+    if args.build_atlas:
+        print(f"Knight atlas written to {build_knight_atlas()}")
+        sys.exit(0)
+    
+    recorder = InputRecorder(args.record) if args.record else None
+    
+    # Simulate a session without a window or sound and report on it
+    if args.headless or args.replay:
+        game = HeadlessGame(recorder, args.profile, stream_budget)
+        if args.replay:
+            game.run(
+                HEADLESS_MAX_TICKS,
+                on_tick=InputReplay(load_input_recording(args.replay))
+            )
+        else:
+            game.run(HEADLESS_MAX_TICKS)
+        game.close()
+        print(json.dumps(game.summary()))
+        sys.exit(0)
+    
+    window = Game(recorder, args.profile, stream_budget)
+    arcade.run()